@@ -76,6 +76,8 @@ CHAT_HARD_TIMEOUT_SECONDS: int = int(_getenv("CHAT_HARD_TIMEOUT_SECONDS", "60"))
 CHAT_REPAIR_TIMEOUT_SECONDS: int = int(_getenv("CHAT_REPAIR_TIMEOUT_SECONDS", "30"))
 CODEGEN_TIMEOUT_SECONDS: int = int(_getenv("CODEGEN_TIMEOUT_SECONDS", "30"))
 CLASSIFIER_TIMEOUT_SECONDS: int = int(_getenv("CLASSIFIER_TIMEOUT_SECONDS", "8"))
+# How long the `done` event waits (after persisting) for the generated conversation title
+TITLE_WAIT_SECONDS: float = float(_getenv("TITLE_WAIT_SECONDS", "3"))
 MAX_FASTPATH_ROWS: int = int(_getenv("MAX_FASTPATH_ROWS", "50000"))
 FORCE_FALLBACK_MIN_ROWS: int = int(_getenv("FORCE_FALLBACK_MIN_ROWS", "500000"))
 MAX_CHART_POINTS: int = int(_getenv("MAX_CHART_POINTS", "500"))
@@ -149,6 +151,12 @@ PRESENTATIONAL_GENERATION_CONFIG = {
 CODE_TIMEOUT: int = int(_getenv("CODE_TIMEOUT", "60"))
 CODE_MAX_MEMORY_BYTES: int = int(_getenv("CODE_MAX_MEMORY_BYTES", str(512 * 1024 * 1024)))
 SANDBOX_MODE: str = _getenv("SANDBOX_MODE", "restricted").lower()
+# Memory-map parquet_path inputs in the worker (set 0 to read through a buffer instead)
+PYARROW_MEMORY_MAP: bool = _env_bool("PYARROW_MEMORY_MAP", True)
+# Fork sandbox workers from a resident, preloaded `worker.py --fork-server` (~140 MB RSS)
+# instead of spawning one per job; it exits after the idle period (0 = never)
+WORKER_FORK_SERVER_ENABLED: bool = _env_bool("WORKER_FORK_SERVER", True)
+WORKER_FORK_SERVER_IDLE_SECONDS: float = float(_getenv("WORKER_FORK_SERVER_IDLE_SECONDS", "300"))
 
 
 # ---------------------------------------------------------------------------
@@ -178,6 +186,7 @@ def validate_config(logger=None) -> list[str]:
         ("CHAT_REPAIR_TIMEOUT_SECONDS", CHAT_REPAIR_TIMEOUT_SECONDS),
         ("CODEGEN_TIMEOUT_SECONDS", CODEGEN_TIMEOUT_SECONDS),
         ("CLASSIFIER_TIMEOUT_SECONDS", CLASSIFIER_TIMEOUT_SECONDS),
+        ("TITLE_WAIT_SECONDS", TITLE_WAIT_SECONDS),
         ("MAX_FASTPATH_ROWS", MAX_FASTPATH_ROWS),
         ("FORCE_FALLBACK_MIN_ROWS", FORCE_FALLBACK_MIN_ROWS),
         ("MAX_CHART_POINTS", MAX_CHART_POINTS),
@@ -2,9 +2,14 @@ import json
 import os
 import time
 import uuid
+import signal
+import socket
 import subprocess
 import sys
+import tempfile
 import io
+import threading
+import itertools
 from datetime import datetime, timezone, timedelta
 from typing import Generator, Iterable
 
@@ -13,16 +18,19 @@ from flask import Request, Response
 from google.cloud import firestore
 from google.cloud import storage
 import pandas as pd
-import base64
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait as futures_wait
 import pyarrow as pa  # type: ignore
 import pyarrow.parquet as pq  # type: ignore
+from pyarrow.fs import GcsFileSystem  # type: ignore
+from cachetools import TTLCache
+import orjson
 
 import firebase_admin
 from firebase_admin import auth as fb_auth
 import google.auth
 from google.auth import impersonated_credentials
 import google.auth.transport.requests
+from requests.adapters import HTTPAdapter
 
 import gemini_client
 import sandbox_runner
@@ -55,9 +63,60 @@ MAX_CHART_POINTS = config.MAX_CHART_POINTS
 TOOLKIT_VERSION = config.TOOLKIT_VERSION
 MIRROR_COMMAND_TO_FIRESTORE = config.MIRROR_COMMAND_TO_FIRESTORE
 CODEGEN_TIMEOUT_SECONDS = config.CODEGEN_TIMEOUT_SECONDS
+TITLE_WAIT_SECONDS = config.TITLE_WAIT_SECONDS
 
 ALLOWED_ORIGINS = config.ALLOWED_ORIGINS
 
+# Fastpath parameter schema per intent: (param_key, kind, required).
+# "col" params are resolved against dataset columns, "raw" params must be truthy,
+# "present" params only need to exist, "filters" is a list of column filters.
+_INTENT_SCHEMA: dict[str, tuple[tuple[str, str, bool], ...]] = {
+    "AGGREGATE": (("dimension", "col", True), ("metric", "col", True), ("func", "raw", True)),
+    "VARIANCE": (("dimension", "col", True), ("period_a", "col", True), ("period_b", "col", True)),
+    "FILTER_SORT": (("sort_col", "col", True), ("filter_col", "col", False)),
+    "DESCRIBE": (),
+    "FILTER": (("filters", "filters", True),),
+    "SORT": (("sort_by_column", "col", True),),
+    "VALUE_COUNTS": (("column", "col", True),),
+    "TOP_N_PER_GROUP": (("group_by_column", "col", True), ("metric_column", "col", True)),
+    "PIVOT": (("index", "col", True), ("columns", "col", True), ("values", "col", True)),
+    "PERCENTILE": (("column", "col", True), ("p", "present", True)),
+    "OUTLIERS": (("column", "col", True),),
+    "SUM_COLUMN": (("column", "col", True),),
+}
+
+# Router lexicons: DESCRIBE keywords (expanded lexicon per decision) and grouping cues
+_DESCRIBE_RE = re.compile(r"\b(describe|summary|summarize|overview|stats|schema|fields)\b")
+_GROUP_RE = re.compile(r"\b(by|per)\b")
+_MEAN_RE = re.compile(r"\b(avg|average|mean)\b")
+_CONJUNCTION_RE = re.compile(r"\band\b|,")
+_WORD_RE = re.compile(r"[a-zA-Z0-9_]+")
+_NUMERIC_DTYPE_RE = re.compile(r"int|float|number|numeric|double|decimal", re.I)
+
+# Cheap local pre-filter for "show me the code" requests: questions that never
+# mention code are not sent to the Gemini show-code classifier.
+_SHOW_CODE_HINT_RE = re.compile(r"\b(code|script|snippet|python)\b", re.IGNORECASE)
+
+# Arrow-native GCS filesystem: parquet reads issue range requests for just the
+# footer and the projected column chunks instead of downloading the object.
+_GCS_FS = GcsFileSystem()
+
+# Shared pool for GCS reads that are prefetched while the request thread waits on Gemini
+_IO_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="gcs-io")
+# Shared pool for Gemini calls (classify, codegen, repair, summarize); avoids a thread spawn/join per request
+_LLM_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="gemini")
+# Title generation keeps running after `done` when it is slow, so it gets its own threads
+# rather than queueing classifier/summary calls (and their timeouts) behind it
+_TITLE_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gemini-title")
+# Shared pool for result-blob uploads; sized for two concurrent requests' six-way fan-out
+_UPLOAD_POOL = ThreadPoolExecutor(max_workers=12, thread_name_prefix="gcs-upload")
+
+# Keep-alive connections held by the shared GCS session (upload + IO pool threads)
+_HTTP_POOL_MAXSIZE = 32
+
+# Cadence of "still_working" keepalives while waiting on long LLM calls
+STILL_WORKING_INTERVAL_SECONDS = 2
+
 # Firebase Admin SDK Initialization
 try:
     firebase_admin.get_app()
@@ -78,6 +137,30 @@ except Exception:
 _CACHED_SIGNING_CREDS = None
 _CACHED_EXPIRES_AT = 0.0
 
+
+@lru_cache(maxsize=1)
+def _get_source_creds():
+    """Discovers the runtime's default credentials once per process."""
+    source_creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+    return source_creds
+
+
+@lru_cache(maxsize=1)
+def _get_storage_client() -> storage.Client:
+    """Shares one GCS client (and its pooled keep-alive session) across requests."""
+    client = storage.Client(project=PROJECT_ID)
+    # requests keeps only 10 idle connections per host by default; size the pool so
+    # every upload/IO pool thread can reuse a warm connection instead of re-handshaking.
+    client._http.mount("https://", HTTPAdapter(pool_maxsize=_HTTP_POOL_MAXSIZE))
+    return client
+
+
+@lru_cache(maxsize=8)
+def _get_bucket(bucket_name: str) -> storage.Bucket:
+    """Bucket handle on the shared client, built once per bucket name."""
+    return _get_storage_client().bucket(bucket_name)
+
+
 def _impersonated_signing_credentials(sa_email: str | None):
     """Creates and caches impersonated credentials for signing URLs."""
     global _CACHED_SIGNING_CREDS, _CACHED_EXPIRES_AT
@@ -85,7 +168,8 @@ def _impersonated_signing_credentials(sa_email: str | None):
     if _CACHED_SIGNING_CREDS and now < _CACHED_EXPIRES_AT:
         return _CACHED_SIGNING_CREDS
 
-    source_creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+    # Only the impersonation wrapper is rebuilt on refresh; source creds are reused
+    source_creds = _get_source_creds()
     if not sa_email:
         creds = source_creds
     else:
@@ -100,16 +184,28 @@ def _impersonated_signing_credentials(sa_email: str | None):
     return _CACHED_SIGNING_CREDS
 
 
+# Signed URLs are reused for up to 10 minutes, so only URLs that stay valid
+# longer than that are cached.
+_SIGNED_URL_CACHE_TTL_SECONDS = 600
+_SIGNED_URL_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=_SIGNED_URL_CACHE_TTL_SECONDS)
+_SIGNED_URL_CACHE_LOCK = threading.Lock()
+
+
 def _sign_gs_uri(gs_uri: str, minutes: int = 15) -> str:
     """Returns a signed HTTPS URL for a gs:// URI."""
     if not gs_uri or not gs_uri.startswith("gs://"):
         return gs_uri
+    cacheable = minutes * 60 > _SIGNED_URL_CACHE_TTL_SECONDS
+    if cacheable:
+        with _SIGNED_URL_CACHE_LOCK:
+            cached = _SIGNED_URL_CACHE.get((gs_uri, minutes))
+        if cached:
+            return cached
     try:
         bucket_name, blob_path = gs_uri[5:].split("/", 1)
-        storage_client = storage.Client(project=PROJECT_ID)
-        blob = storage_client.bucket(bucket_name).blob(blob_path)
+        blob = _get_bucket(bucket_name).blob(blob_path)
         signing_creds = _impersonated_signing_credentials(RUNTIME_SERVICE_ACCOUNT)
-        return blob.generate_signed_url(
+        url = blob.generate_signed_url(
             version="v4",
             expiration=timedelta(minutes=minutes),
             method="GET",
@@ -117,28 +213,515 @@ def _sign_gs_uri(gs_uri: str, minutes: int = 15) -> str:
         )
     except Exception:
         return gs_uri
+    if cacheable:
+        with _SIGNED_URL_CACHE_LOCK:
+            _SIGNED_URL_CACHE[(gs_uri, minutes)] = url
+    return url
+
+
+# payload.json is near-immutable per dataset; cache the parsed dict per GCS path
+# and revalidate against the blob generation once the entry is a few seconds old.
+_PAYLOAD_CACHE: TTLCache = TTLCache(maxsize=256, ttl=60)
+_PAYLOAD_CACHE_LOCK = threading.Lock()
+_PAYLOAD_REVALIDATE_SECONDS = 10.0
+
+
+def _get_payload(bucket, path: str) -> dict:
+    """Returns the parsed payload.json at `path`, served from cache when fresh.
+
+    The returned dict is shared between requests and must not be mutated.
+    """
+    now = time.monotonic()
+    with _PAYLOAD_CACHE_LOCK:
+        entry = _PAYLOAD_CACHE.get(path)
+    blob = bucket.blob(path)
+    if entry is not None:
+        generation, checked_at, payload = entry
+        if now - checked_at < _PAYLOAD_REVALIDATE_SECONDS:
+            return payload
+        blob.reload()
+        if generation is not None and blob.generation == generation:
+            with _PAYLOAD_CACHE_LOCK:
+                _PAYLOAD_CACHE[path] = (generation, now, payload)
+            return payload
+
+    payload = orjson.loads(blob.download_as_bytes())
+    with _PAYLOAD_CACHE_LOCK:
+        _PAYLOAD_CACHE[path] = (blob.generation, now, payload)
+    return payload
+
+
+def _open_parquet(path: str):
+    """Opens a range-reading handle on a parquet object and parses its footer."""
+    reader = _GCS_FS.open_input_file(f"{FILES_BUCKET}/{path}")
+    try:
+        return reader, pq.ParquetFile(reader, pre_buffer=True)
+    except Exception:
+        reader.close()
+        raise
+
+
+def _close_prefetched_parquet(fut) -> None:
+    """Releases a prefetched parquet reader once its future settles."""
+    def _close(f) -> None:
+        if not f.cancelled() and f.exception() is None:
+            f.result()[0].close()
+    fut.add_done_callback(_close)
+
+
+def _download_to_tempfile(blob) -> str:
+    """Downloads a blob to a private temp file and returns its path."""
+    fd, path = tempfile.mkstemp(suffix=".parquet")
+    os.close(fd)
+    try:
+        blob.download_to_filename(path)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path
+
+
+def _download_to_memfd(blob) -> int | str:
+    """Downloads a blob into an anonymous in-memory file and returns its descriptor.
+
+    The descriptor is handed to the worker along with its job socket (see _fork_worker),
+    so the bytes never touch a filesystem entry and the sandbox gets no path into this
+    process. Falls back to a temp file (returning its path) where memfd_create is unavailable.
+    """
+    if not hasattr(os, "memfd_create"):
+        return _download_to_tempfile(blob)
+    fd = os.memfd_create("parquet", os.MFD_CLOEXEC)
+    try:
+        with os.fdopen(os.dup(fd), "wb") as f:
+            blob.download_to_file(f)
+    except Exception:
+        os.close(fd)
+        raise
+    return fd
+
+
+def _remove_tempfile_when_done(fut) -> None:
+    """Releases the memfd or temp file produced by `fut` once the download settles."""
+    def _remove(f) -> None:
+        if not f.cancelled() and f.exception() is None:
+            data = f.result()
+            try:
+                if isinstance(data, int):
+                    os.close(data)
+                else:
+                    os.unlink(data)
+            except OSError:
+                pass
+    fut.add_done_callback(_remove)
+
+
+_WORKER_PATH = os.path.join(os.path.dirname(__file__), "worker.py")
+# One long-lived `worker.py --fork-server` process does the interpreter start-up and the
+# pandas/numpy/pyarrow/matplotlib imports once, then forks a fresh child per job. Each
+# child still runs exactly one job, so user code never shares a process across requests.
+# Started while Gemini generates code; restarted if it dies. It holds ~140 MB RSS (~75 MB
+# of it anonymous) on top of the orchestrator, so it exits after
+# WORKER_FORK_SERVER_IDLE_SECONDS without jobs, and WORKER_FORK_SERVER=0 switches back
+# to spawning a one-shot worker per job.
+_FORK_SERVER_ENABLED = config.WORKER_FORK_SERVER_ENABLED
+_FORK_SERVER_IDLE_SECONDS = config.WORKER_FORK_SERVER_IDLE_SECONDS
+_FORK_SERVER: tuple[subprocess.Popen, socket.socket] | None = None
+_FORK_SERVER_LOCK = threading.Lock()
+
+
+def _start_fork_server() -> tuple[subprocess.Popen, socket.socket]:
+    """Starts a worker fork server; returns it with our end of its control socket."""
+    # Datagram boundaries keep concurrent job hand-offs from interleaving
+    ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    with theirs:
+        proc = subprocess.Popen(
+            [sys.executable, _WORKER_PATH, "--fork-server", str(theirs.fileno()), str(_FORK_SERVER_IDLE_SECONDS)],
+            pass_fds=(theirs.fileno(),),
+        )
+    return proc, ours
+
+
+def _live_fork_server(stale=None) -> tuple[subprocess.Popen, socket.socket]:
+    """Returns the running fork server, (re)starting it if it exited or is `stale`."""
+    global _FORK_SERVER
+    with _FORK_SERVER_LOCK:
+        server = _FORK_SERVER
+        if server is not None and (server is stale or server[0].poll() is not None):
+            if server[0].poll() is None:
+                server[0].kill()  # unresponsive
+            server[1].close()
+            server = None
+        if server is None:
+            server = _FORK_SERVER = _start_fork_server()
+        return server
+
+
+def _prewarm_worker() -> None:
+    """Ensures a live fork server is running (or importing) before the next job."""
+    if _FORK_SERVER_ENABLED:
+        _live_fork_server()
+
+
+def _fork_worker(pass_fds: tuple[int, ...] = ()) -> tuple[int, socket.socket]:
+    """Has the fork server fork a single-use worker; returns its pid and our job socket.
+
+    `pass_fds` (at most one, the dataset memfd) travel with the job socket and are the
+    only descriptors of ours the child receives. The lock only covers finding the server:
+    concurrent jobs wait for their children (and a cold server's imports) in parallel.
+    """
+    stale = None
+    for _ in range(2):
+        server = _live_fork_server(stale)
+        ours, theirs = socket.socketpair()
+        try:
+            with theirs:
+                socket.send_fds(server[1], [b"j"], [theirs.fileno(), *pass_fds])
+            # The child's first 4 bytes are its pid; on first use this waits for the imports
+            ours.settimeout(HARD_TIMEOUT_SECONDS)
+            reply = ours.recv(4, socket.MSG_WAITALL)
+            if len(reply) == 4:
+                return int.from_bytes(reply, "little"), ours
+        except OSError:
+            pass
+        ours.close()
+        # Gone (idle exit, crash) or unresponsive: replace it rather than wait on it again
+        stale = server
+    raise RuntimeError("Worker fork server is not responding")
+
+
+def _run_oneshot_worker(payload: bytes, timeout: float, pass_fds: tuple[int, ...] = ()) -> dict:
+    """Runs one job in a freshly spawned worker.py (WORKER_FORK_SERVER=0)."""
+    proc = subprocess.run(
+        [sys.executable, _WORKER_PATH],
+        input=payload,
+        capture_output=True,
+        timeout=timeout,
+        pass_fds=pass_fds,
+    )
+    if proc.returncode != 0 or not proc.stdout:
+        raise RuntimeError(
+            f"Worker process exited without a result: {proc.stderr.decode('utf-8', errors='ignore')[-2000:]}"
+        )
+    return orjson.loads(proc.stdout)
+
+
+def _worker_data_source(parquet_data: int | str) -> tuple[dict, tuple[int, ...]]:
+    """Payload keys and descriptors that hand the downloaded dataset to a worker.
+
+    A memfd is passed to the worker itself (a spawned worker keeps its number, a forked
+    one is told to use the descriptor sent with its job); a temp file goes by path.
+    """
+    if not isinstance(parquet_data, int):
+        return {"parquet_path": parquet_data}, ()
+    if _FORK_SERVER_ENABLED:
+        return {"parquet_fd": True}, (parquet_data,)
+    return {"parquet_path": f"/proc/self/fd/{parquet_data}"}, (parquet_data,)
+
+
+def _run_worker_job(payload: bytes, timeout: float, pass_fds: tuple[int, ...] = ()) -> dict:
+    """Runs one job in a freshly forked worker; raises subprocess.TimeoutExpired past `timeout`."""
+    if not _FORK_SERVER_ENABLED:
+        return _run_oneshot_worker(payload, timeout, pass_fds)
+    pid, conn = _fork_worker(pass_fds)
+    deadline = time.monotonic() + timeout
+    chunks = []
+    with conn:
+        try:
+            conn.settimeout(timeout)
+            conn.sendall(payload)
+            conn.shutdown(socket.SHUT_WR)
+            while True:
+                conn.settimeout(max(deadline - time.monotonic(), 0.001))
+                chunk = conn.recv(1 << 20)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except TimeoutError:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            raise subprocess.TimeoutExpired("worker", timeout) from None
+    if not chunks:
+        raise RuntimeError("Worker process exited without a result (see worker stderr)")
+    try:
+        return orjson.loads(b"".join(chunks))
+    except orjson.JSONDecodeError:
+        # The child died mid-write; its traceback is in the worker stderr
+        raise RuntimeError("Worker process exited with a truncated result (see worker stderr)") from None
+
+
+@lru_cache(maxsize=1)
+def _code_cache_dir() -> str:
+    """Private directory (0700, unguessable name) where workers keep compiled user code.
+
+    User code can write files through pandas, so the cache must not live at a path it
+    could guess; only the workers learn this one, through their job payload.
+    """
+    return tempfile.mkdtemp(prefix="worker-codecache-")
+
+
+@lru_cache(maxsize=1)
+def _worker_output_dir() -> str:
+    """Private directory where workers drop large result tables as Arrow IPC files (tmpfs when available)."""
+    shm = "/dev/shm"
+    base = shm if os.path.isdir(shm) and os.access(shm, os.W_OK) else None
+    return tempfile.mkdtemp(prefix="worker-out-", dir=base)
+
+
+def _read_parquet_head(parquet_file, columns: list[str] | None, max_rows: int) -> pd.DataFrame:
+    """Reads the projected columns batch by batch, stopping once `max_rows` rows are collected."""
+    if columns:
+        missing = [c for c in columns if c not in parquet_file.schema_arrow.names]
+        if missing:
+            raise KeyError(f"Columns not found in dataset: {missing}")
+    batch_size = min(max_rows, 65536) if max_rows > 0 else 65536
+    batches = []
+    collected = 0
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns, use_pandas_metadata=True):
+        if max_rows > 0 and collected + batch.num_rows > max_rows:
+            batch = batch.slice(0, max_rows - collected)
+        batches.append(batch)
+        collected += batch.num_rows
+        if max_rows > 0 and collected >= max_rows:
+            break
+    if not batches:
+        return parquet_file.read(columns=columns, use_pandas_metadata=True).to_pandas(types_mapper=pd.ArrowDtype)
+    return pa.Table.from_batches(batches).to_pandas(
+        types_mapper=pd.ArrowDtype, self_destruct=True, split_blocks=True
+    )
+
+
+def _arrow_rowable(dtype) -> bool:
+    """True when Arrow's `to_pylist` yields the same JSON as pandas for this dtype."""
+    if isinstance(dtype, pd.ArrowDtype):
+        return not pa.types.is_temporal(dtype.pyarrow_dtype)
+    if isinstance(dtype, (pd.CategoricalDtype, pd.IntervalDtype, pd.PeriodDtype)):
+        return False
+    return dtype.kind in "biufO"
+
+
+def _df_to_records(df: pd.DataFrame, n: int = 200) -> list[dict]:
+    """Returns the first `n` rows as records without going through `to_dict(orient="records")`.
+
+    Plain numeric/string frames are converted by Arrow's C-level `to_pylist`; anything else
+    (temporal, categorical, mixed objects) is converted column by column via `tolist()`.
+    """
+    sub = df.head(n)
+    if all(_arrow_rowable(dt) for dt in sub.dtypes):
+        try:
+            return pa.Table.from_pandas(sub, preserve_index=False).to_pylist()
+        except (pa.ArrowException, TypeError, ValueError):
+            pass
+    cols = list(sub.columns)
+    arrays = []
+    for i in range(len(cols)):
+        col = sub.iloc[:, i]
+        values = col.tolist()
+        if isinstance(col.dtype, pd.api.extensions.ExtensionDtype) and col.hasnans:
+            # Match to_dict(): extension-array nulls come back as pd.NA from tolist()
+            values = [None if v is pd.NA else v for v in values]
+        arrays.append(values)
+    return [dict(zip(cols, row)) for row in zip(*arrays)]
+
+
+def _upload_blob(blob, data: bytes, content_type: str = "application/json") -> None:
+    """Uploads a small in-memory payload as-is: no content-encoding and no client-side checksum pass."""
+    blob.content_encoding = None
+    # upload_from_string is a thin BytesIO wrapper over upload_from_file; the explicit
+    # size keeps this a single multipart request.
+    blob.upload_from_file(io.BytesIO(data), size=len(data), content_type=content_type, checksum=None)
+
+
+# PASSTHROUGH_DATETIME sends datetime/date through default=str, keeping the
+# "2024-01-01 00:00:00" form json.dumps(default=str) produced rather than ISO-8601
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def _dumps(obj) -> bytes:
+    """Serializes `obj` to UTF-8 JSON bytes (NumPy scalars/arrays and non-str keys allowed)."""
+    return orjson.dumps(obj, default=str, option=_ORJSON_OPTIONS)
+
+
+# Upper bound on persisted/streamed table cells; wide results (e.g. pivots) are cut to
+# _MAX_TABLE_ROWS x _MAX_TABLE_COLUMNS so serialization cost stays bounded.
+_MAX_CELLS = 50_000
+_MAX_TABLE_ROWS = 200
+_MAX_TABLE_COLUMNS = 50
+
+
+def _sse_table_truncated(rows: int, cols: int) -> bytes:
+    """Formats the warning event sent when a result table is cut down to the cell cap."""
+    return _sse_format({
+        "type": "warning",
+        "data": {
+            "code": "TABLE_TRUNCATED",
+            "message": (
+                f"The result has {rows} rows x {cols} columns; only the first "
+                f"{_MAX_TABLE_ROWS} rows and {_MAX_TABLE_COLUMNS} columns are included."
+            ),
+        },
+    })
+
+
+def _cap_records(table: list) -> list | None:
+    """Truncated copy of a records list exceeding _MAX_CELLS, or None when it fits."""
+    cols = len(table[0]) if table and isinstance(table[0], dict) else 1
+    if len(table) * cols <= _MAX_CELLS:
+        return None
+    return [
+        dict(itertools.islice(row.items(), _MAX_TABLE_COLUMNS)) if isinstance(row, dict) else row
+        for row in table[:_MAX_TABLE_ROWS]
+    ]
+
+
+def _read_arrow_table(path: str) -> tuple[list, int, int]:
+    """Loads a worker's Arrow IPC result table and deletes the file.
+
+    Only the rows that survive the _MAX_CELLS cap are converted to records. Returns
+    (records, total_rows, total_columns).
+    """
+    try:
+        with pa.memory_map(path, "r") as source:
+            table = pa.ipc.open_stream(source).read_all()
+            rows, cols = table.num_rows, table.num_columns
+            if rows * cols > _MAX_CELLS:
+                table = table.slice(0, _MAX_TABLE_ROWS).select(range(min(cols, _MAX_TABLE_COLUMNS)))
+            records = _df_to_records(table.to_pandas(), table.num_rows)
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    return records, rows, cols
+
+
+def _json_object(base: dict, **members: bytes) -> bytes:
+    """Serializes `base` and appends already-encoded JSON `members` without re-encoding them."""
+    head = _dumps(base)[1:-1]
+    tail = b",".join(b'"%s":%s' % (key.encode("utf-8"), value) for key, value in members.items())
+    return b"{" + head + (b"," if head and tail else b"") + tail + b"}"
+
+
+def _sse_format(obj: dict) -> bytes:
+    """Formats a dictionary as a Server-Sent Event frame."""
+    buf = bytearray(b"data: ")
+    buf += _dumps(obj)
+    buf += b"\n\n"
+    return bytes(buf)
+
 
+# Payload-free status events are identical on every request; render them once.
+_SSE_STILL_WORKING = _sse_format({"type": "still_working"})
+_SSE_GENERATING_CODE = _sse_format({"type": "generating_code"})
+_SSE_RUNNING_FAST = _sse_format({"type": "running_fast"})
+_SSE_PERSISTING = _sse_format({"type": "persisting"})
+_SSE_REPAIRING = _sse_format({"type": "repairing"})
+_SSE_SUMMARIZING = _sse_format({"type": "summarizing"})
 
-def _sse_format(obj: dict) -> str:
-    """Formats a dictionary as a Server-Sent Event string."""
-    return f"data: {json.dumps(obj, ensure_ascii=False)}\n\n"
 
+_SSE_CODE_PREFIX = b'data: {"type":"code","data":{"language":"python","text":'
 
-def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterable[str]:
+
+def _sse_code_event(code: str, warnings: list | None, source: str) -> bytes:
+    """Formats a `code` event from a pre-rendered envelope; only the code text is encoded."""
+    return b"".join((
+        _SSE_CODE_PREFIX,
+        orjson.dumps(code),
+        b',"warnings":',
+        _dumps(warnings or []),
+        b',"source":',
+        orjson.dumps(source),
+        b"}}\n\n",
+    ))
+
+
+def _generate_title_and_persist(bucket, results_prefix: str, question: str, summary: str) -> str | None:
+    """Generates the conversation title and stores it as `title.json` next to the result.
+
+    Starts alongside persistence; the `done` event waits up to TITLE_WAIT_SECONDS for it
+    (see _await_title) and otherwise goes out without one.
+    """
+    try:
+        title = gemini_client.generate_title(question, summary)
+        if not isinstance(title, str) or not title.strip():
+            return None
+        title = title.strip()
+        # Stored without holding up the `done` event that is waiting for the title
+        _UPLOAD_POOL.submit(_upload_blob, bucket.blob(f"{results_prefix}/title.json"), _dumps({"title": title}))
+        return title
+    except Exception as e:
+        try:
+            logging.info(json.dumps({"event": "title_generate_error", "detail": str(e)[:200]}))
+        except Exception:
+            pass
+        return None
+
+
+def _await_title(title_future) -> str | None:
+    """The generated title, if it arrives within TITLE_WAIT_SECONDS of persisting."""
+    try:
+        return title_future.result(timeout=TITLE_WAIT_SECONDS)
+    except Exception:
+        return None
+
+
+@lru_cache(maxsize=128)
+def _cached_presentational_code(mid: str, ctx_json: str, schema: str, style: str) -> str:
+    """Presentational code for a previous analysis, cached across requests."""
+    try:
+        ctx = orjson.loads(ctx_json)
+    except Exception:
+        ctx = {}
+    return gemini_client.generate_presentational_code(ctx, schema, style=style)
+
+
+def _await_with_keepalive(fut, timeout_s: float) -> Generator[bytes, None, object]:
+    """Yields still_working events until `fut` settles and returns its result.
+
+    Raises FuturesTimeout once `timeout_s` has elapsed without a result.
+    """
+    deadline = time.monotonic() + timeout_s
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise FuturesTimeout()
+        done, _ = futures_wait([fut], timeout=min(STILL_WORKING_INTERVAL_SECONDS, remaining))
+        if done:
+            return fut.result()
+        yield _SSE_STILL_WORKING
+
+
+def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterable[bytes]:
     """Generator function for the main SSE event stream."""
+    # The parquet footer is prefetched while the metadata and classifier run; whichever
+    # way the stream ends (early error, reply, client disconnect) the reader is released
+    parquet_gcs_path = f"users/{uid}/sessions/{session_id}/datasets/{dataset_id}/cleaned/cleaned.parquet"
+    parquet_future = _IO_POOL.submit(_open_parquet, parquet_gcs_path) if FASTPATH_ENABLED else None
+    try:
+        yield from _event_stream(session_id, dataset_id, uid, question, parquet_gcs_path, parquet_future)
+    finally:
+        if parquet_future is not None:
+            _close_prefetched_parquet(parquet_future)
+
+
+def _event_stream(
+    session_id: str, dataset_id: str, uid: str, question: str, parquet_gcs_path: str, parquet_future
+) -> Iterable[bytes]:
     yield _sse_format({"type": "received", "data": {"sessionId": session_id, "datasetId": dataset_id}})
 
     # Setup GCS and Firestore clients
-    storage_client = storage.Client(project=PROJECT_ID)
-    bucket = storage_client.bucket(FILES_BUCKET)
+    storage_client = _get_storage_client()
+    bucket = _get_bucket(FILES_BUCKET)
     fs = firestore.Client(project=PROJECT_ID)
 
-    # Fetch payload.json for schema and sample data
+    # Fetch payload.json for schema and sample data; the parquet footer is being fetched
+    # concurrently so it is ready by the time the classifier returns.
+    payload_gcs_path = f"users/{uid}/sessions/{session_id}/datasets/{dataset_id}/metadata/payload.json"
+    payload_future = _IO_POOL.submit(_get_payload, bucket, payload_gcs_path)
     payload_obj = {}
     try:
-        payload_gcs_path = f"users/{uid}/sessions/{session_id}/datasets/{dataset_id}/metadata/payload.json"
-        payload_blob = bucket.blob(payload_gcs_path)
-        payload_obj = json.loads(payload_blob.download_as_text())
+        payload_obj = payload_future.result()
     except Exception as e:
         yield _sse_format({"type": "error", "data": {"code": "PAYLOAD_READ_FAILED", "message": f"Could not read metadata: {e}"}})
         return
@@ -149,38 +732,44 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
     dataset_rows = int(dataset_meta.get("rows") or 0)
     column_names = list(dataset_meta.get("column_names") or (payload_obj.get("columns", {}) or {}).keys())
     columns_schema = payload_obj.get("columns", {}) or {}
+    # Exact and case-insensitive column lookups, built once per request (first match wins)
+    column_set = set(column_names)
+    col_lower = {c.lower(): c for c in reversed(column_names)}
 
     # --- Router helpers: DESCRIBE lexicon and multi-metric detection ---
-    def _is_describe_like(q: str) -> bool:
-        if not isinstance(q, str) or not q:
+    # The question is lowercased and scanned for grouping/describe cues once per request.
+    q_lower = question.lower() if isinstance(question, str) else ""
+    has_group_cue = bool(_GROUP_RE.search(q_lower))
+    describe_like = bool(_DESCRIBE_RE.search(q_lower)) and not has_group_cue
+
+    # Worked out on first use (it may resolve aliases) and remembered in the holder
+    multi_metric: list[bool] = []
+
+    def _is_multi_metric_request() -> bool:
+        if not multi_metric:
+            multi_metric.append(_detect_multi_metric())
+        return multi_metric[0]
+
+    def _detect_multi_metric() -> bool:
+        # Both outcomes require a grouping cue
+        if not has_group_cue:
             return False
-        ql = q.lower()
-        # Expanded lexicon per decision
-        lex = ["describe", "summary", "summarize", "overview", "stats", "schema", "fields"]
-        has_keyword = any(re.search(rf"\b{re.escape(tok)}\b", ql) for tok in lex)
-        has_grouping = bool(re.search(r"\b(by|per)\b", ql))
-        return has_keyword and not has_grouping
-
-    def _is_multi_metric_request(q: str, col_names: list[str], cols_schema: dict) -> bool:
-        if not isinstance(q, str) or not q:
-            return False
-        ql = q.lower()
         # Heuristic: mentions average/mean and has conjunctions and grouping cue
-        pattern_avg = bool(re.search(r"\b(avg|average|mean)\b", ql))
-        pattern_multi = bool(re.search(r"\b(and)\b|,", ql))
-        pattern_group = bool(re.search(r"\b(by|per)\b", ql))
+        if _MEAN_RE.search(q_lower) and _CONJUNCTION_RE.search(q_lower):
+            return True
 
         # Column resolution: count unique resolved columns referenced in question
-        tokens = re.findall(r"[a-zA-Z0-9_]+", ql)
+        tokens = _WORD_RE.findall(q_lower)
         resolved: set[str] = set()
         for t in tokens:
-            col = aliases.resolve_column(t, col_names)
+            # Direct (case-insensitive) hit first; fuzzy alias resolution only on a miss
+            col = col_lower.get(t) or aliases.resolve_column(t, column_names)
             if col:
                 # Optionally check numeric-ish types if provided in schema
-                meta = (cols_schema or {}).get(col, {})
-                dtype = str(meta.get("dtype") or meta.get("type") or "").lower()
+                meta = columns_schema.get(col, {})
+                dtype = str(meta.get("dtype") or meta.get("type") or "")
                 if dtype:
-                    if any(k in dtype for k in ["int", "float", "number", "numeric", "double", "decimal"]):
+                    if _NUMERIC_DTYPE_RE.search(dtype):
                         resolved.add(col)
                     else:
                         # If dtype present but non-numeric, skip
@@ -188,28 +777,29 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
                 else:
                     # If no dtype info, still count the resolved column
                     resolved.add(col)
+                if len(resolved) >= 2:
+                    return True
 
-        return (pattern_avg and pattern_multi and pattern_group) or (len(resolved) >= 2 and pattern_group)
+        return False
 
     # --- Optional: Unified Presentational Code (Show Code) ---
-    @lru_cache(maxsize=32)
-    def _cached_presentational_code(mid: str, ctx_json: str, schema: str, style: str) -> str:
-        try:
-            ctx = json.loads(ctx_json)
-        except Exception:
-            ctx = {}
-        return gemini_client.generate_presentational_code(ctx, schema, style=style)
-
     try:
-        if CODE_RECONSTRUCT_ENABLED:
+        if CODE_RECONSTRUCT_ENABLED and _SHOW_CODE_HINT_RE.search(question or ""):
             show_req = gemini_client.is_show_code_request(question)
             if isinstance(show_req, dict) and show_req.get("is_code_request") is True:
                 results_prefix = f"users/{uid}/sessions/{session_id}/results/"
                 latest_strategy_blob = None
-                for blob in storage_client.list_blobs(FILES_BUCKET, prefix=results_prefix):
-                    if blob.name.endswith("/strategy.json"):
-                        if latest_strategy_blob is None or (getattr(blob, "updated", None) and blob.updated > latest_strategy_blob.updated):
-                            latest_strategy_blob = blob
+                # Filter server-side and fetch only the fields needed; message ids are
+                # random UUIDs, so recency still comes from `updated`.
+                strategy_blobs = storage_client.list_blobs(
+                    FILES_BUCKET,
+                    prefix=results_prefix,
+                    match_glob="**/strategy.json",
+                    fields="items(name,updated,generation),nextPageToken",
+                )
+                for blob in strategy_blobs:
+                    if latest_strategy_blob is None or (getattr(blob, "updated", None) and blob.updated > latest_strategy_blob.updated):
+                        latest_strategy_blob = blob
                 if latest_strategy_blob is None:
                     yield _sse_format({"type": "error", "data": {"code": "NO_PREV_ANALYSIS", "message": "No previous analysis found to reconstruct."}})
                     return
@@ -236,12 +826,9 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
                     return
 
                 style = config.PRESENTATIONAL_CODE_STYLE
-                ctx_json = json.dumps(context, ensure_ascii=False, sort_keys=True)
+                ctx_json = orjson.dumps(context, option=orjson.OPT_SORT_KEYS).decode("utf-8")
                 code_text = _cached_presentational_code(message_id_prev, ctx_json, schema_snippet, style)
-                yield _sse_format({
-                    "type": "code",
-                    "data": {"language": "python", "text": code_text, "warnings": [], "source": "presentation"}
-                })
+                yield _sse_code_event(code_text, [], "presentation")
                 return
     except Exception:
         # Non-fatal; continue with normal flow
@@ -257,7 +844,11 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
         })
 
         classification = None
-        if config.EMBED_ROUTER_ENABLED:
+        # Plain describe requests (no grouping cue) are routed without a classifier RPC;
+        # the DESCRIBE fastpath guard below is the same regex check.
+        if describe_like:
+            classification = {"intent": "run_describe", "params": {}, "confidence": 1.0}
+        if classification is None and config.EMBED_ROUTER_ENABLED:
             intent_guess, embed_score = None, 0.0
             try:
                 intent_guess, embed_score = embedding_router.semantic_route(
@@ -273,28 +864,27 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
                     threshold = float(config.EMBED_THRESHOLD_DEFAULT)
 
                 passes_guards = True
-                if intent_guess == "run_describe" and (not _is_describe_like(question)):
+                if intent_guess == "run_describe" and (not describe_like):
                     passes_guards = False
-                if intent_guess == "run_aggregation" and _is_multi_metric_request(question, column_names, columns_schema):
+                if intent_guess == "run_aggregation" and _is_multi_metric_request():
                     passes_guards = False
 
                 if embed_score >= threshold and passes_guards:
                     restricted_spec = [t for t in (analysis_toolkit.TOOLS_SPEC or []) if t.get("name") == intent_guess]
                     if restricted_spec:
                         try:
-                            with ThreadPoolExecutor(max_workers=1) as ex:
-                                fut = ex.submit(
-                                    gemini_client.classify_intent,
-                                    question,
-                                    schema_snippet,
-                                    sample_rows,
-                                    restricted_spec,
-                                    hinting,
-                                )
-                                try:
-                                    classification = fut.result(timeout=3)
-                                except FuturesTimeout:
-                                    classification = None
+                            fut = _LLM_POOL.submit(
+                                gemini_client.classify_intent,
+                                question,
+                                schema_snippet,
+                                sample_rows,
+                                restricted_spec,
+                                hinting,
+                            )
+                            try:
+                                classification = fut.result(timeout=3)
+                            except FuturesTimeout:
+                                classification = None
                         except Exception:
                             classification = None
                 try:
@@ -310,25 +900,15 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
 
         if classification is None:
             try:
-                with ThreadPoolExecutor(max_workers=1) as ex:
-                    fut = ex.submit(
-                        gemini_client.classify_intent,
-                        question,
-                        schema_snippet,
-                        sample_rows,
-                        analysis_toolkit.TOOLS_SPEC,
-                        hinting,
-                    )
-                    remaining = CLASSIFIER_TIMEOUT_SECONDS
-                    while True:
-                        try:
-                            classification = fut.result(timeout=min(remaining, 2))
-                            break
-                        except FuturesTimeout:
-                            yield _sse_format({"type": "still_working"})
-                            remaining -= 2
-                            if remaining <= 0:
-                                raise
+                fut = _LLM_POOL.submit(
+                    gemini_client.classify_intent,
+                    question,
+                    schema_snippet,
+                    sample_rows,
+                    analysis_toolkit.TOOLS_SPEC,
+                    hinting,
+                )
+                classification = yield from _await_with_keepalive(fut, CLASSIFIER_TIMEOUT_SECONDS)
             except FuturesTimeout:
                 classification = {"intent": "UNKNOWN", "params": {}, "confidence": 0.0}
             except Exception:
@@ -367,79 +947,45 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
             """Resolve column with case-insensitive fallback before fuzzy matching."""
             if not name:
                 return None
-            
-            # 1. Exact match
-            if name in cols:
+            # 1. Exact match, 2. case-insensitive match, 3. alias + fuzzy (existing logic)
+            if name in column_set:
                 return name
-            
-            # 2. Case-insensitive match
-            name_lower = name.lower()
-            for c in cols:
-                if c.lower() == name_lower:
-                    return c
-            
-            # 3. Alias + fuzzy (existing logic)
-            return aliases.resolve_column(name, cols)
+            return col_lower.get(name.lower()) or aliases.resolve_column(name, cols)
 
-        # Parameter validation and resolution
+        # Parameter validation and resolution driven by _INTENT_SCHEMA
         def _validate_and_resolve(i: str, p: dict) -> tuple[bool, dict]:
+            # Scalar params (func, ascending, limit, ...) are carried through unchanged
             resolved = dict(p)
+            schema = _INTENT_SCHEMA.get(i)
+            if schema is None:
+                return False, resolved
+            all_required_present = True
             try:
-                if i == "AGGREGATE":
-                    resolved["dimension"] = _smart_resolve_column(p.get("dimension"), column_names) or p.get("dimension")
-                    resolved["metric"] = _smart_resolve_column(p.get("metric"), column_names) or p.get("metric")
-                    return bool(resolved.get("dimension") and resolved.get("metric") and p.get("func")), resolved
-                if i == "VARIANCE":
-                    resolved["dimension"] = _smart_resolve_column(p.get("dimension"), column_names) or p.get("dimension")
-                    resolved["period_a"] = _smart_resolve_column(p.get("period_a"), column_names) or p.get("period_a")
-                    resolved["period_b"] = _smart_resolve_column(p.get("period_b"), column_names) or p.get("period_b")
-                    return bool(resolved.get("dimension") and resolved.get("period_a") and resolved.get("period_b")), resolved
-                if i == "FILTER_SORT":
-                    resolved["sort_col"] = _smart_resolve_column(p.get("sort_col"), column_names) or p.get("sort_col")
-                    if p.get("filter_col"):
-                        resolved["filter_col"] = _smart_resolve_column(p.get("filter_col"), column_names) or p.get("filter_col")
-                    return bool(resolved.get("sort_col")), resolved
-                if i == "DESCRIBE":
-                    return True, resolved
-                if i == "FILTER":
-                    flist = []
-                    for f in (p.get("filters") or []):
-                        col = _smart_resolve_column(f.get("column"), column_names) or f.get("column")
-                        flist.append({
-                            "column": col,
-                            "operator": f.get("operator"),
-                            "value": f.get("value"),
-                        })
-                    resolved["filters"] = flist
-                    return bool(flist), resolved
-                if i == "SORT":
-                    resolved["sort_by_column"] = _smart_resolve_column(p.get("sort_by_column"), column_names) or p.get("sort_by_column")
-                    return bool(resolved.get("sort_by_column")), resolved
-                if i == "VALUE_COUNTS":
-                    resolved["column"] = _smart_resolve_column(p.get("column"), column_names) or p.get("column")
-                    return bool(resolved.get("column")), resolved
-                if i == "TOP_N_PER_GROUP":
-                    resolved["group_by_column"] = _smart_resolve_column(p.get("group_by_column"), column_names) or p.get("group_by_column")
-                    resolved["metric_column"] = _smart_resolve_column(p.get("metric_column"), column_names) or p.get("metric_column")
-                    return bool(resolved.get("group_by_column") and resolved.get("metric_column")), resolved
-                if i == "PIVOT":
-                    resolved["index"] = _smart_resolve_column(p.get("index"), column_names) or p.get("index")
-                    resolved["columns"] = _smart_resolve_column(p.get("columns"), column_names) or p.get("columns")
-                    resolved["values"] = _smart_resolve_column(p.get("values"), column_names) or p.get("values")
-                    return bool(resolved.get("index") and resolved.get("columns") and resolved.get("values")), resolved
-                if i == "PERCENTILE":
-                    resolved["column"] = _smart_resolve_column(p.get("column"), column_names) or p.get("column")
-                    # p may be string or number; defer casting to toolkit
-                    return bool(resolved.get("column") and ("p" in p)), resolved
-                if i == "OUTLIERS":
-                    resolved["column"] = _smart_resolve_column(p.get("column"), column_names) or p.get("column")
-                    return bool(resolved.get("column")), resolved
-                if i == "SUM_COLUMN":
-                    resolved["column"] = _smart_resolve_column(p.get("column"), column_names) or p.get("column")
-                    return bool(resolved.get("column")), resolved
+                for key, kind, required in schema:
+                    if kind == "col":
+                        if required or p.get(key):
+                            resolved[key] = _smart_resolve_column(p.get(key), column_names) or p.get(key)
+                        present = bool(resolved.get(key))
+                    elif kind == "filters":
+                        resolved[key] = [
+                            {
+                                "column": _smart_resolve_column(f.get("column"), column_names) or f.get("column"),
+                                "operator": f.get("operator"),
+                                "value": f.get("value"),
+                            }
+                            for f in (p.get(key) or [])
+                        ]
+                        present = bool(resolved[key])
+                    elif kind == "present":
+                        # e.g. percentile p may legitimately be 0; defer casting to toolkit
+                        present = key in p
+                    else:
+                        present = bool(p.get(key))
+                    if required and not present:
+                        all_required_present = False
             except Exception:
                 return False, resolved
-            return False, resolved
+            return all_required_present, resolved
 
         params_ok, resolved_params = _validate_and_resolve(intent, params)
 
@@ -451,7 +997,7 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
             # DESCRIBE: only when clearly a describe-like request, never if grouping cues present
             is_fastpath_candidate = (
                 params_ok
-                and _is_describe_like(question)
+                and describe_like
                 and (confidence >= MIN_FASTPATH_CONFIDENCE or confidence >= soft_threshold)
             )
             if not is_fastpath_candidate:
@@ -466,7 +1012,7 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
                     pass
         elif intent in {"AGGREGATE", "VARIANCE", "FILTER_SORT"}:
             # Capability guard for AGGREGATE: multi-metric grouped tables require fallback
-            if intent == "AGGREGATE" and _is_multi_metric_request(question, column_names, columns_schema):
+            if intent == "AGGREGATE" and _is_multi_metric_request():
                 is_fastpath_candidate = False
                 try:
                     logging.info(json.dumps({
@@ -519,12 +1065,10 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
                 }))
             except Exception:
                 pass
-            yield _sse_format({"type": "generating_code"})
-            yield _sse_format({"type": "running_fast"})
-            parquet_gcs_path = f"users/{uid}/sessions/{session_id}/datasets/{dataset_id}/cleaned/cleaned.parquet"
+            yield _SSE_GENERATING_CODE
+            yield _SSE_RUNNING_FAST
             try:
-                parquet_blob = bucket.blob(parquet_gcs_path)
-                parquet_bytes = parquet_blob.download_as_bytes()
+                parquet_reader, parquet_file = parquet_future.result()
             except Exception as e:
                 yield _sse_format({"type": "error", "data": {"code": "DATA_READ_FAILED", "message": str(e)}})
             else:
@@ -566,18 +1110,14 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
 
                     needed_cols = compute_needed_cols(intent, resolved_params)
 
-                    if needed_cols:
-                        df = pd.read_parquet(io.BytesIO(parquet_bytes), columns=needed_cols)
-                    else:
-                        df = pd.read_parquet(io.BytesIO(parquet_bytes))
-                    if MAX_FASTPATH_ROWS > 0 and len(df) > MAX_FASTPATH_ROWS:
-                        df = df.head(MAX_FASTPATH_ROWS)
+                    with parquet_reader:
+                        df = _read_parquet_head(parquet_file, needed_cols or None, MAX_FASTPATH_ROWS)
 
                     # Execute
                     if intent == "AGGREGATE":
                         dim = resolved_params.get("dimension")
                         met = resolved_params.get("metric")
-                        res_df = analysis_toolkit.run_aggregation(df, dim, met, resolved_params.get("func", params.get("func", "sum")))
+                        res_df = analysis_toolkit.run_aggregation(df, dim, met, resolved_params.get("func", "sum"))
                     elif intent == "VARIANCE":
                         dim = resolved_params.get("dimension")
                         a = resolved_params.get("period_a")
@@ -589,10 +1129,10 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
                         res_df = analysis_toolkit.run_filter_and_sort(
                             df,
                             sort_col=sort_col,
-                            ascending=bool(resolved_params.get("ascending", params.get("ascending", False))),
-                            limit=int((resolved_params.get("limit") or params.get("limit") or 50)),
+                            ascending=bool(resolved_params.get("ascending", False)),
+                            limit=int(resolved_params.get("limit") or 50),
                             filter_col=fcol,
-                            filter_val=resolved_params.get("filter_val", params.get("filter_val")),
+                            filter_val=resolved_params.get("filter_val"),
                         )
                     elif intent == "FILTER":
                         res_df = analysis_toolkit.filter_rows(df, filters=resolved_params.get("filters") or [])
@@ -647,12 +1187,44 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
                     else:
                         res_df = analysis_toolkit.run_describe(df)
 
-                    # Summarization with timeout for resilience
+                    # Summarization with timeout for resilience; the table rows and
+                    # strategy.json are prepared and uploaded while Gemini responds.
+                    summary_future = _LLM_POOL.submit(gemini_client.format_final_response, question, res_df)
+                    rows, cols = res_df.shape
+                    table_df = res_df
+                    if min(rows, _MAX_TABLE_ROWS) * cols > _MAX_CELLS:
+                        table_df = res_df.iloc[:, :_MAX_TABLE_COLUMNS]
+                        yield _sse_table_truncated(rows, cols)
+                    table_rows = _df_to_records(table_df, _MAX_TABLE_ROWS)
+                    metrics = {"rows": int(getattr(res_df, "shape", [0, 0])[0] or 0),
+                               "columns": int(getattr(res_df, "shape", [0, 0])[1] or 0)}
+                    chart_data = {}
+
+                    message_id = str(uuid.uuid4())
+                    results_prefix = f"users/{uid}/sessions/{session_id}/results/{message_id}"
+                    bundle_path = f"{results_prefix}/bundle.json"
+                    strategy_path = f"{results_prefix}/strategy.json"
+                    command_obj = {
+                        "intent": intent,
+                        "params": resolved_params,
+                        "confidence": confidence,
+                        "toolkitVersion": TOOLKIT_VERSION,
+                    }
+                    # The command is encoded once and spliced into strategy.json and the
+                    # bundle; strategy.json is in turn spliced into the bundle.
+                    command_data = _dumps(command_obj)
+                    strategy_data = _json_object({
+                        "strategy": "fastpath",
+                        "version": TOOLKIT_VERSION,
+                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                        "messageId": message_id,
+                        "question": question,
+                    }, command=command_data)
+                    strategy_upload = _UPLOAD_POOL.submit(_upload_blob, bucket.blob(strategy_path), strategy_data)
+
                     summary_obj = {}
                     try:
-                        with ThreadPoolExecutor(max_workers=1) as ex:
-                            fut = ex.submit(gemini_client.format_final_response, question, res_df)
-                            summary_obj = fut.result(timeout=15)
+                        summary_obj = summary_future.result(timeout=15)
                     except Exception as e:
                         try:
                             logging.warning(f"Summarization call failed or timed out: {e}")
@@ -660,78 +1232,34 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
                             pass
                         summary_obj = {"summary": "The analysis is complete. Please review the data below."}
                     summary_text = summary_obj.get("summary") or ""
-                    # Optional title generation (non-blocking)
-                    title_text = None
-                    try:
-                        title_text = gemini_client.generate_title(question, summary_text)
-                    except Exception as e:
-                        try:
-                            logging.info(json.dumps({"event": "title_generate_error", "detail": str(e)[:200]}))
-                        except Exception:
-                            pass
-                    table_rows = res_df.head(200).to_dict(orient="records")
-                    metrics = {"rows": int(getattr(res_df, "shape", [0, 0])[0] or 0),
-                               "columns": int(getattr(res_df, "shape", [0, 0])[1] or 0)}
-                    chart_data = {}
-
-                    yield _sse_format({"type": "persisting"})
-                    message_id = str(uuid.uuid4())
-                    results_prefix = f"users/{uid}/sessions/{session_id}/results/{message_id}"
-                    table_path = f"{results_prefix}/fastpath_table.json"
-                    metrics_path = f"{results_prefix}/fastpath_metrics.json"
-                    chart_path = f"{results_prefix}/fastpath_chart_data.json"
-                    summary_path = f"{results_prefix}/summary.json"
-                    command_path = f"{results_prefix}/command.json"
-                    strategy_path = f"{results_prefix}/strategy.json"
+                    # Optional title generation runs off the request path (see _generate_title_and_persist)
+                    title_future = _TITLE_POOL.submit(
+                        _generate_title_and_persist, bucket, results_prefix, question, summary_text
+                    )
 
+                    yield _SSE_PERSISTING
                     try:
-                        table_blob = bucket.blob(table_path)
-                        metrics_blob = bucket.blob(metrics_path)
-                        chart_blob = bucket.blob(chart_path)
-                        summary_blob = bucket.blob(summary_path)
-                        command_blob = bucket.blob(command_path)
-                        strategy_blob = bucket.blob(strategy_path)
-
-                        table_data = json.dumps({"rows": table_rows}, ensure_ascii=False).encode("utf-8")
-                        metrics_data = json.dumps(metrics, ensure_ascii=False).encode("utf-8")
-                        chart_data_json = json.dumps(chart_data, ensure_ascii=False).encode("utf-8")
-                        summary_data = json.dumps({"text": summary_text}, ensure_ascii=False).encode("utf-8")
-                        command_obj = {
-                            "intent": intent,
-                            "params": resolved_params,
-                            "confidence": confidence,
-                            "toolkitVersion": TOOLKIT_VERSION,
-                        }
-                        command_data = json.dumps(command_obj, ensure_ascii=False).encode("utf-8")
-                        strategy_obj = {
-                            "strategy": "fastpath",
-                            "version": TOOLKIT_VERSION,
-                            "timestamp": datetime.now(timezone.utc).isoformat(),
-                            "messageId": message_id,
-                            "question": question,
-                            "command": command_obj,
-                        }
-                        strategy_data = json.dumps(strategy_obj, ensure_ascii=False).encode("utf-8")
-
-                        with ThreadPoolExecutor(max_workers=6) as executor:
-                            futures = [
-                                executor.submit(table_blob.upload_from_string, table_data, content_type="application/json"),
-                                executor.submit(metrics_blob.upload_from_string, metrics_data, content_type="application/json"),
-                                executor.submit(chart_blob.upload_from_string, chart_data_json, content_type="application/json"),
-                                executor.submit(summary_blob.upload_from_string, summary_data, content_type="application/json"),
-                                executor.submit(command_blob.upload_from_string, command_data, content_type="application/json"),
-                                executor.submit(strategy_blob.upload_from_string, strategy_data, content_type="application/json"),
-                            ]
-                            for f in futures:
-                                f.result()
-                        table_url = _sign_gs_uri(f"gs://{FILES_BUCKET}/{table_path}")
-                        metrics_url = _sign_gs_uri(f"gs://{FILES_BUCKET}/{metrics_path}")
-                        chart_url = _sign_gs_uri(f"gs://{FILES_BUCKET}/{chart_path}")
-                        summary_url = _sign_gs_uri(f"gs://{FILES_BUCKET}/{summary_path}")
+                        # One object for the result payloads; strategy.json stays separate
+                        # because show-code discovery globs for it.
+                        bundle_data = _json_object({
+                            "table": {"rows": table_rows},
+                            "metrics": metrics,
+                            "chartData": chart_data,
+                            "summary": {"text": summary_text},
+                        }, command=command_data, strategy=strategy_data)
+                        futures = [
+                            _UPLOAD_POOL.submit(_upload_blob, bucket.blob(bundle_path), bundle_data),
+                            strategy_upload,
+                        ]
+                        for f in futures:
+                            f.result()
+                        bundle_url = _sign_gs_uri(f"gs://{FILES_BUCKET}/{bundle_path}")
                     except Exception as e:
                         yield _sse_format({"type": "error", "data": {"code": "PERSIST_FAILED", "message": str(e)}})
                         return
 
+                    title_text = _await_title(title_future)
+
                     _data = {
                         "messageId": message_id,
                         "summary": summary_text,
@@ -739,12 +1267,7 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
                         "chartData": chart_data,
                         "metrics": metrics,
                         "strategy": "fastpath",
-                        "uris": {
-                            "table": table_url,
-                            "metrics": metrics_url,
-                            "chartData": chart_url,
-                            "summary": summary_url,
-                        },
+                        "uris": {"bundle": bundle_url},
                     }
                     if isinstance(title_text, str) and title_text.strip():
                         _data["title"] = title_text.strip()
@@ -767,246 +1290,215 @@ def _events(session_id: str, dataset_id: str, uid: str, question: str) -> Iterab
                         pass
 
     # --- Main Generation and Validation Loop ---
-    yield _sse_format({"type": "generating_code"})
-    code, is_valid, validation_errors, warnings = "", False, ["Code generation failed."], []
+    # Release the reader before the (long) fallback; closing again in _events is a no-op
+    if parquet_future is not None:
+        _close_prefetched_parquet(parquet_future)
+    # Download the dataset into memory while code is being generated; the worker
+    # reads it by path instead of through a base64 copy embedded in its stdin JSON
+    parquet_path_future = _IO_POOL.submit(_download_to_memfd, bucket.blob(parquet_gcs_path))
+    _prewarm_worker()
+    try:
+        yield _SSE_GENERATING_CODE
+        code, is_valid, validation_errors, warnings = "", False, ["Code generation failed."], []
     
-    max_retries = 2
-    for attempt in range(max_retries):
-        try:
-            # Time-bounded code generation with keepalive pings
-            with ThreadPoolExecutor(max_workers=1) as ex:
-                fut = ex.submit(gemini_client.generate_code_and_summary, question, schema_snippet, sample_rows)
-                remaining = CODEGEN_TIMEOUT_SECONDS
-                while True:
-                    try:
-                        raw_code, llm_response_text = fut.result(timeout=min(remaining, 2))
-                        break
-                    except FuturesTimeout:
-                        # Keep the connection alive for the UI
-                        try:
-                            yield _sse_format({"type": "still_working"})
-                        except Exception:
-                            pass
-                        remaining -= 2
-                        if remaining <= 0:
-                            raise
-
-            if not raw_code:
-                # If code extraction fails, use the raw response for the repair prompt
-                validation_errors = [f"LLM did not return a valid code block. Response: {llm_response_text[:200]}"]
-                question = f"The previous attempt failed. Please fix it. The error was: {validation_errors[0]}. Original question: {question}"
-                continue # Retry
-
-            # Validate the generated code
-            is_valid, validation_errors, warnings = sandbox_runner.validate_code(raw_code)
+        max_retries = 2
+        for attempt in range(max_retries):
+            try:
+                # Time-bounded code generation with keepalive pings
+                fut = _LLM_POOL.submit(gemini_client.generate_code_and_summary, question, schema_snippet, sample_rows)
+                # Keep the connection alive for the UI
+                raw_code, llm_response_text = yield from _await_with_keepalive(fut, CODEGEN_TIMEOUT_SECONDS)
+
+                if not raw_code:
+                    # If code extraction fails, use the raw response for the repair prompt
+                    validation_errors = [f"LLM did not return a valid code block. Response: {llm_response_text[:200]}"]
+                    question = f"The previous attempt failed. Please fix it. The error was: {validation_errors[0]}. Original question: {question}"
+                    continue # Retry
+
+                # Validate the generated code
+                is_valid, validation_errors, warnings = sandbox_runner.validate_code(raw_code)
             
-            if is_valid:
-                code = raw_code
-                break # Success
-            else:
-                # If validation fails, use the errors for the repair prompt
-                question = f"The previous code failed validation. Please fix it. Errors: {'; '.join(validation_errors)}. Original question: {question}"
-
-        except FuturesTimeout:
-            # Application-level timeout for code generation
-            yield _sse_format({
-                "type": "error",
-                "data": {
-                    "code": "CODEGEN_TIMEOUT",
-                    "message": f"Analysis step took longer than {CODEGEN_TIMEOUT_SECONDS}s. Please rephrase or try again.",
-                },
-            })
-            return
-        except Exception as e:
-            validation_errors = [f"An unexpected error occurred during code generation: {e}"]
+                if is_valid:
+                    code = raw_code
+                    break # Success
+                else:
+                    # If validation fails, use the errors for the repair prompt
+                    question = f"The previous code failed validation. Please fix it. Errors: {'; '.join(validation_errors)}. Original question: {question}"
 
-    if not is_valid or not code:
-        yield _sse_format({"type": "error", "data": {"code": "CODE_VALIDATION_FAILED", "message": "; ".join(validation_errors)}})
-        return
+            except FuturesTimeout:
+                # Application-level timeout for code generation
+                yield _sse_format({
+                    "type": "error",
+                    "data": {
+                        "code": "CODEGEN_TIMEOUT",
+                        "message": f"Analysis step took longer than {CODEGEN_TIMEOUT_SECONDS}s. Please rephrase or try again.",
+                    },
+                })
+                return
+            except Exception as e:
+                validation_errors = [f"An unexpected error occurred during code generation: {e}"]
+
+        if not is_valid or not code:
+            yield _sse_format({"type": "error", "data": {"code": "CODE_VALIDATION_FAILED", "message": "; ".join(validation_errors)}})
+            return
     
-    # --- Emit the validated code so the UI can display it (even if execution fails) ---
-    try:
-        yield _sse_format({
-            "type": "code",
-            "data": {
-                "language": "python",
-                "text": code,
-                "warnings": (warnings or []),
-                "source": "fallback_execution",
-            }
-        })
-    except Exception:
-        # Non-fatal: continue workflow even if emitting this event fails
-        pass
+        # --- Emit the validated code so the UI can display it (even if execution fails) ---
+        try:
+            yield _sse_code_event(code, warnings, "fallback_execution")
+        except Exception:
+            # Non-fatal: continue workflow even if emitting this event fails
+            pass
 
-    # --- Execute the validated code (with one-time repair on failure) ---
-    yield _sse_format({"type": "running_fast"})
-    parquet_gcs_path = f"users/{uid}/sessions/{session_id}/datasets/{dataset_id}/cleaned/cleaned.parquet"
-    try:
-        parquet_blob = bucket.blob(parquet_gcs_path)
-        parquet_bytes = parquet_blob.download_as_bytes()
-        parquet_b64 = base64.b64encode(parquet_bytes).decode("ascii")
-    except Exception as e:
-        yield _sse_format({"type": "error", "data": {"code": "DATA_READ_FAILED", "message": str(e)}})
-        return
+        # --- Execute the validated code (with one-time repair on failure) ---
+        yield _SSE_RUNNING_FAST
+        try:
+            parquet_data = parquet_path_future.result()
+        except Exception as e:
+            yield _sse_format({"type": "error", "data": {"code": "DATA_READ_FAILED", "message": str(e)}})
+            return
 
-    def _run_once(code_to_run: str) -> dict:
-        worker_path = os.path.join(os.path.dirname(__file__), "worker.py")
-        proc = subprocess.run(
-            [sys.executable, worker_path],
-            input=json.dumps({
-                "code": code_to_run,
-                "parquet_b64": parquet_b64,
-                "ctx": {"question": question, "row_limit": 200},
-            }).encode("utf-8"),
-            capture_output=True,
-            timeout=HARD_TIMEOUT_SECONDS,
-        )
-        if proc.returncode != 0:
-            raise RuntimeError(f"Worker process failed: {proc.stderr.decode('utf-8', errors='ignore')}")
-        return json.loads(proc.stdout)
+        data_source, data_fds = _worker_data_source(parquet_data)
+
+        def _run_once(code_to_run: str) -> dict:
+            return _run_worker_job(
+                orjson.dumps({
+                    "code": code_to_run,
+                    "validated_digest": sandbox_runner.code_digest(code_to_run),
+                    "code_cache_dir": _code_cache_dir(),
+                    "arrow_out_dir": _worker_output_dir(),
+                    **data_source,
+                    "ctx": {"question": question, "row_limit": 200},
+                }),
+                HARD_TIMEOUT_SECONDS,
+                data_fds,
+            )
 
-    tried_repair = False
-    try:
-        result = _run_once(code)
-        if result.get("error"):
-            raise RuntimeError(f"Execution error: {result['error']}")
-    except subprocess.TimeoutExpired:
-        yield _sse_format({"type": "error", "data": {"code": "TIMEOUT_HARD", "message": f"Execution timed out after {HARD_TIMEOUT_SECONDS}s"}})
-        return
-    except Exception as e_first:
-        # Attempt a single repair using the runtime error
+        tried_repair = False
         try:
-            tried_repair = True
-            yield _sse_format({"type": "repairing"})
-            # Bound the repair step to avoid indefinite hangs
-            with ThreadPoolExecutor(max_workers=1) as ex:
-                future = ex.submit(gemini_client.repair_code, question, schema_snippet, sample_rows, code, str(e_first))
-                try:
-                    repaired = future.result(timeout=REPAIR_TIMEOUT_SECONDS)
-                except FuturesTimeout:
-                    yield _sse_format({"type": "error", "data": {"code": "REPAIR_TIMEOUT", "message": f"Repair step timed out after {REPAIR_TIMEOUT_SECONDS}s"}})
-                    return
-            ok2, errs2, warns2 = sandbox_runner.validate_code(repaired)
-            if not ok2:
-                yield _sse_format({"type": "error", "data": {"code": "CODE_VALIDATION_FAILED", "message": "; ".join(errs2)}})
-                return
-            code = repaired
-            warnings = warns2
-            # Emit updated code for the UI
-            try:
-                yield _sse_format({
-                    "type": "code",
-                    "data": {"language": "python", "text": code, "warnings": (warnings or []), "source": "fallback_execution"}
-                })
-            except Exception:
-                pass
-            # Re-run once
-            yield _sse_format({"type": "running_fast"})
             result = _run_once(code)
             if result.get("error"):
                 raise RuntimeError(f"Execution error: {result['error']}")
         except subprocess.TimeoutExpired:
             yield _sse_format({"type": "error", "data": {"code": "TIMEOUT_HARD", "message": f"Execution timed out after {HARD_TIMEOUT_SECONDS}s"}})
             return
-        except Exception as e_second:
-            # Final failure after repair attempt
-            yield _sse_format({"type": "error", "data": {"code": "EXEC_FAILED", "message": str(e_second)}})
-            return
+        except Exception as e_first:
+            # Attempt a single repair using the runtime error
+            try:
+                tried_repair = True
+                yield _SSE_REPAIRING
+                # Bound the repair step to avoid indefinite hangs
+                future = _LLM_POOL.submit(gemini_client.repair_code, question, schema_snippet, sample_rows, code, str(e_first))
+                try:
+                    repaired = future.result(timeout=REPAIR_TIMEOUT_SECONDS)
+                except FuturesTimeout:
+                    yield _sse_format({"type": "error", "data": {"code": "REPAIR_TIMEOUT", "message": f"Repair step timed out after {REPAIR_TIMEOUT_SECONDS}s"}})
+                    return
+                ok2, errs2, warns2 = sandbox_runner.validate_code(repaired)
+                if not ok2:
+                    yield _sse_format({"type": "error", "data": {"code": "CODE_VALIDATION_FAILED", "message": "; ".join(errs2)}})
+                    return
+                code = repaired
+                warnings = warns2
+                # Emit updated code for the UI
+                try:
+                    yield _sse_code_event(code, warnings, "fallback_execution")
+                except Exception:
+                    pass
+                # Re-run once
+                yield _SSE_RUNNING_FAST
+                result = _run_once(code)
+                if result.get("error"):
+                    raise RuntimeError(f"Execution error: {result['error']}")
+            except subprocess.TimeoutExpired:
+                yield _sse_format({"type": "error", "data": {"code": "TIMEOUT_HARD", "message": f"Execution timed out after {HARD_TIMEOUT_SECONDS}s"}})
+                return
+            except Exception as e_second:
+                # Final failure after repair attempt
+                yield _sse_format({"type": "error", "data": {"code": "EXEC_FAILED", "message": str(e_second)}})
+                return
 
-    # ✅ FIX 2: Correct key names (singular, not plural)
-    message_id = str(uuid.uuid4())
-    table = result.get("table", [])  # "table" not "tables"
-    chart_data = result.get("chartData", {})  # "chartData" not "charts"
-    metrics = result.get("metrics", {})
+        # ✅ FIX 2: Correct key names (singular, not plural)
+        message_id = str(uuid.uuid4())
+        table = result.get("table", [])  # "table" not "tables"
+        chart_data = result.get("chartData", {})  # "chartData" not "charts"
+        metrics = result.get("metrics", {})
+        if result.get("table_arrow_path"):
+            # Large DataFrame results arrive as an Arrow IPC file rather than JSON records
+            try:
+                table, total_rows, total_cols = _read_arrow_table(result["table_arrow_path"])
+            except Exception as e:
+                yield _sse_format({"type": "error", "data": {"code": "EXEC_FAILED", "message": f"Failed to read result table: {e}"}})
+                return
+            if total_rows * total_cols > _MAX_CELLS:
+                yield _sse_table_truncated(total_rows, total_cols)
+        else:
+            capped = _cap_records(table) if isinstance(table, list) else None
+            if capped is not None:
+                yield _sse_table_truncated(len(table), len(table[0]) if isinstance(table[0], dict) else 1)
+                table = capped
     
-    yield _sse_format({"type": "summarizing"})
-    summary = result.get("summary") or gemini_client.generate_summary(question, table[:5], metrics)
+        yield _SSE_SUMMARIZING
+        summary = result.get("summary") or gemini_client.generate_summary(question, table[:5], metrics)
     
-    # ✅ FIX 3: Add actual persistence logic
-    yield _sse_format({"type": "persisting"})
+        # ✅ FIX 3: Add actual persistence logic
+        yield _SSE_PERSISTING
     
-    results_prefix = f"users/{uid}/sessions/{session_id}/results/{message_id}"
-    table_path = f"{results_prefix}/fallback_table.json"
-    metrics_path = f"{results_prefix}/fallback_metrics.json"
-    chart_path = f"{results_prefix}/fallback_chart_data.json"
-    summary_path = f"{results_prefix}/summary.json"
-    strategy_path = f"{results_prefix}/strategy.json"
-    exec_code_path = f"{results_prefix}/fallback_exec_code.py"
+        results_prefix = f"users/{uid}/sessions/{session_id}/results/{message_id}"
+        # Optional title generation runs off the request path (see _generate_title_and_persist)
+        title_future = _TITLE_POOL.submit(_generate_title_and_persist, bucket, results_prefix, question, summary)
+        bundle_path = f"{results_prefix}/bundle.json"
+        strategy_path = f"{results_prefix}/strategy.json"
+        exec_code_path = f"{results_prefix}/fallback_exec_code.py"
     
-    try:
-        table_blob = bucket.blob(table_path)
-        metrics_blob = bucket.blob(metrics_path)
-        chart_blob = bucket.blob(chart_path)
-        summary_blob = bucket.blob(summary_path)
-        strategy_blob = bucket.blob(strategy_path)
-        exec_code_blob = bucket.blob(exec_code_path)
-        
-        table_data = json.dumps({"rows": table}, ensure_ascii=False).encode("utf-8")
-        metrics_data = json.dumps(metrics, ensure_ascii=False).encode("utf-8")
-        chart_data_json = json.dumps(chart_data, ensure_ascii=False).encode("utf-8")
-        summary_data = json.dumps({"text": summary}, ensure_ascii=False).encode("utf-8")
-        
-        # Upload in parallel (do not expose exec code URL)
-        strategy_obj = {
-            "strategy": "fallback",
-            "version": TOOLKIT_VERSION,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "messageId": message_id,
-            "question": question,
-        }
-        strategy_data = json.dumps(strategy_obj, ensure_ascii=False).encode("utf-8")
-
-        with ThreadPoolExecutor(max_workers=6) as executor:
+        try:
+            strategy_obj = {
+                "strategy": "fallback",
+                "version": TOOLKIT_VERSION,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "messageId": message_id,
+                "question": question,
+            }
+            strategy_data = _dumps(strategy_obj)
+            bundle_data = _json_object({
+                "table": {"rows": table},
+                "metrics": metrics,
+                "chartData": chart_data,
+                "summary": {"text": summary},
+            }, strategy=strategy_data)
+
+            # Upload in parallel (do not expose exec code URL)
             futures = [
-                executor.submit(table_blob.upload_from_string, table_data, content_type="application/json"),
-                executor.submit(metrics_blob.upload_from_string, metrics_data, content_type="application/json"),
-                executor.submit(chart_blob.upload_from_string, chart_data_json, content_type="application/json"), 
-                executor.submit(summary_blob.upload_from_string, summary_data, content_type="application/json"),
-                executor.submit(strategy_blob.upload_from_string, strategy_data, content_type="application/json"),
-                executor.submit(exec_code_blob.upload_from_string, code.encode("utf-8"), content_type="text/plain"),
+                _UPLOAD_POOL.submit(_upload_blob, bucket.blob(bundle_path), bundle_data),
+                _UPLOAD_POOL.submit(_upload_blob, bucket.blob(strategy_path), strategy_data),
+                _UPLOAD_POOL.submit(_upload_blob, bucket.blob(exec_code_path), code.encode("utf-8"), "text/plain"),
             ]
             for f in futures:
                 f.result()
         
-        # Generate signed URLs for frontend
-        table_url = _sign_gs_uri(f"gs://{FILES_BUCKET}/{table_path}")
-        metrics_url = _sign_gs_uri(f"gs://{FILES_BUCKET}/{metrics_path}")
-        chart_url = _sign_gs_uri(f"gs://{FILES_BUCKET}/{chart_path}")
-        summary_url = _sign_gs_uri(f"gs://{FILES_BUCKET}/{summary_path}")
+            # Generate signed URL for frontend
+            bundle_url = _sign_gs_uri(f"gs://{FILES_BUCKET}/{bundle_path}")
         
-    except Exception as e:
-        yield _sse_format({"type": "error", "data": {"code": "PERSIST_FAILED", "message": str(e)}})
-        return
+        except Exception as e:
+            yield _sse_format({"type": "error", "data": {"code": "PERSIST_FAILED", "message": str(e)}})
+            return
     
-    # Optional title generation (non-blocking)
-    title_text = None
-    try:
-        title_text = gemini_client.generate_title(question, summary)
-    except Exception as e:
-        try:
-            logging.info(json.dumps({"event": "title_generate_error", "detail": str(e)[:200]}))
-        except Exception:
-            pass
+        title_text = _await_title(title_future)
 
-    # Final 'done' event with URLs
-    _data = {
-        "messageId": message_id,
-        "summary": summary,
-        "tableSample": table[:200],  # Send up to 200 rows to frontend
-        "chartData": chart_data,
-        "metrics": metrics,
-        "strategy": "fallback",
-        "uris": {
-            "table": table_url,
-            "metrics": metrics_url,
-            "chartData": chart_url,
-            "summary": summary_url,
-        },
-    }
-    if isinstance(title_text, str) and title_text.strip():
-        _data["title"] = title_text.strip()
-    yield _sse_format({"type": "done", "data": _data})
+        # Final 'done' event with URLs
+        _data = {
+            "messageId": message_id,
+            "summary": summary,
+            "tableSample": table[:200],  # Send up to 200 rows to frontend
+            "chartData": chart_data,
+            "metrics": metrics,
+            "strategy": "fallback",
+            "uris": {"bundle": bundle_url},
+        }
+        if isinstance(title_text, str) and title_text.strip():
+            _data["title"] = title_text.strip()
+        yield _sse_format({"type": "done", "data": _data})
+    finally:
+        _remove_tempfile_when_done(parquet_path_future)
 
 
 @functions_framework.http
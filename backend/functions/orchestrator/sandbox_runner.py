@@ -17,9 +17,15 @@ Environment variable:
 
 from __future__ import annotations
 import ast
+import hashlib
+import io
 import os
+import re
+import tokenize
 import config
-from typing import Iterable, Tuple, Dict, List
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -41,141 +47,286 @@ if _SANDBOX_MODE in ("rich", "extended"):
     ALLOWED_IMPORTS.update(ALLOWED_IMPORTS_RICH)
 
 # Dangerous constructs and module prefixes
-FORBIDDEN_NAMES = {"exec", "eval", "compile", "open", "__import__", "globals", "locals", "input"}
+FORBIDDEN_NAMES = frozenset({"exec", "eval", "compile", "open", "__import__", "globals", "locals", "input"})
 
-FORBIDDEN_MODULE_PREFIXES = {
+FORBIDDEN_MODULE_PREFIXES = frozenset({
     "os", "sys", "subprocess", "socket", "asyncio", "multiprocessing",
     "threading", "ctypes", "pathlib", "importlib", "pdb", "pickle",
     "dill", "requests", "urllib",
-}
+})
 
 # Safety thresholds
 MAX_IMPORTS = 12
 MAX_LOOP_DEPTH = 4
 
+# Larger sources are validated without being memoized, bounding cache memory
+MAX_CACHED_CODE_LENGTH = 64_000
+
 
 # ---------------------------------------------------------------------------
 # AST Validator
 # ---------------------------------------------------------------------------
 
-class _Validator(ast.NodeVisitor):
-    """AST walker enforcing import, call, and naming safety rules."""
-
-    def __init__(self, allowlist: Iterable[str]):
-        super().__init__()
-        self.allowlist = set(allowlist)
-        self.errors: List[str] = []
-        self.warnings: List[str] = []
-        self.import_count = 0
-        self.loop_depth = 0
-
-    def _err(self, msg: str) -> None:
-        self.errors.append(msg)
-
-    def _warn(self, msg: str) -> None:
-        self.warnings.append(msg)
-
-    # -------------------------------
-    # Helpers: complex dtype detection
-    # -------------------------------
-    def _node_contains_complex(self, node: ast.AST) -> bool:
-        """Return True if the AST node subtree refers to complex dtype.
-
-        Matches any of the following patterns:
-        - Name 'complex' (built-in complex)
-        - Attribute whose attr startswith 'complex' (e.g., np.complex, complex64, complex128)
-        - Constant string containing 'complex' (e.g., "complex128")
-        """
-        for sub in ast.walk(node):
-            if isinstance(sub, ast.Name) and sub.id == "complex":
-                return True
-            if isinstance(sub, ast.Attribute) and isinstance(sub.attr, str) and sub.attr.lower().startswith("complex"):
-                return True
-            if isinstance(sub, ast.Constant) and isinstance(sub.value, str) and "complex" in sub.value.lower():
-                return True
-        return False
-
-    # -------------------------------
-    # Import Validation
-    # -------------------------------
-    def visit_Import(self, node: ast.Import) -> None:
-        self.import_count += 1
-        for alias in node.names:
-            root = (alias.name or "").split(".")[0]
-            if root not in self.allowlist:
-                self._err(f"Import not allowed: {alias.name}")
-            if root in FORBIDDEN_MODULE_PREFIXES:
-                self._err(f"Forbidden import: {alias.name}")
-        self.generic_visit(node)
-
-    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
-        self.import_count += 1
-        mod = node.module or ""
-        root = mod.split(".")[0]
-        if root not in self.allowlist:
-            self._err(f"Import from not allowed: {mod}")
-        if any(root == p or root.startswith(p + ".") for p in FORBIDDEN_MODULE_PREFIXES):
-            self._err(f"Forbidden import from: {mod}")
-        self.generic_visit(node)
-
-    # -------------------------------
-    # Function & Call Validation
-    # -------------------------------
-    def visit_Call(self, node: ast.Call) -> None:
-        # Forbid dangerous builtins
-        if isinstance(node.func, ast.Name) and node.func.id in FORBIDDEN_NAMES:
-            self._err(f"Forbidden call: {node.func.id}")
-
-        # Forbid direct usage of complex() builtin or np.complex* as a callable
-        if (isinstance(node.func, ast.Name) and node.func.id == "complex") or (
-            isinstance(node.func, ast.Attribute) and isinstance(node.func.attr, str) and node.func.attr.lower().startswith("complex")
-        ):
-            self._err("Complex dtype is not allowed. Use float via pd.to_numeric(..., errors='coerce') instead.")
-
-        # Forbid dtype=complex or astype(complex)
-        # 1) dtype keyword anywhere
-        for kw in getattr(node, "keywords", []) or []:
-            if kw.arg == "dtype" and kw.value is not None and self._node_contains_complex(kw.value):
-                self._err("Complex dtype is not allowed (dtype=complex).")
-
-        # 2) astype(complex) or astype(np.complex*) patterns
-        if isinstance(node.func, ast.Attribute) and node.func.attr == "astype":
-            # check positional first arg
-            if node.args:
-                if self._node_contains_complex(node.args[0]):
-                    self._err("Complex dtype is not allowed (astype(complex)).")
-            # or keyword dtype
-            for kw in getattr(node, "keywords", []) or []:
-                if kw.arg == "dtype" and kw.value is not None and self._node_contains_complex(kw.value):
-                    self._err("Complex dtype is not allowed (astype(dtype=complex)).")
-        self.generic_visit(node)
-
-    def visit_Attribute(self, node: ast.Attribute) -> None:
-        if node.attr.startswith("__") and node.attr.endswith("__"):
-            self._err("Use of dunder attributes is not allowed")
-        self.generic_visit(node)
-
-    def visit_Name(self, node: ast.Name) -> None:
-        if node.id.startswith("__") and node.id.endswith("__"):
-            self._err("Use of dunder names is not allowed")
-        self.generic_visit(node)
-
-    # -------------------------------
-    # Structural Safety Checks
-    # -------------------------------
-    def visit_For(self, node: ast.For) -> None:
-        self.loop_depth += 1
-        if self.loop_depth > MAX_LOOP_DEPTH:
-            self._warn(f"Deeply nested loop detected (depth {self.loop_depth})")
-        self.generic_visit(node)
-        self.loop_depth -= 1
-
-    def visit_While(self, node: ast.While) -> None:
-        self.loop_depth += 1
-        if self.loop_depth > MAX_LOOP_DEPTH:
-            self._warn(f"Deeply nested loop detected (depth {self.loop_depth})")
-        self.generic_visit(node)
-        self.loop_depth -= 1
+# Error sink passed to every rule (the bound `errors.append` of the current walk)
+_Err = Callable[[str], None]
+
+
+def _node_contains_complex(node: ast.AST) -> bool:
+    """Return True if the AST node subtree refers to complex dtype.
+
+    Matches any of the following patterns:
+    - Name 'complex' (built-in complex)
+    - Attribute whose attr startswith 'complex' (e.g., np.complex, complex64, complex128)
+    - Constant string containing 'complex' (e.g., "complex128")
+    """
+    for sub in ast.walk(node):
+        if isinstance(sub, ast.Name) and sub.id == "complex":
+            return True
+        if isinstance(sub, ast.Attribute) and isinstance(sub.attr, str) and sub.attr.lower().startswith("complex"):
+            return True
+        if isinstance(sub, ast.Constant) and isinstance(sub.value, str) and "complex" in sub.value.lower():
+            return True
+    return False
+
+
+def _check_call(node: ast.Call, allowlist: FrozenSet[str], err: _Err) -> None:
+    """Call-level rules: forbidden builtins and complex dtypes."""
+    func = node.func
+    # Forbid dangerous builtins
+    if isinstance(func, ast.Name) and func.id in FORBIDDEN_NAMES:
+        err(f"Forbidden call: {func.id}")
+    _check_call_dtypes(node, allowlist, err)
+
+
+def _check_call_dtypes(node: ast.Call, allowlist: FrozenSet[str], err: _Err) -> None:
+    """Complex-dtype rules for calls; the part of _check_call that applies to any source."""
+    func = node.func
+    # Forbid direct usage of complex() builtin or np.complex* as a callable
+    if (isinstance(func, ast.Name) and func.id == "complex") or (
+        isinstance(func, ast.Attribute) and isinstance(func.attr, str) and func.attr.lower().startswith("complex")
+    ):
+        err("Complex dtype is not allowed. Use float via pd.to_numeric(..., errors='coerce') instead.")
+
+    # Forbid dtype=complex or astype(complex)
+    # 1) dtype keyword anywhere
+    for kw in node.keywords:
+        if kw.arg == "dtype" and kw.value is not None and _node_contains_complex(kw.value):
+            err("Complex dtype is not allowed (dtype=complex).")
+
+    # 2) astype(complex) or astype(np.complex*) patterns
+    if isinstance(func, ast.Attribute) and func.attr == "astype":
+        # check positional first arg
+        if node.args and _node_contains_complex(node.args[0]):
+            err("Complex dtype is not allowed (astype(complex)).")
+        # or keyword dtype
+        for kw in node.keywords:
+            if kw.arg == "dtype" and kw.value is not None and _node_contains_complex(kw.value):
+                err("Complex dtype is not allowed (astype(dtype=complex)).")
+
+
+def _check_loop_depth(node: ast.AST, depth: int, warn: _Err) -> None:
+    """Warns on For/While nesting beyond MAX_LOOP_DEPTH.
+
+    Loops are statements, so only statement-bearing children are followed; expression
+    subtrees (which make up most of the tree) are never entered.
+    """
+    for child in ast.iter_child_nodes(node):
+        if not isinstance(child, (ast.stmt, ast.excepthandler, ast.match_case)):
+            continue
+        child_depth = depth
+        if isinstance(child, (ast.For, ast.While)):
+            child_depth += 1
+            if child_depth > MAX_LOOP_DEPTH:
+                warn(f"Deeply nested loop detected (depth {child_depth})")
+        _check_loop_depth(child, child_depth, warn)
+
+
+def _is_dunder(s: str) -> bool:
+    """Same answer as `s.startswith("__") and s.endswith("__")`; most names fail on s[0]."""
+    return len(s) >= 2 and s[0] == "_" and s[1] == "_" and s[-1] == "_" and s[-2] == "_"
+
+
+def _check_name(node: ast.Name, allowlist: FrozenSet[str], err: _Err) -> None:
+    if _is_dunder(node.id):
+        err("Use of dunder names is not allowed")
+
+
+def _check_attribute(node: ast.Attribute, allowlist: FrozenSet[str], err: _Err) -> None:
+    if _is_dunder(node.attr):
+        err("Use of dunder attributes is not allowed")
+
+
+def _check_import(node: ast.Import, allowlist: FrozenSet[str], err: _Err) -> None:
+    for alias in node.names:
+        root = (alias.name or "").partition(".")[0]
+        if root not in allowlist:
+            err(f"Import not allowed: {alias.name}")
+        if root in FORBIDDEN_MODULE_PREFIXES:
+            err(f"Forbidden import: {alias.name}")
+
+
+def _check_import_from(node: ast.ImportFrom, allowlist: FrozenSet[str], err: _Err) -> None:
+    mod = node.module or ""
+    root = mod.partition(".")[0]
+    if root not in allowlist:
+        err(f"Import from not allowed: {mod}")
+    # `root` has no dots, so the old `root == p or root.startswith(p + ".")` scan
+    # reduces to a single hash lookup
+    if root in FORBIDDEN_MODULE_PREFIXES:
+        err(f"Forbidden import from: {mod}")
+
+
+def _check_import_allowlist(node: ast.Import, allowlist: FrozenSet[str], err: _Err) -> None:
+    for alias in node.names:
+        if (alias.name or "").partition(".")[0] not in allowlist:
+            err(f"Import not allowed: {alias.name}")
+
+
+def _check_import_from_allowlist(node: ast.ImportFrom, allowlist: FrozenSet[str], err: _Err) -> None:
+    mod = node.module or ""
+    if mod.partition(".")[0] not in allowlist:
+        err(f"Import from not allowed: {mod}")
+
+
+# Node type -> rule, looked up once per node in _validate_tree. Keyed on the exact
+# type, so node classes without rules cost a single dict miss.
+_NODE_CHECKS: Dict[type, Callable[[Any, FrozenSet[str], _Err], None]] = {
+    ast.Name: _check_name,
+    ast.Attribute: _check_attribute,
+    ast.Call: _check_call,
+    ast.Import: _check_import,
+    ast.ImportFrom: _check_import_from,
+}
+
+# Rules for source that _FORBIDDEN_TOKEN_RE found clean: no identifier in it can be a
+# forbidden builtin or module, so only the allowlist, dunder and dtype rules remain.
+_NODE_CHECKS_CLEAN: Dict[type, Callable[[Any, FrozenSet[str], _Err], None]] = {
+    ast.Name: _check_name,
+    ast.Attribute: _check_attribute,
+    ast.Call: _check_call_dtypes,
+    ast.Import: _check_import_allowlist,
+    ast.ImportFrom: _check_import_from_allowlist,
+}
+
+# Any forbidden call or import in ASCII source has to spell its name as a whole
+# identifier somewhere, so a miss here proves the forbidden-name rules cannot fire
+_FORBIDDEN_TOKEN_RE = re.compile(
+    r"\b(?:" + "|".join(sorted(map(re.escape, FORBIDDEN_NAMES | FORBIDDEN_MODULE_PREFIXES))) + r")\b"
+)
+_IMPORT_NODES = (ast.Import, ast.ImportFrom)
+
+
+class _ValidationError(Exception):
+    """Raised by the fail-fast error sink to abandon the walk at the first offense."""
+
+
+def _raise_validation_error(msg: str) -> None:
+    raise _ValidationError(msg)
+
+
+def _validate_tree(
+    tree: ast.Module, allowlist: FrozenSet[str], screened: bool = False, fast: bool = False
+) -> Tuple[List[str], List[str], int, bool]:
+    """Enforces import, call, and naming safety rules in a single `ast.walk` pass.
+
+    The same pass looks for the module-level `def run(df, ctx):` entrypoint. With
+    `screened=True` (source already known to contain no forbidden identifier) the
+    forbidden-name rules are skipped. With `fast=True` the first error raises
+    _ValidationError instead of being collected.
+
+    Returns:
+        (errors, warnings, import_count, has_run_func)
+    """
+    errors: List[str] = []
+    warnings: List[str] = []
+    err = _raise_validation_error if fast else errors.append
+    import_count = 0
+    has_run_func = False
+    top_level = {id(stmt) for stmt in tree.body}
+    checks = (_NODE_CHECKS_CLEAN if screened else _NODE_CHECKS).get
+    FunctionDef = ast.FunctionDef
+
+    for node in ast.walk(tree):
+        t = type(node)
+        check = checks(t)
+        if check is not None:
+            check(node, allowlist, err)
+            if isinstance(node, _IMPORT_NODES):
+                import_count += 1
+        elif t is FunctionDef and not has_run_func and node.name == "run" and id(node) in top_level:
+            args = node.args.args
+            has_run_func = len(args) >= 2 and args[0].arg == "df" and args[1].arg == "ctx"
+
+    # Structural safety checks
+    _check_loop_depth(tree, 0, warnings.append)
+    return errors, warnings, import_count, has_run_func
+
+
+def _import_offense(keyword: str, module: str, allowlist: FrozenSet[str]) -> Optional[str]:
+    """The first message the AST rules give for `import module` / `from module import`."""
+    root = module.partition(".")[0]
+    if keyword == "import":
+        if root not in allowlist:
+            return f"Import not allowed: {module}"
+        if root in FORBIDDEN_MODULE_PREFIXES:
+            return f"Forbidden import: {module}"
+    else:
+        if root not in allowlist:
+            return f"Import from not allowed: {module}"
+        if root in FORBIDDEN_MODULE_PREFIXES:
+            return f"Forbidden import from: {module}"
+    return None
+
+
+def _first_token_offense(code: str, allowlist: FrozenSet[str]) -> Optional[str]:
+    """Cheap pre-parse rejection for fail-fast validation.
+
+    Scans tokens for the first module of a statement-level `import`/`from` and for
+    forbidden builtins called by bare name. Only reports offenses the AST rules would
+    also report; returns None when unsure (relative imports, tokenizer errors, ...),
+    leaving the verdict to the full parse.
+    """
+    NAME, OP = tokenize.NAME, tokenize.OP
+    stmt_start = True
+    keyword = None           # "import"/"from" whose module name is being read
+    parts: List[str] = []
+    expect_name = False
+    suspect = None           # forbidden name waiting to see whether "(" follows
+    prev = ""
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(code).readline):
+            t, s = tok.type, tok.string
+            if t in (tokenize.COMMENT, tokenize.NL):
+                continue
+            if suspect is not None:
+                if t == OP and s == "(":
+                    return f"Forbidden call: {suspect}"
+                suspect = None
+            if keyword is not None:
+                if t == NAME and expect_name:
+                    parts.append(s)
+                    expect_name = False
+                    prev = s
+                    continue
+                if t == OP and s == "." and parts and not expect_name:
+                    expect_name = True
+                    prev = s
+                    continue
+                if parts:
+                    offense = _import_offense(keyword, ".".join(parts), allowlist)
+                    if offense:
+                        return offense
+                keyword = None
+            if t == NAME:
+                if stmt_start and s in ("import", "from"):
+                    keyword, parts, expect_name = s, [], True
+                elif s in FORBIDDEN_NAMES and prev not in (".", "def", "class", "case"):
+                    suspect = s
+            stmt_start = t in (tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT) or (t == OP and s == ";")
+            prev = s
+    except (tokenize.TokenError, SyntaxError):
+        return None
+    return None
 
 
 # ---------------------------------------------------------------------------
@@ -184,47 +335,80 @@ class _Validator(ast.NodeVisitor):
 
 def validate_code(
     code: str,
-    allowlist: Iterable[str] | None = None
+    allowlist: Iterable[str] | None = None,
+    *,
+    fast: bool = False,
 ) -> Tuple[bool, List[str], List[str]]:
     """
     Validate Python code against structural and security rules.
 
+    With `fast=True` validation stops at the first error, which is then the only one
+    reported; use it where only the verdict matters.
+
     Returns:
         (is_valid, errors, warnings)
     """
     if not code or not isinstance(code, str):
         return False, ["Empty or invalid code string."], []
 
+    # Determine which allowlist to apply
+    allowlist_to_use = frozenset(allowlist) if allowlist else frozenset(ALLOWED_IMPORTS)
+    if len(code) < MAX_CACHED_CODE_LENGTH:
+        ok, errors, warnings = _validate_cached(code, allowlist_to_use, fast)
+    else:
+        ok, errors, warnings = _validate_cached.__wrapped__(code, allowlist_to_use, fast)
+    # Fresh lists per call so callers cannot mutate the cached result
+    return ok, list(errors), list(warnings)
+
+
+@lru_cache(maxsize=256)
+def _validate_cached(
+    code: str,
+    allowlist: FrozenSet[str],
+    fast: bool = False,
+) -> Tuple[bool, Tuple[str, ...], Tuple[str, ...]]:
+    """Parse-and-walk behind validate_code, memoized since retries often revalidate identical code."""
+    if fast:
+        # Rejected imports/calls usually sit at the top; skip building the tree for them
+        offense = _first_token_offense(code, allowlist)
+        if offense:
+            return False, (offense,), ()
     try:
-        tree = ast.parse(code)
+        # ast.parse without its Python wrapper; "<unknown>" keeps SyntaxError text identical
+        tree = compile(code, "<unknown>", "exec", ast.PyCF_ONLY_AST, dont_inherit=True)
     except SyntaxError as e:
-        return False, [f"SyntaxError: {e}"], []
+        return False, (f"SyntaxError: {e}",), ()
 
-    # Ensure required entrypoint exists
-    has_run_func = False
-    for node in tree.body:
-        if isinstance(node, ast.FunctionDef) and node.name == "run":
-            args = node.args.args
-            if len(args) >= 2 and args[0].arg == "df" and args[1].arg == "ctx":
-                has_run_func = True
-                break
-    if not has_run_func:
-        return False, ["Missing required function: def run(df, ctx):"], []
+    # Only ASCII source is screened: Python NFKC-normalizes identifiers, so fullwidth or
+    # math-alphanumeric spellings parse to forbidden names the regex cannot see
+    screened = code.isascii() and _FORBIDDEN_TOKEN_RE.search(code) is None
+    try:
+        errors, warnings, import_count, has_run_func = _validate_tree(tree, allowlist, screened, fast)
+    except _ValidationError as e:
+        return False, (str(e),), ()
 
-    # Determine which allowlist to apply
-    allowlist_to_use = set(allowlist) if allowlist else set(ALLOWED_IMPORTS)
-    validator = _Validator(allowlist_to_use)
-    validator.visit(tree)
+    # A missing entrypoint is reported on its own, as before
+    if not has_run_func:
+        return False, ("Missing required function: def run(df, ctx):",), ()
 
     # Apply import/loop sanity warnings
-    if validator.import_count > MAX_IMPORTS:
-        validator._warn(f"Too many imports ({validator.import_count} > {MAX_IMPORTS})")
+    if import_count > MAX_IMPORTS:
+        warnings.append(f"Too many imports ({import_count} > {MAX_IMPORTS})")
+
+    ok = len(errors) == 0
+    return ok, tuple(errors), tuple(warnings)
 
-    ok = len(validator.errors) == 0
-    return ok, validator.errors, validator.warnings
 
+def code_digest(code: str) -> str:
+    """Short blake2b digest identifying a code string that has passed validate_code.
 
-def structured_validate(code: str) -> Dict[str, any]:
+    The orchestrator sends it alongside already-validated code so the worker can skip
+    re-parsing the same text in its fresh process.
+    """
+    return hashlib.blake2b(code.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def structured_validate(code: str) -> Dict[str, Any]:
     """
     Return a structured dict for downstream use (e.g., LLM repair loop).
     """
@@ -242,15 +426,22 @@ def structured_validate(code: str) -> Dict[str, any]:
 # Stub Execution (compatibility placeholder)
 # ---------------------------------------------------------------------------
 
+# Constant stub payload shared by every call; sequences are tuples (they serialize as JSON arrays)
+_STUB_RESULT = MappingProxyType({
+    "table": ({"category": "A", "value": 1}, {"category": "B", "value": 2}),
+    "metrics": {},
+    "chartData": {
+        "kind": "bar",
+        "labels": ("A", "B"),
+        "series": ({"label": "Value", "data": (1, 2)},),
+    },
+    "message": f"Sandbox validation ready (mode={_SANDBOX_MODE}). Execution not yet implemented.",
+})
+
+
 def run_user_code_stub() -> dict:
-    """Simple placeholder result for systems not yet executing code."""
-    return {
-        "table": [{"category": "A", "value": 1}, {"category": "B", "value": 2}],
-        "metrics": {},
-        "chartData": {
-            "kind": "bar",
-            "labels": ["A", "B"],
-            "series": [{"label": "Value", "data": [1, 2]}],
-        },
-        "message": f"Sandbox validation ready (mode={_SANDBOX_MODE}). Execution not yet implemented.",
-    }
+    """Simple placeholder result for systems not yet executing code.
+
+    Returns a shallow copy of _STUB_RESULT; deep-copy it before mutating nested values.
+    """
+    return dict(_STUB_RESULT)
@@ -11,6 +11,25 @@ import aliases
 # Sample column list for testing
 COLUMN_NAMES = ["revenue", "revenue_diff", "quantity", "category", "department", "Customer Name"]
 
+# Ensure the ALIASES dict is consistent for every test in this module
+TEST_ALIASES = {
+    "profit": "revenue_diff",
+    "sales": "revenue",
+    "rev": "revenue",
+    "qty": "quantity",
+    "count": "quantity",
+    "cat": "category",
+    "dept": "department",
+    "seg": "segment",
+}
+
+@pytest.fixture(scope="module", autouse=True)
+def _patched_aliases():
+    """Swaps in TEST_ALIASES once for the module instead of once per parametrized case."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(aliases, "ALIASES", TEST_ALIASES)
+        yield
+
 # Test cases for resolve_column, covering all logic paths
 @pytest.mark.parametrize("alias, column_names, expected", [
     # 1. Exact matches
@@ -38,20 +57,8 @@ COLUMN_NAMES = ["revenue", "revenue_diff", "quantity", "category", "department",
     (None, COLUMN_NAMES, None),                   # None input
     ("revenue", [], None),                         # Empty column list
 ])
-def test_resolve_column(alias, column_names, expected, monkeypatch):
+def test_resolve_column(alias, column_names, expected):
     """
     Tests the resolve_column function with various aliases, column lists, and scenarios.
     """
-    # Ensure the ALIASES dict is consistent for this test
-    test_aliases = {
-        "profit": "revenue_diff",
-        "sales": "revenue",
-        "rev": "revenue",
-        "qty": "quantity",
-        "count": "quantity",
-        "cat": "category",
-        "dept": "department",
-        "seg": "segment",
-    }
-    monkeypatch.setattr(aliases, "ALIASES", test_aliases)
     assert aliases.resolve_column(alias, column_names) == expected
\ No newline at end of file
@@ -10,31 +10,28 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 # Now, import the module
 import analysis_toolkit
 
-# Test cases for the run_aggregation function
-def test_run_aggregation_sum():
-    """
-    Tests the run_aggregation function with the 'sum' aggregation.
-    """
-    data = {'category': ['A', 'B', 'A', 'B'], 'value': [10, 20, 5, 15]}
-    df = pd.DataFrame(data)
-    result_df = analysis_toolkit.run_aggregation(df, 'category', 'value', 'sum')
-    
-    # Expected output is sorted by the aggregated value, descending
-    expected_data = {'category': ['B', 'A'], 'value_sum': [35, 15]}
-    expected_df = pd.DataFrame(expected_data)
-    pd.testing.assert_frame_equal(result_df, expected_df)
+# Shared inputs; the toolkit functions return new DataFrames, so one instance per module is safe
+@pytest.fixture(scope="module")
+def agg_df():
+    return pd.DataFrame({'category': ['A', 'B', 'A', 'B'], 'value': [10, 20, 5, 15]})
+
+@pytest.fixture(scope="module")
+def sort_df():
+    return pd.DataFrame({'name': ['A', 'B', 'C', 'D'], 'value': [10, 5, 20, 15]})
 
-def test_run_aggregation_mean():
+# Test cases for the run_aggregation function
+@pytest.mark.parametrize("agg, expected_values", [
+    ('sum', [35, 15]),
+    ('mean', [17.5, 7.5]),
+])
+def test_run_aggregation(agg_df, agg, expected_values):
     """
-    Tests the run_aggregation function with the 'mean' aggregation.
+    Tests the run_aggregation function with the 'sum' and 'mean' aggregations.
     """
-    data = {'category': ['A', 'B', 'A', 'B'], 'value': [10, 20, 5, 15]}
-    df = pd.DataFrame(data)
-    result_df = analysis_toolkit.run_aggregation(df, 'category', 'value', 'mean')
+    result_df = analysis_toolkit.run_aggregation(agg_df, 'category', 'value', agg)
 
     # Expected output is sorted by the aggregated value, descending
-    expected_data = {'category': ['B', 'A'], 'value_mean': [17.5, 7.5]}
-    expected_df = pd.DataFrame(expected_data)
+    expected_df = pd.DataFrame({'category': ['B', 'A'], f'value_{agg}': expected_values})
     pd.testing.assert_frame_equal(result_df, expected_df)
 
 # Test cases for the run_variance function
@@ -63,24 +60,13 @@ def test_run_variance():
     pd.testing.assert_frame_equal(result_df, expected_df, atol=1e-6)
 
 # Test cases for the run_filter_and_sort function
-def test_run_filter_and_sort_ascending():
-    """
-    Tests the run_filter_and_sort function with ascending sort.
-    """
-    data = {'name': ['A', 'B', 'C', 'D'], 'value': [10, 5, 20, 15]}
-    df = pd.DataFrame(data)
-    result_df = analysis_toolkit.run_filter_and_sort(df, 'value', ascending=True, limit=3)
-    expected_df = df.sort_values('value', kind='mergesort').head(3).reset_index(drop=True)
-    pd.testing.assert_frame_equal(result_df, expected_df)
-
-def test_run_filter_and_sort_descending():
+@pytest.mark.parametrize("ascending", [True, False])
+def test_run_filter_and_sort(sort_df, ascending):
     """
-    Tests the run_filter_and_sort function with descending sort.
+    Tests the run_filter_and_sort function with ascending and descending sort.
     """
-    data = {'name': ['A', 'B', 'C', 'D'], 'value': [10, 5, 20, 15]}
-    df = pd.DataFrame(data)
-    result_df = analysis_toolkit.run_filter_and_sort(df, 'value', ascending=False, limit=3)
-    expected_df = df.sort_values('value', ascending=False, kind='mergesort').head(3).reset_index(drop=True)
+    result_df = analysis_toolkit.run_filter_and_sort(sort_df, 'value', ascending=ascending, limit=3)
+    expected_df = sort_df.sort_values('value', ascending=ascending, kind='mergesort').head(3).reset_index(drop=True)
     pd.testing.assert_frame_equal(result_df, expected_df)
 
 def test_run_filter_and_sort_with_filter():
@@ -10,23 +10,24 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 # Now, import the module
 import gemini_client
 
-# Fixture to correctly mock the Gemini client dependencies
-@pytest.fixture
-def mock_gemini_client(monkeypatch):
+# Fixture to correctly mock the Gemini client dependencies. Module-scoped: the patches
+# are installed and torn down once, and each test sets the response it expects.
+@pytest.fixture(scope="module")
+def mock_gemini_client():
     """
     Mocks the Gemini API key, configure function, and the GenerativeModel 
     to prevent actual API calls and configuration errors.
     """
-    # Patch the module-level _API_KEY variable directly
-    monkeypatch.setattr(gemini_client, "_API_KEY", "test-key")
-    
-    # Patch the genai.configure function to do nothing
-    monkeypatch.setattr(gemini_client.genai, "configure", lambda api_key: None)
-    
-    # Reset the _configured flag to ensure the mock setup runs
-    monkeypatch.setattr(gemini_client, "_configured", False)
+    with pytest.MonkeyPatch.context() as mp, patch('gemini_client.genai.GenerativeModel') as mock_genai_model:
+        # Patch the module-level _API_KEY variable directly
+        mp.setattr(gemini_client, "_API_KEY", "test-key")
+
+        # Patch the genai.configure function to do nothing
+        mp.setattr(gemini_client.genai, "configure", lambda api_key: None)
+
+        # Reset the _configured flag to ensure the mock setup runs
+        mp.setattr(gemini_client, "_configured", False)
 
-    with patch('gemini_client.genai.GenerativeModel') as mock_genai_model:
         mock_response = MagicMock()
         mock_response.text = "Default mocked response"
         mock_genai_model.return_value.generate_content.return_value = mock_response
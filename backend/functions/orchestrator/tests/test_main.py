@@ -1,3 +1,6 @@
+import base64
+import io
+
 import pytest
 from unittest.mock import patch, MagicMock
 
@@ -9,6 +12,17 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 # Now, import the module
 import main
 
+@pytest.fixture(autouse=True)
+def _clear_signed_url_cache():
+    """Keeps signed URLs and GCS handles cached by one test from leaking into the next."""
+    main._SIGNED_URL_CACHE.clear()
+    main._get_storage_client.cache_clear()
+    main._get_bucket.cache_clear()
+    yield
+    main._SIGNED_URL_CACHE.clear()
+    main._get_storage_client.cache_clear()
+    main._get_bucket.cache_clear()
+
 # Test cases for the _origin_allowed function
 @pytest.mark.parametrize("origin, allowed_origins, expected", [
     ("http://localhost:5173", {"http://localhost:5173", "https://example.com"}, True),
@@ -65,4 +79,268 @@ def test_sign_gs_uri_exception(mock_storage_client):
     """
     Tests that _sign_gs_uri returns the original URI when an exception occurs.
     """
-    assert main._sign_gs_uri("gs://test-bucket/test-object") == "gs://test-bucket/test-object"
\ No newline at end of file
+    assert main._sign_gs_uri("gs://test-bucket/test-object") == "gs://test-bucket/test-object"
+
+def test_get_payload_caches_parsed_dict(monkeypatch):
+    """
+    Tests that _get_payload downloads payload.json once and serves repeats from cache.
+    """
+    monkeypatch.setattr(main, "_PAYLOAD_CACHE", main.TTLCache(maxsize=4, ttl=60))
+    mock_blob = MagicMock()
+    mock_blob.generation = 1
+    mock_blob.download_as_bytes.return_value = b'{"columns": {"a": {}}}'
+    mock_bucket = MagicMock()
+    mock_bucket.blob.return_value = mock_blob
+
+    first = main._get_payload(mock_bucket, "users/u/sessions/s/datasets/d/metadata/payload.json")
+    second = main._get_payload(mock_bucket, "users/u/sessions/s/datasets/d/metadata/payload.json")
+
+    assert first == {"columns": {"a": {}}}
+    assert second is first
+    mock_blob.download_as_bytes.assert_called_once()
+    mock_blob.reload.assert_not_called()
+
+
+@patch("main.storage.Client")
+@patch("main._impersonated_signing_credentials")
+def test_sign_gs_uri_reuses_cached_url(mock_creds, mock_storage_client):
+    """
+    Tests that signing the same gs:// URI twice only generates one signed URL.
+    """
+    mock_blob = MagicMock()
+    mock_blob.generate_signed_url.return_value = "https://signed.url"
+    mock_storage_client.return_value.bucket.return_value.blob.return_value = mock_blob
+
+    assert main._sign_gs_uri("gs://test-bucket/test-object") == "https://signed.url"
+    assert main._sign_gs_uri("gs://test-bucket/test-object") == "https://signed.url"
+    mock_blob.generate_signed_url.assert_called_once()
+
+
+def test_await_with_keepalive_returns_result_and_times_out(monkeypatch):
+    """
+    Tests that _await_with_keepalive returns a settled result without pings and raises past the deadline.
+    """
+    from concurrent.futures import Future, TimeoutError as FuturesTimeout
+
+    done = Future()
+    done.set_result("ok")
+    gen = main._await_with_keepalive(done, 5)
+    with pytest.raises(StopIteration) as stop:
+        next(gen)
+    assert stop.value.value == "ok"
+
+    monkeypatch.setattr(main, "STILL_WORKING_INTERVAL_SECONDS", 0.01)
+    pending = Future()
+    events = []
+    with pytest.raises(FuturesTimeout):
+        for ev in main._await_with_keepalive(pending, 0.05):
+            events.append(ev)
+    assert events and all(b"still_working" in ev for ev in events)
+
+
+def test_df_to_records_matches_to_dict():
+    import pandas as pd
+    df = pd.DataFrame({"region": ["N", "S", None], "sales": [1.5, 2.0, 3.0], "qty": [1, 2, 3]})
+    assert main._df_to_records(df, 2) == df.head(2).to_dict(orient="records")
+    assert main._df_to_records(df.iloc[0:0]) == []
+    mixed = pd.DataFrame({"v": [1, "a"], "ts": pd.to_datetime(["2024-01-01", "2024-01-02"])})
+    assert main._df_to_records(mixed) == mixed.to_dict(orient="records")
+
+
+def test_run_worker_job_uses_forked_worker():
+    """
+    Tests that a job runs in a child of the worker fork server and its result comes back
+    over the job socket, with user prints kept out of it.
+    """
+    import orjson
+    import pandas as pd
+    buf = io.BytesIO()
+    pd.DataFrame({"a": [1, 2]}).to_parquet(buf)
+    code = "def run(df, ctx):\n    print('noise')\n    return {'metrics': {'n': int(df['a'].sum())}}"
+    payload = orjson.dumps({"code": code, "parquet_b64": base64.b64encode(buf.getvalue()).decode(), "ctx": {}})
+    result = main._run_worker_job(payload, 60)
+    assert result["metrics"] == {"n": 3}
+    assert result["table"] == [{"a": 1}, {"a": 2}]
+
+
+def test_run_worker_job_reports_unserializable_result_as_error():
+    """
+    Tests that a forked worker whose result cannot be serialized (tuple dict keys) sends
+    back a runtime error result for the repair loop, not truncated JSON.
+    """
+    import orjson
+    import pandas as pd
+    buf = io.BytesIO()
+    pd.DataFrame({"a": ["x", "y"], "b": [1, 2], "v": [3, 4]}).to_parquet(buf)
+    code = "def run(df, ctx):\n    return {'metrics': {'by': df.groupby(['a', 'b'])['v'].sum().to_dict()}}"
+    payload = orjson.dumps({"code": code, "parquet_b64": base64.b64encode(buf.getvalue()).decode(), "ctx": {}})
+    result = main._run_worker_job(payload, 60)
+    assert result["error"] == "Runtime error: keys must be str, int, float, bool or None, not tuple"
+    assert "traceback" in result
+
+
+@pytest.mark.parametrize("fork_server", [True, False])
+def test_run_worker_job_reads_dataset_from_passed_fd(monkeypatch, fork_server):
+    """
+    Tests that the dataset memfd reaches the worker with its job, not as a path into us,
+    whether the worker is forked or spawned one-shot.
+    """
+    monkeypatch.setattr(main, "_FORK_SERVER_ENABLED", fork_server)
+    import orjson
+    import pandas as pd
+    buf = io.BytesIO()
+    pd.DataFrame({"a": [1, 2, 3]}).to_parquet(buf)
+    blob = MagicMock()
+    blob.download_to_file.side_effect = lambda f: f.write(buf.getvalue())
+    fd = main._download_to_memfd(blob)
+    try:
+        code = "def run(df, ctx):\n    return {'metrics': {'n': int(df['a'].sum())}}"
+        source, fds = main._worker_data_source(fd)
+        assert fds == (fd,) and str(os.getpid()) not in str(source)
+        payload = orjson.dumps({"code": code, **source, "ctx": {}})
+        assert main._run_worker_job(payload, 60, fds)["metrics"] == {"n": 6}
+    finally:
+        os.close(fd)
+
+
+def test_fork_server_exits_when_idle_and_is_restarted(monkeypatch):
+    """
+    Tests that an idle fork server exits, and that concurrent jobs then restart it and
+    run side by side.
+    """
+    import time
+    import orjson
+    from concurrent.futures import ThreadPoolExecutor
+
+    monkeypatch.setattr(main, "_FORK_SERVER_IDLE_SECONDS", 0.5)
+    monkeypatch.setattr(main, "_FORK_SERVER", None)
+    payload = orjson.dumps({
+        "code": "def run(df, ctx):\n    return {'metrics': {'n': len(df)}}",
+        "parquet_b64": base64.b64encode(_tiny_parquet()).decode(), "ctx": {},
+    })
+    assert main._run_worker_job(payload, 60)["metrics"] == {"n": 1}
+    proc = main._FORK_SERVER[0]
+    deadline = time.monotonic() + 10
+    while proc.poll() is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert proc.poll() is not None
+
+    with ThreadPoolExecutor(3) as pool:
+        results = list(pool.map(lambda _: main._run_worker_job(payload, 60), range(3)))
+    assert [r["metrics"] for r in results] == [{"n": 1}] * 3
+    main._FORK_SERVER[0].kill()
+
+
+def _tiny_parquet() -> bytes:
+    import pandas as pd
+    buf = io.BytesIO()
+    pd.DataFrame({"a": [1]}).to_parquet(buf)
+    return buf.getvalue()
+
+def test_run_worker_job_reports_crashed_worker():
+    with pytest.raises(RuntimeError, match="without a result"):
+        main._run_worker_job(b"not json", 60)
+
+
+def test_run_worker_job_kills_worker_past_timeout():
+    import orjson
+    import subprocess
+    import pandas as pd
+    buf = io.BytesIO()
+    pd.DataFrame({"a": [1]}).to_parquet(buf)
+    code = "def run(df, ctx):\n    while True:\n        pass"
+    payload = orjson.dumps({"code": code, "parquet_b64": base64.b64encode(buf.getvalue()).decode(), "ctx": {}})
+    with pytest.raises(subprocess.TimeoutExpired):
+        main._run_worker_job(payload, 0.5)
+
+
+def test_json_object_splices_encoded_members():
+    import orjson
+    command = {"intent": "AGGREGATE", "params": {"metric": "sales"}}
+    data = main._json_object({"strategy": "fastpath", "n": 1}, command=orjson.dumps(command))
+    assert orjson.loads(data) == {"strategy": "fastpath", "n": 1, "command": command}
+    assert orjson.loads(main._json_object({}, a=b"1")) == {"a": 1}
+    assert orjson.loads(main._json_object({"a": 1})) == {"a": 1}
+
+
+def test_sse_code_event_matches_generic_format():
+    code = 'def run(df, ctx):\n    return {"t": "é\\t"}\n'
+    expected = main._sse_format({
+        "type": "code",
+        "data": {"language": "python", "text": code, "warnings": ["w"], "source": "fallback_execution"},
+    })
+    assert main._sse_code_event(code, ["w"], "fallback_execution") == expected
+
+
+def test_download_to_memfd_is_readable_then_released():
+    """
+    Tests that the in-memory dataset copy can be read by path and is released afterwards.
+    """
+    import io
+    from concurrent.futures import Future
+    import pandas as pd
+
+    buf = io.BytesIO()
+    pd.DataFrame({"a": [1, 2]}).to_parquet(buf)
+    blob = MagicMock()
+    blob.download_to_file.side_effect = lambda f: f.write(buf.getvalue())
+    blob.download_to_filename.side_effect = lambda p: open(p, "wb").write(buf.getvalue())
+
+    fd = main._download_to_memfd(blob)
+    assert pd.read_parquet(f"/proc/self/fd/{fd}")["a"].tolist() == [1, 2]
+    fut = Future()
+    main._remove_tempfile_when_done(fut)
+    fut.set_result(fd)
+    with pytest.raises(OSError):
+        os.fstat(fd)
+
+
+def test_cap_records_truncates_only_oversized_tables():
+    small = [{"a": 1, "b": 2}] * 10
+    assert main._cap_records(small) is None
+    wide = [{f"c{i}": i for i in range(300)} for _ in range(500)]
+    capped = main._cap_records(wide)
+    assert len(capped) == main._MAX_TABLE_ROWS
+    assert list(capped[0]) == [f"c{i}" for i in range(main._MAX_TABLE_COLUMNS)]
+
+
+@pytest.mark.parametrize("disconnect", [False, True])
+def test_events_closes_prefetched_parquet_on_early_exit(monkeypatch, disconnect):
+    """
+    Tests that the prefetched parquet reader is released when the stream stops early,
+    whether on an error reply or because the client went away.
+    """
+    reader = MagicMock()
+    monkeypatch.setattr(main, "FASTPATH_ENABLED", True)
+    monkeypatch.setattr(main, "_open_parquet", lambda path: (reader, MagicMock()))
+    monkeypatch.setattr(main, "_get_payload", MagicMock(side_effect=RuntimeError("gone")))
+    monkeypatch.setattr(main, "_get_storage_client", MagicMock())
+    monkeypatch.setattr(main, "_get_bucket", MagicMock())
+    monkeypatch.setattr(main.firestore, "Client", MagicMock())
+
+    stream = main._events("s", "d", "u", "q")
+    if disconnect:
+        next(stream)
+        stream.close()
+    else:
+        events = list(stream)
+        assert b"PAYLOAD_READ_FAILED" in events[-1]
+    import time
+    deadline = time.monotonic() + 5
+    while not reader.close.called and time.monotonic() < deadline:  # the open settles in the pool
+        time.sleep(0.01)
+    reader.close.assert_called()
+
+
+def test_await_title_waits_briefly_for_the_title(monkeypatch):
+    """
+    Tests that the done event picks up a title that lands within the wait, and not a slow one.
+    """
+    from concurrent.futures import Future
+    import threading
+
+    monkeypatch.setattr(main, "TITLE_WAIT_SECONDS", 0.2)
+    fut = Future()
+    threading.Timer(0.05, fut.set_result, args=("Sales by region",)).start()
+    assert main._await_title(fut) == "Sales by region"
+    assert main._await_title(Future()) is None
@@ -82,4 +82,72 @@ def test_validate_code(code, expected_is_valid, expected_errors, expected_warnin
     assert is_valid == expected_is_valid
     # Sort lists to ensure comparison is order-independent
     assert sorted(errors) == sorted(expected_errors)
-    assert sorted(warnings) == sorted(expected_warnings)
\ No newline at end of file
+    assert sorted(warnings) == sorted(expected_warnings)
+
+def test_validate_code_cached_result_is_not_shared():
+    """
+    Tests that repeated validation returns equal results without sharing mutable lists.
+    """
+    code = "import os\ndef run(df, ctx):\n    return {}"
+    first = sandbox_runner.validate_code(code)
+    first[1].append("mutated")
+    second = sandbox_runner.validate_code(code)
+    assert second[0] is False
+    assert "mutated" not in second[1]
+
+
+def test_code_digest_is_stable_and_content_sensitive():
+    a = sandbox_runner.code_digest("def run(df, ctx):\n    return df\n")
+    assert a == sandbox_runner.code_digest("def run(df, ctx):\n    return df\n")
+    assert len(a) == 32
+    assert a != sandbox_runner.code_digest("def run(df, ctx):\n    return None\n")
+
+
+def test_validate_code_skips_cache_for_oversized_code():
+    sandbox_runner._validate_cached.cache_clear()
+    padding = "# " + "x" * sandbox_runner.MAX_CACHED_CODE_LENGTH + "\n"
+    ok, errors, _ = sandbox_runner.validate_code(padding + "def run(df, ctx):\n    return {}\n")
+    assert ok, errors
+    assert sandbox_runner._validate_cached.cache_info().currsize == 0
+
+
+def test_clean_source_still_enforces_allowlist():
+    code = "import scipy\ndef run(df, ctx):\n    return {}\n"
+    assert sandbox_runner._FORBIDDEN_TOKEN_RE.search(code) is None
+    ok, errors, _ = sandbox_runner.validate_code(code)
+    assert not ok
+    assert errors == ["Import not allowed: scipy"]
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("def run(df, ctx):\n    return \uff45\uff56\uff41\uff4c('1')\n", "Forbidden call: eval"),
+    ("def run(df, ctx):\n    return \U0001d428\U0001d429\U0001d41e\U0001d427('/etc/passwd')\n", "Forbidden call: open"),
+    ("import \uff4f\uff53\ndef run(df, ctx):\n    return {}\n", "Import not allowed: "),
+])
+@pytest.mark.parametrize("fast", [False, True])
+def test_validate_code_rejects_nfkc_spelled_forbidden_names(code, expected, fast):
+    sandbox_runner._validate_cached.cache_clear()
+    ok, errors, _ = sandbox_runner.validate_code(code, fast=fast)
+    assert not ok
+    assert any(e.startswith(expected) for e in errors), errors
+
+
+def test_validate_code_fast_mode_stops_at_first_error():
+    code = "import os\nimport subprocess\ndef run(df, ctx):\n    return {}\n"
+    ok, errors, _ = sandbox_runner.validate_code(code)
+    assert not ok and len(errors) > 1
+    ok_fast, errors_fast, _ = sandbox_runner.validate_code(code, fast=True)
+    assert not ok_fast
+    assert errors_fast == [errors[0]]
+    assert sandbox_runner.validate_code("def run(df, ctx):\n    return {}\n", fast=True)[0]
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("import os\ndef run(df, ctx):\n    return {}\n", "Import not allowed: os"),
+    ("def run(df, ctx):\n    return eval('1')\n", "Forbidden call: eval"),
+    ("def run(df, ctx):\n    raise ValueError() from None\n", None),
+    ("def run(df, ctx):\n    return df.open(1)\n", None),
+])
+def test_first_token_offense(code, expected):
+    allowlist = frozenset(sandbox_runner.ALLOWED_IMPORTS)
+    assert sandbox_runner._first_token_offense(code, allowlist) == expected
@@ -14,19 +14,74 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 # Get the path to the worker script
 WORKER_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'worker.py'))
 
+# Runs worker.main() once per request line inside one long-lived interpreter, so the
+# pandas/matplotlib imports are paid once per session instead of once per test.
+# Each request gets fresh stdin/stdout/stderr buffers, like a fresh subprocess would.
+_WORKER_HARNESS = textwrap.dedent("""
+    import io, json, sys
+    sys.path.insert(0, sys.argv[1])
+    import worker
+
+    real_stdout = sys.stdout
+    for line in sys.stdin:
+        stdin = io.TextIOWrapper(io.BytesIO(json.loads(line).encode("utf-8")), encoding="utf-8")
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        stderr = io.StringIO()
+        sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+        try:
+            returncode = worker.main()
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = sys.__stdin__, real_stdout, sys.__stderr__
+        stdout.flush()
+        real_stdout.write(json.dumps({
+            "returncode": returncode,
+            "stdout": stdout.buffer.getvalue().decode("utf-8"),
+            "stderr": stderr.getvalue(),
+        }) + "\\n")
+        real_stdout.flush()
+""")
+
+
+@pytest.fixture(scope="session")
+def run_worker():
+    """
+    Returns a callable that feeds one stdin payload to the worker and returns a
+    subprocess.CompletedProcess-like result, reusing a single harness process.
+    """
+    proc = subprocess.Popen(
+        [sys.executable, "-c", _WORKER_HARNESS, os.path.dirname(WORKER_PATH)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+    def _run(input_data: str) -> subprocess.CompletedProcess:
+        proc.stdin.write(json.dumps(input_data) + "\n")
+        proc.stdin.flush()
+        reply = json.loads(proc.stdout.readline())
+        return subprocess.CompletedProcess(
+            WORKER_PATH, reply["returncode"], reply["stdout"], reply["stderr"]
+        )
+
+    yield _run
+    proc.stdin.close()
+    proc.wait(timeout=10)
+
+
 # Sample DataFrame for testing, encoded as Parquet
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_parquet_b64():
     """
     Provides a base64-encoded Parquet representation of a sample DataFrame.
+    Built once per session; the returned string is immutable, so sharing it is safe.
     """
     df = pd.DataFrame({'col1': [1, 2], 'col2': ['A', 'B']})
     buffer = io.BytesIO()
     df.to_parquet(buffer)
     return base64.b64encode(buffer.getvalue()).decode('ascii')
 
-# Test cases for the worker script using subprocess
-def test_worker_success(sample_parquet_b64):
+# Test cases for the worker script, run through the shared harness process
+def test_worker_success(run_worker, sample_parquet_b64):
     """
     Tests the worker script with a valid code snippet that should execute successfully.
     """
@@ -45,12 +100,7 @@ def test_worker_success(sample_parquet_b64):
         "ctx": {"question": "test"}
     })
     
-    result = subprocess.run(
-        [sys.executable, WORKER_PATH],
-        input=input_data,
-        capture_output=True,
-        text=True
-    )
+    result = run_worker(input_data)
     
     assert result.returncode == 0, f"Worker script failed with stderr: {result.stderr}"
     output = json.loads(result.stdout)
@@ -59,7 +109,7 @@ def test_worker_success(sample_parquet_b64):
     assert output["table"] == [{'col1': 1, 'col2': 'A'}, {'col1': 2, 'col2': 'B'}]
     assert output["metrics"] == {'rows': 2}
 
-def test_worker_execution_error(sample_parquet_b64):
+def test_worker_execution_error(run_worker, sample_parquet_b64):
     """
     Tests that the worker catches a runtime error from the user code.
     The error is a NameError because ValueError is not in the sandboxed scope.
@@ -71,12 +121,7 @@ def test_worker_execution_error(sample_parquet_b64):
         "ctx": {}
     })
     
-    result = subprocess.run(
-        [sys.executable, WORKER_PATH],
-        input=input_data,
-        capture_output=True,
-        text=True
-    )
+    result = run_worker(input_data)
 
     assert result.returncode == 0, f"Worker script failed with stderr: {result.stderr}"
     output = json.loads(result.stdout)
@@ -86,36 +131,218 @@ def test_worker_execution_error(sample_parquet_b64):
     # This is the correct behavior to test.
     assert "name 'ValueError' is not defined" in output["error"]
 
-def test_worker_invalid_json_input():
+def test_worker_invalid_json_input(run_worker):
     """
     Tests the worker with malformed JSON input.
     The script should exit with a non-zero status code and report to stderr.
     """
     input_data = "not valid json"
     
-    result = subprocess.run(
-        [sys.executable, WORKER_PATH],
-        input=input_data,
-        capture_output=True,
-        text=True
-    )
+    result = run_worker(input_data)
     
     assert result.returncode != 0
     assert "Invalid input payload" in result.stderr
 
-def test_worker_missing_keys_in_input(sample_parquet_b64):
+def test_worker_missing_keys_in_input(run_worker, sample_parquet_b64):
     """
     Tests the worker with valid JSON but missing required keys.
     The script should exit with a non-zero code and report to stderr.
     """
     input_data = json.dumps({"parquet_b64": sample_parquet_b64}) # Missing 'code'
     
-    result = subprocess.run(
-        [sys.executable, WORKER_PATH],
-        input=input_data,
-        capture_output=True,
-        text=True
-    )
+    result = run_worker(input_data)
 
     assert result.returncode != 0
-    assert "Missing 'code' field" in result.stderr
\ No newline at end of file
+    assert "Missing 'code' field" in result.stderr
+def test_worker_reads_arrow_ipc_path(run_worker, tmp_path):
+    """
+    Tests that the worker loads an Arrow IPC stream file passed by path.
+    """
+    import pyarrow as pa
+
+    ipc_path = tmp_path / "data.arrows"
+    table = pa.table({'col1': [1, 2], 'col2': ['A', 'B']})
+    with pa.OSFile(str(ipc_path), 'wb') as sink:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    code = "def run(df, ctx):\n    return {'table': df.to_dict(orient='records'), 'metrics': {}, 'chartData': {}}"
+    result = run_worker(json.dumps({"code": code, "arrow_ipc_path": str(ipc_path), "ctx": {}}))
+
+    assert result.returncode == 0, f"Worker script failed with stderr: {result.stderr}"
+    output = json.loads(result.stdout)
+    assert output["table"] == [{'col1': 1, 'col2': 'A'}, {'col1': 2, 'col2': 'B'}]
+
+def test_worker_projects_columns_but_defaults_use_full_frame(run_worker, tmp_path):
+    """
+    Code that only selects literal columns reads just those from parquet_path, while
+    the default table still shows every column.
+    """
+    parquet_path = tmp_path / "data.parquet"
+    pd.DataFrame({'col1': [1, 2], 'col2': ['A', 'B'], 'col3': [0.5, 1.5]}).to_parquet(parquet_path)
+
+    code = "def run(df, ctx):\n    return {'metrics': {'total': int(df['col1'].sum())}, 'chartData': {}}"
+    result = run_worker(json.dumps({"code": code, "parquet_path": str(parquet_path), "ctx": {}}))
+
+    assert result.returncode == 0, f"Worker script failed with stderr: {result.stderr}"
+    output = json.loads(result.stdout)
+    assert output["metrics"] == {'total': 3}
+    assert output["table"] == [
+        {'col1': 1, 'col2': 'A', 'col3': 0.5},
+        {'col1': 2, 'col2': 'B', 'col3': 1.5},
+    ]
+
+def test_worker_reuses_compiled_code_from_cache_dir(run_worker, sample_parquet_b64, tmp_path):
+    """
+    With a code_cache_dir, the first run stores the compiled code and later runs load it.
+    """
+    code = "def run(df, ctx):\n    return {'table': [], 'metrics': {'rows': len(df)}, 'chartData': {}}"
+    input_data = json.dumps({
+        "code": code,
+        "parquet_b64": sample_parquet_b64,
+        "code_cache_dir": str(tmp_path),
+        "ctx": {},
+    })
+
+    first = run_worker(input_data)
+    cached = list(tmp_path.glob("*.marshal"))
+    second = run_worker(input_data)
+
+    assert len(cached) == 1
+    assert json.loads(first.stdout)["metrics"] == {'rows': 2}
+    assert json.loads(second.stdout) == json.loads(first.stdout)
+
+def test_worker_records_successful_validation_in_cache_dir(run_worker, sample_parquet_b64, tmp_path):
+    """
+    Without a validated_digest, a passing validation leaves a marker for later workers;
+    a failing one does not.
+    """
+    good = "def run(df, ctx):\n    return {'table': [], 'metrics': {}, 'chartData': {}}"
+    bad = "import os\ndef run(df, ctx):\n    return {}"
+    for code in (good, bad):
+        run_worker(json.dumps({"code": code, "parquet_b64": sample_parquet_b64, "code_cache_dir": str(tmp_path), "ctx": {}}))
+
+    import worker
+    markers = list(tmp_path.glob("*.valid"))
+    assert [m.stem for m in markers] == [worker.code_digest(good)]
+
+def test_worker_serializes_datetimes_like_str(run_worker, sample_parquet_b64):
+    """
+    Datetimes in the output keep the str() form ("YYYY-MM-DD HH:MM:SS").
+    """
+    code = (
+        "def run(df, ctx):\n"
+        "    when = pd.Timestamp('2024-01-02 03:04:05').to_pydatetime()\n"
+        "    return {'table': [{'when': when}], 'metrics': {}, 'chartData': {}}"
+    )
+    result = run_worker(json.dumps({"code": code, "parquet_b64": sample_parquet_b64, "ctx": {}}))
+
+    assert result.returncode == 0, f"Worker script failed with stderr: {result.stderr}"
+    assert json.loads(result.stdout)["table"] == [{'when': '2024-01-02 03:04:05'}]
+
+def test_sanitize_for_json_masks_float_arrays():
+    import numpy as np
+    import worker
+
+    assert worker.sanitize_for_json({"a": np.array([[1.5, np.nan], [np.inf, 2.0]]), "b": np.arange(2)}) == {
+        "a": [[1.5, None], [None, 2.0]],
+        "b": [0, 1],
+    }
+
+
+def test_worker_writes_large_dataframe_result_as_arrow(run_worker, sample_parquet_b64, tmp_path):
+    """
+    Large DataFrame results are handed back as an Arrow IPC file instead of JSON records.
+    """
+    import pyarrow as pa
+
+    code = "import pandas as pd\ndef run(df, ctx):\n    return pd.DataFrame({'n': range(1500)})"
+    payload = {"code": code, "parquet_b64": sample_parquet_b64, "arrow_out_dir": str(tmp_path), "ctx": {}}
+    result = run_worker(json.dumps(payload))
+
+    assert result.returncode == 0, f"Worker script failed with stderr: {result.stderr}"
+    output = json.loads(result.stdout)
+    assert "table" not in output
+    with pa.memory_map(output["table_arrow_path"], "r") as source:
+        table = pa.ipc.open_stream(source).read_all()
+    assert table.num_rows == 1500
+    assert table.column("n").to_pylist()[:3] == [0, 1, 2]
+
+
+def test_worker_maps_first_tables_frame_to_table(run_worker, sample_parquet_b64):
+    code = "def run(df, ctx):\n    return {'tables': {'a': 'skip', 'b': df.head(1)}, 'metrics': {}}"
+    result = run_worker(json.dumps({"code": code, "parquet_b64": sample_parquet_b64, "ctx": {}}))
+
+    assert result.returncode == 0, f"Worker script failed with stderr: {result.stderr}"
+    output = json.loads(result.stdout)
+    assert output["table"] == [{'col1': 1, 'col2': 'A'}]
+    assert output["chartData"] == {}
+
+
+def test_worker_normalizes_plural_list_keys(run_worker, sample_parquet_b64):
+    code = "def run(df, ctx):\n    return {'tables': [[{'x': 1}]], 'charts': [{'kind': 'bar'}], 'metrics': {}}"
+    result = run_worker(json.dumps({"code": code, "parquet_b64": sample_parquet_b64, "ctx": {}}))
+
+    assert result.returncode == 0, f"Worker script failed with stderr: {result.stderr}"
+    output = json.loads(result.stdout)
+    assert output["table"] == [{'x': 1}]
+    assert output["chartData"] == {'kind': 'bar'}
+
+
+def test_worker_streams_json_fallback_for_big_ints(run_worker, sample_parquet_b64):
+    code = "def run(df, ctx):\n    return {'metrics': {'big': 2 ** 70, 'nan': float('nan')}, 'table': []}"
+    result = run_worker(json.dumps({"code": code, "parquet_b64": sample_parquet_b64, "ctx": {}}))
+
+    assert result.returncode == 0, f"Worker script failed with stderr: {result.stderr}"
+    assert result.stdout.endswith("}\n")
+    output = json.loads(result.stdout)
+    assert output["metrics"] == {'big': 2 ** 70, 'nan': None}
+
+
+def test_sanitize_for_json_handles_subclasses_and_numpy_scalars():
+    from collections import OrderedDict
+    import numpy as np
+    import worker
+
+    obj = {"v": [float("nan"), np.float64("inf"), np.float32("nan"), np.int64(3), 1.5, "x", None, True],
+           "od": OrderedDict(b=float("-inf"))}
+    assert worker.sanitize_for_json(obj) == {"v": [None, None, None, 3, 1.5, "x", None, True], "od": {"b": None}}
+
+
+
+def test_write_result_fallback_output_is_strict_json():
+    from collections import namedtuple
+    import orjson
+    import worker
+
+    Point = namedtuple("Point", "x y")
+    buf = io.BytesIO()
+    worker._write_result({"big": 2 ** 70, "vals": (float("nan"), 1.0), "pt": Point(float("inf"), 2)}, buf)
+    assert orjson.loads(buf.getvalue()) == {"big": 2 ** 70, "vals": [None, 1.0], "pt": [None, 2]}
+
+
+def test_worker_reports_unserializable_result_as_error(run_worker, sample_parquet_b64):
+    code = (
+        "def run(df, ctx):\n"
+        "    return {'metrics': {'by': df.groupby(['col1', 'col2'])['col1'].count().to_dict()}}"
+    )
+    result = run_worker(json.dumps({"code": code, "parquet_b64": sample_parquet_b64, "ctx": {}}))
+
+    assert result.returncode == 0, f"Worker script failed with stderr: {result.stderr}"
+    output = json.loads(result.stdout)
+    assert output["error"] == "Runtime error: keys must be str, int, float, bool or None, not tuple"
+    assert output["table"] == [] and output["metrics"] == {} and "traceback" in output
+
+
+def test_worker_imports_plotting_on_first_use(run_worker, sample_parquet_b64):
+    code = (
+        "def run(df, ctx):\n"
+        "    fig, ax = plt.subplots()\n"
+        "    sns.barplot(x=df['col2'], y=df['col1'], ax=ax)\n"
+        "    plt.close(fig)\n"
+        "    return {'table': [], 'metrics': {'axes': len(fig.axes)}, 'chartData': {}}"
+    )
+    result = run_worker(json.dumps({"code": code, "parquet_b64": sample_parquet_b64, "ctx": {}}))
+
+    assert result.returncode == 0, f"Worker script failed with stderr: {result.stderr}"
+    assert json.loads(result.stdout)["metrics"] == {'axes': 1}
@@ -2,12 +2,15 @@
 """
 Worker process to safely execute LLM-generated analysis code in a sandboxed environment.
 
-This script is launched as a subprocess by the orchestrator. It receives JSON via stdin:
+Run as a script, it reads one job as JSON from stdin. The orchestrator instead keeps a
+`worker.py --fork-server` process that has already done every import and forks a fresh
+single-use child per job (see serve_forks), which receives the same JSON over a socket:
 {
   "code": "<python source>",
   "parquet_b64": "<base64 bytes>" | optional,
-  "arrow_ipc_b64": "<base64 bytes>" | optional,
+  "arrow_ipc_path": "/dev/shm/cleaned.arrows" | optional,
   "parquet_path": "/tmp/cleaned.parquet" | optional,
+  "parquet_fd": true | optional (fork server: read the descriptor sent with the job),
   "ctx": { ... }
 }
 
@@ -17,32 +20,40 @@ Steps:
 3. Execute the validated run(df, ctx) safely.
 4. Sanitize and normalize the result for JSON output.
 
-It always prints a JSON payload to stdout and exits with 0 unless the payload is malformed.
+It always produces a JSON payload and exits with 0 unless the payload is malformed.
 """
 from __future__ import annotations
 
-import io
+import ast
+import builtins
+import contextlib
+import importlib
 import json
 import base64
+import marshal
+import math
 import sys
 import signal
+import socket
+import tempfile
 import traceback
 import os
-from typing import Any
+from typing import Any, Callable
 
 import pandas as pd
 import numpy as np
 import pyarrow as pa  # type: ignore
+import pyarrow.parquet as pq  # type: ignore
+import orjson
 
 import matplotlib
 
-matplotlib.use("Agg")  # Non-interactive backend
-import matplotlib.pyplot as plt
-import seaborn as sns
+matplotlib.use("Agg")  # Non-interactive backend, set before anything imports pyplot
 
 # Try to import sandbox validator (preferred)
 try:
     from sandbox_runner import (
+        code_digest,
         structured_validate,
         ALLOWED_IMPORTS as SANDBOX_ALLOWED_IMPORTS,
     )
@@ -64,6 +75,7 @@ except Exception:
         "base64",
     }
     structured_validate = None  # fallback
+    code_digest = None
 
 
 # --------------------------------------------------------------------------
@@ -74,6 +86,7 @@ import config
 ALLOWED_IMPORTS = set(SANDBOX_ALLOWED_IMPORTS)
 CODE_TIMEOUT = int(config.CODE_TIMEOUT)
 MAX_MEMORY_BYTES = int(config.CODE_MAX_MEMORY_BYTES)  # 512MB default
+MEMORY_MAP = bool(config.PYARROW_MEMORY_MAP)
 try:
     import resource
 except Exception:
@@ -83,75 +96,296 @@ except Exception:
 # --------------------------------------------------------------------------
 # Utilities
 # --------------------------------------------------------------------------
-def sanitize_for_json(obj: Any) -> Any:
-    """Recursively replaces NaN/Inf with None for Firestore/JSON compatibility."""
+def _sanitize_ndarray(obj: np.ndarray) -> list:
+    # Whole-array mask instead of a Python-level test per element
+    if obj.dtype.kind == "f":
+        out = obj.astype(object)
+        out[~np.isfinite(obj)] = None
+        return out.tolist()
+    if obj.dtype.kind in "iub":
+        return obj.tolist()
+    return sanitize_for_json(obj.tolist())
+
+
+def _sanitize_float(x: float) -> float | None:
+    return x if math.isfinite(x) else None
+
+
+def _sanitize_slow(obj: Any) -> Any:
+    """isinstance-based path for subclasses and numpy scalars."""
     if isinstance(obj, dict):
         return {k: sanitize_for_json(v) for k, v in obj.items()}
-    if isinstance(obj, list):
+    if isinstance(obj, (list, tuple)):
         return [sanitize_for_json(v) for v in obj]
-    if isinstance(obj, float):
-        if np.isnan(obj) or np.isinf(obj):
-            return None
-        return float(obj)
-    if isinstance(obj, (np.integer,)):
+    if isinstance(obj, np.ndarray):
+        return _sanitize_ndarray(obj)
+    if isinstance(obj, (float, np.floating)):
+        return _sanitize_float(float(obj))
+    if isinstance(obj, np.integer):
         return int(obj)
-    if isinstance(obj, (np.floating,)):
-        return float(obj)
     return obj
 
 
+def _identity(obj: Any) -> Any:
+    return obj
+
+
+# Exact-type dispatch for the common cases; anything else takes _sanitize_slow
+_SANITIZERS: dict[type, Callable[[Any], Any]] = {
+    dict: lambda d: {k: sanitize_for_json(v) for k, v in d.items()},
+    list: lambda items: [sanitize_for_json(v) for v in items],
+    tuple: lambda items: [sanitize_for_json(v) for v in items],
+    float: _sanitize_float,
+    int: _identity,
+    str: _identity,
+    bool: _identity,
+    type(None): _identity,
+    np.ndarray: _sanitize_ndarray,
+}
+
+
+def sanitize_for_json(obj: Any) -> Any:
+    """Recursively replaces NaN/Inf with None for Firestore/JSON compatibility."""
+    fn = _SANITIZERS.get(type(obj))
+    return fn(obj) if fn is not None else _sanitize_slow(obj)
+
+
+def _records(df: pd.DataFrame) -> list[dict]:
+    """Column-major equivalent of `df.to_dict(orient="records")`.
+
+    One `tolist()` per column and a zip per row avoid pandas' per-cell boxing; pd.NA
+    from extension dtypes becomes None, as to_dict does.
+    """
+    if not len(df.columns) or not df.columns.is_unique:
+        return df.to_dict(orient="records")
+    cols = df.columns.tolist()
+    values = []
+    for name, dtype in zip(cols, df.dtypes):
+        col = df[name].tolist()
+        if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+            col = [None if v is pd.NA else v for v in col]
+        values.append(col)
+    return [dict(zip(cols, row)) for row in zip(*values)]
+
+
+def _df_to_records_safe(df: pd.DataFrame, limit: int | None = None) -> list[dict]:
+    """`df.to_dict(orient="records")` with NaN/Inf in numeric columns already None.
+
+    The replacement is done column-wise on the (head of the) frame, instead of testing
+    every cell of the records afterwards.
+    """
+    if limit is not None:
+        df = df.head(limit)
+    num = df.select_dtypes(include=[np.number]).columns
+    if len(num) and df.columns.is_unique:
+        vals = df[num]
+        bad = vals.isna() | vals.isin([np.inf, -np.inf])
+        if bad.to_numpy().any():
+            df = df.copy()
+            df[num] = vals.astype(object).mask(bad, None)
+    return _records(df)
+
+
+# DataFrame tables from this many rows are handed back as an Arrow IPC file instead of
+# JSON records (when the orchestrator supplies arrow_out_dir); smaller ones stay inline
+ARROW_TABLE_MIN_ROWS = 1000
+
+
+def _write_arrow_table(df: pd.DataFrame, out_dir: str) -> str | None:
+    """Writes `df` as an Arrow IPC stream file in `out_dir`; None if Arrow cannot hold it."""
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowException, TypeError, ValueError):
+        return None
+    fd, path = tempfile.mkstemp(dir=out_dir, suffix=".arrows")
+    try:
+        with os.fdopen(fd, "wb") as sink, pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    except Exception:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        return None
+    return path
+
+
+def _table_fields(df: pd.DataFrame, out_dir: str | None) -> dict:
+    """Result fields carrying `df`: {"table_arrow_path": ...} for large frames, else {"table": records}."""
+    if out_dir and len(df) >= ARROW_TABLE_MIN_ROWS:
+        path = _write_arrow_table(df, out_dir)
+        if path:
+            return {"table_arrow_path": path}
+    return {"table": _df_to_records_safe(df)}
+
+
+# Plural-key normalization, keyed by value type: result fields for an entry of "tables",
+# and the chart dict to use from "charts"
+_TABLE_COERCERS: dict[type, Callable[[Any, str | None], dict]] = {
+    pd.DataFrame: _table_fields,
+    list: lambda rows, out_dir: {"table": rows},
+    dict: lambda row, out_dir: {"table": [row]},
+}
+_CHART_PICKERS: dict[type, Callable[[Any], Any]] = {
+    dict: lambda charts: charts,
+    list: lambda charts: charts[0] if charts else None,
+}
+
+
+def _dispatch(table: dict, value: Any) -> Any:
+    """Entry of `table` for type(value), falling back to its base classes (None if absent)."""
+    for cls in type(value).__mro__:
+        hit = table.get(cls)
+        if hit is not None:
+            return hit
+    return None
+
+
+# PASSTHROUGH_DATETIME sends datetime/date through default=str, keeping the
+# "2024-01-01 00:00:00" form json.dumps(default=str) produced rather than ISO-8601
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def _write_result(output: dict, stream) -> None:
+    """Writes the result as UTF-8 JSON to the binary `stream` (NaN/Inf become null).
+
+    Never raises for an unserializable result: it is replaced by a runtime error result,
+    like an exception from the user code, so the repair loop sees what went wrong.
+    """
+    try:
+        # orjson already writes NaN/Inf (numpy scalars and arrays included) as null
+        data = orjson.dumps(output, default=str, option=_ORJSON_OPTIONS)
+    except TypeError:
+        try:
+            # e.g. integers beyond 64 bits, which orjson refuses; json would emit bare
+            # NaN tokens, so sanitize first. Built whole so a failure writes nothing.
+            data = json.dumps(sanitize_for_json(output), ensure_ascii=False, default=str).encode("utf-8")
+        except Exception as e:  # e.g. tuple dict keys
+            data = orjson.dumps({
+                "table": [],
+                "metrics": {},
+                "chartData": {},
+                "error": f"Runtime error: {e}",
+                "traceback": traceback.format_exc(limit=8),
+            })
+    stream.write(data)
+
+
+def _emit(output: dict) -> None:
+    """Writes the result as one JSON line to stdout."""
+    out = sys.stdout.buffer
+    _write_result(output, out)
+    out.write(b"\n")  # separately, rather than copying the whole payload to append it
+    out.flush()
+
+
+def _compile_user_code(code: str, digest: str | None, cache_dir: str | None):
+    """compile() with a marshal cache keyed by the code digest, shared across workers.
+
+    `cache_dir` comes from the orchestrator (a private directory); without it, or
+    without a digest, the code is simply compiled.
+    """
+    if not cache_dir or not digest:
+        return compile(code, filename="<user_code>", mode="exec")
+    path = os.path.join(cache_dir, f"{digest}.{sys.implementation.cache_tag}.marshal")
+    # A missing or unreadable/corrupt entry just means compiling again
+    with contextlib.suppress(OSError, EOFError, ValueError, TypeError):
+        with open(path, "rb") as f:
+            return marshal.load(f)
+    compiled = compile(code, filename="<user_code>", mode="exec")
+    with contextlib.suppress(OSError, ValueError):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            marshal.dump(compiled, f)
+        os.replace(tmp_path, path)
+    return compiled
+
+
+def _validation_marker(digest: str | None, cache_dir: str | None) -> str | None:
+    """Path whose existence records that this digest passed validation (same private dir
+    and key as the compiled-code cache)."""
+    if not cache_dir or not digest:
+        return None
+    return os.path.join(cache_dir, f"{digest}.valid")
+
+
 def _safe_import(name, globals=None, locals=None, fromlist=(), level=0):
-    root = (name.split(".") or [name])[0]
+    root = name.partition(".")[0]
     if root not in ALLOWED_IMPORTS:
         raise ImportError(f"Import not allowed: {name}")
     return _orig_import(name, globals, locals, fromlist, level)
 
 
+# Builtins exposed to user code, resolved once at import instead of on every run
+_SAFE_BUILTIN_NAMES = (
+    "abs",
+    "all",
+    "any",
+    "bool",
+    "dict",
+    "enumerate",
+    "filter",
+    "float",
+    "int",
+    "len",
+    "list",
+    "map",
+    "max",
+    "min",
+    "pow",
+    "range",
+    "round",
+    "set",
+    "slice",
+    "sorted",
+    "str",
+    "sum",
+    "zip",
+    "print",
+    "isinstance",
+    "getattr",
+    "hasattr",
+    "type",
+)
+_SAFE_BUILTINS_TEMPLATE = {
+    b: getattr(builtins, b) for b in _SAFE_BUILTIN_NAMES if hasattr(builtins, b)
+}
+_SAFE_BUILTINS_TEMPLATE["__import__"] = _safe_import
+
+
+# pyplot and seaborn cost hundreds of ms to import and most analyses never touch them.
+# The fork server imports them up front (see serve_forks), so its children get them free.
+_PLOTTING_MODULES = ("matplotlib.pyplot", "seaborn")
+
+
+def _lazy_module(name: str) -> Any:
+    """Stand-in for module `name` that imports it on first attribute access.
+
+    No instance state (empty __slots__), so user code cannot repoint it elsewhere.
+    """
+
+    class _LazyModule:
+        __slots__ = ()
+
+        def __getattr__(self, attr: str) -> Any:
+            return getattr(importlib.import_module(name), attr)
+
+    return _LazyModule()
+
+
+_LAZY_PLT = _lazy_module("matplotlib.pyplot")
+_LAZY_SNS = _lazy_module("seaborn")
+
+
 def _prepare_globals() -> dict:
     """Prepare restricted globals for execution."""
-    import builtins as _builtins
-
-    safe_builtins = {
-        b: getattr(_builtins, b)
-        for b in [
-            "abs",
-            "all",
-            "any",
-            "bool",
-            "dict",
-            "enumerate",
-            "filter",
-            "float",
-            "int",
-            "len",
-            "list",
-            "map",
-            "max",
-            "min",
-            "pow",
-            "range",
-            "round",
-            "set",
-            "slice",
-            "sorted",
-            "str",
-            "sum",
-            "zip",
-            "print",
-            "isinstance",
-            "getattr",
-            "hasattr",
-            "type",
-        ]
-        if hasattr(_builtins, b)
-    }
-    safe_builtins["__import__"] = _safe_import
     return {
-        "__builtins__": safe_builtins,
+        # A copy, so user code cannot alter the template
+        "__builtins__": _SAFE_BUILTINS_TEMPLATE.copy(),
         "pd": pd,
         "np": np,
-        "plt": plt,
-        "sns": sns,
+        "plt": _LAZY_PLT,
+        "sns": _LAZY_SNS,
         "RESULT": None,
     }
 
@@ -164,10 +398,8 @@ def _set_resource_limits():
     #     resource.setrlimit(resource.RLIMIT_AS, (MAX_MEMORY_BYTES, MAX_MEMORY_BYTES))
     # except Exception:
     #     pass
-    try:
+    with contextlib.suppress(OSError, ValueError):
         resource.setrlimit(resource.RLIMIT_CPU, (CODE_TIMEOUT + 5, CODE_TIMEOUT + 5))
-    except Exception:
-        pass
 
 
 class _TimeoutException(Exception):
@@ -178,20 +410,116 @@ def _timeout_handler(signum, frame):
     raise _TimeoutException("User code timed out")
 
 
-def _load_dataframe(payload: dict) -> pd.DataFrame:
-    """Load df from base64 Parquet/Arrow or path."""
-    if payload.get("arrow_ipc_b64"):
-        ipc_bytes = base64.b64decode(payload["arrow_ipc_b64"])
-        with pa.ipc.open_stream(io.BytesIO(ipc_bytes)) as reader:
-            table = reader.read_all()
-        return table.to_pandas()
-    if payload.get("parquet_b64"):
-        data = base64.b64decode(payload["parquet_b64"])
-        return pd.read_parquet(io.BytesIO(data))
+def _install_sandbox_once() -> None:
+    """Installs the SIGALRM timeout handler (POSIX, main thread; idempotent).
+
+    Runs at import, so fork-server children inherit it and a job only arms the alarm.
+    The CPU rlimit stays per job: it is cumulative, so setting it here would eventually
+    kill the long-lived fork server.
+    """
+    if hasattr(signal, "SIGALRM") and signal.getsignal(signal.SIGALRM) is not _timeout_handler:
+        with contextlib.suppress(ValueError):  # not the main thread
+            signal.signal(signal.SIGALRM, _timeout_handler)
+
+
+_install_sandbox_once()
+
+
+def _table_to_df(table: pa.Table) -> pd.DataFrame:
+    """Converts without consolidating blocks, releasing Arrow buffers as columns are converted.
+
+    `table` must not be used afterwards (self_destruct invalidates it).
+    """
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def _referenced_columns(code: str, names: list[str]) -> list[str] | None:
+    """Columns `code` can observe, when it touches `df` only through literal selection.
+
+    Every use of the name `df` must be `df["col"]`, `df[["a", "b"]]` or `df.col` (with
+    `col` a column that is not also a DataFrame attribute). Any other use (method calls,
+    iteration, passing it on, rebinding) returns None, meaning every column is needed.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    schema = set(names)
+    used: set[str] = set()
+    selected: set[int] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == "df":
+            key = node.slice
+            items = key.elts if isinstance(key, (ast.List, ast.Tuple)) else [key]
+            if not all(isinstance(k, ast.Constant) and isinstance(k.value, str) for k in items):
+                return None
+            used.update(k.value for k in items if k.value in schema)
+            selected.add(id(node.value))
+        elif isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == "df":
+            if node.attr not in schema or hasattr(pd.DataFrame, node.attr):
+                return None
+            used.add(node.attr)
+            selected.add(id(node.value))
+    # Any other `df` Name (loads, rebinding, del) can see the whole frame; the run(df, ctx)
+    # parameter itself is an ast.arg, not a Name
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == "df" and id(node) not in selected:
+            return None
+    if not used:
+        return None
+    return [n for n in names if n in used]
+
+
+def _projected_columns(payload: dict, code: str, ctx: dict) -> list[str] | None:
+    """Columns to read from parquet_path, or None to read them all.
+
+    Uses `ctx["columns"]` when the caller supplies it, otherwise what `code` references.
+    """
+    path = payload.get("parquet_path")
+    if not path or payload.get("arrow_ipc_path"):
+        return None
+    try:
+        names = pq.read_schema(path, memory_map=MEMORY_MAP).names
+    except Exception:
+        return None
+    hinted = ctx.get("columns")
+    if hinted:
+        wanted = set(hinted)
+        columns = [n for n in names if n in wanted]
+    else:
+        columns = _referenced_columns(code, names)
+    if not columns or len(columns) == len(names):
+        return None
+    return columns
+
+
+def _load_dataframe(payload: dict, columns: list[str] | None = None) -> pd.DataFrame:
+    """Load df from an Arrow IPC stream file, a Parquet path, or base64 Parquet.
+
+    `columns` projects the parquet_path read (index columns are always kept).
+    """
+    if payload.get("arrow_ipc_path"):
+        # Memory-mapped: the IPC stream is read in place (ideally from tmpfs), no copy
+        # through stdin and no base64 round trip
+        with pa.memory_map(payload["arrow_ipc_path"], "r") as source:
+            table = pa.ipc.open_stream(source).read_all()
+        return _table_to_df(table)
     if payload.get("parquet_path"):
-        return pd.read_parquet(payload["parquet_path"])
+        # Memory-mapped reads are served from the page cache (the orchestrator's memfd or
+        # tmpfs file) without first copying into a freshly allocated buffer
+        table = pq.read_table(
+            payload["parquet_path"], columns=columns, memory_map=MEMORY_MAP, use_pandas_metadata=True
+        )
+        return _table_to_df(table)
+    if payload.get("parquet_b64"):
+        # Popped so the base64 text is freed once decoded instead of living alongside
+        # the decoded bytes and the table (only parquet_path inputs are ever re-read)
+        data = base64.b64decode(payload.pop("parquet_b64"))
+        table = pq.read_table(pa.BufferReader(data), use_pandas_metadata=True)
+        del data
+        return _table_to_df(table)
     raise ValueError(
-        "Missing data payload: no parquet_b64, arrow_ipc_b64, or parquet_path provided"
+        "Missing data payload: no arrow_ipc_path, parquet_path, or parquet_b64 provided"
     )
 
 
@@ -199,7 +527,7 @@ def _fallback_result(df: pd.DataFrame, ctx: dict) -> dict:
     """Fallback minimal result when code fails."""
     row_limit = int((ctx or {}).get("row_limit", 200))
     return {
-        "table": df.head(row_limit).to_dict(orient="records"),
+        "table": _df_to_records_safe(df, row_limit),
         "metrics": {"rows": len(df), "columns": len(df.columns)},
         "chartData": {},
         "message": "Fallback result generated due to code execution failure.",
@@ -209,26 +537,31 @@ def _fallback_result(df: pd.DataFrame, ctx: dict) -> dict:
 # --------------------------------------------------------------------------
 # Main Execution
 # --------------------------------------------------------------------------
-def main() -> int:
-    global _orig_import
-    import builtins as _builtins
+def _parse_payload(raw: bytes) -> dict:
+    payload = orjson.loads(raw)
+    if not payload.get("code"):
+        raise ValueError("Missing 'code' field in payload")
+    return payload
 
-    _orig_import = _builtins.__import__
 
-    # Step 1: Read payload
-    try:
-        payload = json.load(sys.stdin)
-        code = payload.get("code", "")
-        ctx = payload.get("ctx", {}) or {}
-        if not code:
-            raise ValueError("Missing 'code' field in payload")
-    except Exception as e:
-        sys.stderr.write(f"Invalid input payload: {e}\n")
-        return 1
+def handle(payload: dict) -> dict:
+    """Validates, loads and runs one job payload; returns the JSON-ready result."""
+    global _orig_import
+
+    _orig_import = builtins.__import__
+    code = payload["code"]
+    ctx = payload.get("ctx", {}) or {}
 
-    # Step 2: Validate code via sandbox_runner
+    # Step 2: Validate code via sandbox_runner (skipped when the orchestrator already
+    # validated this exact text and says so with its digest, or an earlier worker did)
     try:
-        if structured_validate:
+        digest = code_digest(code) if code_digest else None
+        cache_dir = payload.get("code_cache_dir")
+        marker = _validation_marker(digest, cache_dir)
+        prevalidated = digest is not None and (
+            payload.get("validated_digest") == digest or (marker is not None and os.path.exists(marker))
+        )
+        if structured_validate and not prevalidated:
             validation = structured_validate(code)
             if not validation.get("ok", False):
                 output = {
@@ -238,8 +571,11 @@ def main() -> int:
                     "error": "Validation failed",
                     "validation": validation,
                 }
-                print(json.dumps(output, ensure_ascii=False))
-                return 0
+                return output
+            if marker is not None:
+                # Only successes are recorded; failures are rare and cheap to recompute
+                with contextlib.suppress(OSError):
+                    open(marker, "xb").close()
     except Exception as e:
         output = {
             "table": [],
@@ -247,12 +583,12 @@ def main() -> int:
             "chartData": {},
             "error": f"Validator error: {e}",
         }
-        print(json.dumps(output, ensure_ascii=False))
-        return 0
+        return output
 
     # Step 3: Load DataFrame
     try:
-        df = _load_dataframe(payload)
+        columns = _projected_columns(payload, code, ctx)
+        df = _load_dataframe(payload, columns)
     except Exception as e:
         output = {
             "table": [],
@@ -260,19 +596,26 @@ def main() -> int:
             "chartData": {},
             "error": f"Failed to load data: {e}",
         }
-        print(json.dumps(output, ensure_ascii=False))
-        return 0
+        return output
+
+    # Fallback/default outputs describe the whole dataset, so a projected df is
+    # re-read in full, and only if one of them is actually needed
+    whole: list = [df] if columns is None else []
+
+    def _whole_df() -> pd.DataFrame:
+        if not whole:
+            whole.append(_load_dataframe(payload))
+        return whole[0]
 
     # Step 4: Execute code safely
     globs = _prepare_globals()
     locs: dict = {}
 
     _set_resource_limits()
-    old_handler = signal.signal(signal.SIGALRM, _timeout_handler)
     signal.alarm(CODE_TIMEOUT)
 
     try:
-        compiled = compile(code, filename="<user_code>", mode="exec")
+        compiled = _compile_user_code(code, digest, cache_dir)
         exec(compiled, globs, locs)
 
         run_func = locs.get("run") or globs.get("run")
@@ -283,70 +626,62 @@ def main() -> int:
         if result is None:
             result = globs.get("RESULT")
 
+        arrow_out_dir = payload.get("arrow_out_dir")
+
         # Normalize
         if isinstance(result, pd.DataFrame):
             result = {
-                "table": result.to_dict(orient="records"),
+                **_table_fields(result, arrow_out_dir),
                 "metrics": {},
                 "chartData": {},
             }
         elif isinstance(result, list):
             result = {"table": result, "metrics": {}, "chartData": {}}
         elif not isinstance(result, dict):
-            result = _fallback_result(df, ctx)
+            result = _fallback_result(_whole_df(), ctx)
 
         # Map plural keys to canonical ones when needed
         if isinstance(result, dict):
+            if isinstance(result.get("table"), pd.DataFrame):
+                result.update(_table_fields(result.pop("table"), arrow_out_dir))
+
             # tables -> table (choose first reasonable table)
-            if "table" not in result and "tables" in result:
+            if "table" not in result and "table_arrow_path" not in result and "tables" in result:
                 tables = result.get("tables")
-                table_rows = None
-                try:
-                    if isinstance(tables, list) and len(tables) > 0:
-                        first = tables[0]
-                        if isinstance(first, pd.DataFrame):
-                            table_rows = first.to_dict(orient="records")
-                        elif isinstance(first, list):
-                            table_rows = first
-                        elif isinstance(first, dict):
-                            table_rows = [first]
-                    elif isinstance(tables, dict) and len(tables) > 0:
-                        for v in tables.values():
-                            if isinstance(v, pd.DataFrame):
-                                table_rows = v.to_dict(orient="records")
-                                break
-                            elif isinstance(v, list):
-                                table_rows = v
-                                break
-                            elif isinstance(v, dict):
-                                table_rows = [v]
-                                break
-                except Exception:
-                    table_rows = None
-                if table_rows is not None:
-                    result["table"] = table_rows
+                candidates = []
+                if isinstance(tables, list):
+                    candidates = tables[:1]
+                elif isinstance(tables, dict):
+                    candidates = list(tables.values())
+                for first in candidates:
+                    coerce = _dispatch(_TABLE_COERCERS, first)
+                    if coerce is not None:
+                        # DataFrames take the top-level path: large frames go out as Arrow
+                        try:
+                            result.update(coerce(first, arrow_out_dir))
+                        except Exception:
+                            pass
+                        break
 
             # charts -> chartData (choose first chart-like dict)
             if "chartData" not in result and "charts" in result:
                 charts = result.get("charts")
-                chosen = None
-                if isinstance(charts, dict):
-                    chosen = charts
-                elif isinstance(charts, list) and len(charts) > 0:
-                    chosen = charts[0]
+                pick = _dispatch(_CHART_PICKERS, charts)
+                chosen = pick(charts) if pick is not None else None
                 if isinstance(chosen, dict):
                     result["chartData"] = chosen
 
         # Ensure required keys
-        result.setdefault(
-            "table", df.head(int(ctx.get("row_limit", 200))).to_dict(orient="records")
-        )
-        result.setdefault("metrics", {"rows": len(df), "columns": len(df.columns)})
-        result.setdefault("chartData", {})
+        if "table" not in result and "table_arrow_path" not in result:
+            result["table"] = _df_to_records_safe(_whole_df(), int(ctx.get("row_limit", 200)))
+        if "metrics" not in result:
+            result["metrics"] = {"rows": len(df), "columns": len(_whole_df().columns)}
+        if "chartData" not in result:
+            result["chartData"] = {}
 
-        sanitized = sanitize_for_json(result)
-        print(json.dumps(sanitized, ensure_ascii=False))
-        return 0
+        # Tables built here are already NaN-free and _write_result maps any remaining NaN/Inf
+        # to null, so no recursive sanitize pass over the result
+        return result
 
     except _TimeoutException:
         output = {
@@ -355,8 +690,7 @@ def main() -> int:
             "chartData": {},
             "error": f"Execution timed out after {CODE_TIMEOUT}s.",
         }
-        print(json.dumps(output, ensure_ascii=False))
-        return 0
+        return output
 
     except Exception as e:
         tb = traceback.format_exc(limit=8)
@@ -367,13 +701,84 @@ def main() -> int:
             "error": f"Runtime error: {e}",
             "traceback": tb,
         }
-        print(json.dumps(output, ensure_ascii=False))
-        return 0
+        return output
 
     finally:
         signal.alarm(0)
-        signal.signal(signal.SIGALRM, old_handler)
+
+
+def _serve_job(conn: socket.socket, data_fds: list[int]) -> None:
+    """Runs the job read from `conn` (until EOF) and sends the JSON result back on it.
+
+    `data_fds` are the descriptors sent along with the job socket; "parquet_fd" jobs read
+    their dataset from the first one.
+    """
+    chunks = []
+    while chunk := conn.recv(1 << 16):
+        chunks.append(chunk)
+    payload = _parse_payload(b"".join(chunks))
+    del chunks  # the raw job bytes are not needed once parsed
+    if payload.pop("parquet_fd", False) and data_fds:
+        payload["parquet_path"] = f"/proc/self/fd/{data_fds[0]}"
+    sys.stdout = open(os.devnull, "w")  # user prints must not reach the orchestrator's logs
+    result = handle(payload)
+    with conn.makefile("wb") as out:
+        _write_result(result, out)
+    conn.close()
+
+
+def serve_forks(control_fd: int, idle_seconds: float = 0) -> None:
+    """Fork-server loop: forks one single-use child per job socket received on `control_fd`.
+
+    This process has already paid for every import, so a child starts its job in
+    milliseconds. It never runs user code itself, so each child starts from a clean copy;
+    the child first sends its pid on the job socket so the orchestrator can kill it on
+    timeout. Exits after `idle_seconds` (if > 0) without a job, giving its memory back.
+    """
+    control = socket.socket(fileno=control_fd)
+    control.settimeout(idle_seconds if idle_seconds > 0 else None)
+    for module in _PLOTTING_MODULES:
+        importlib.import_module(module)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # the kernel reaps finished children
+    while True:
+        try:
+            _, fds, _, _ = socket.recv_fds(control, 1, 2)  # job socket (+ dataset memfd)
+        except OSError:  # idle timeout included
+            return
+        if not fds:
+            return  # orchestrator went away
+        pid = os.fork()
+        if pid == 0:
+            control.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            status = 1
+            try:
+                conn = socket.socket(fileno=fds[0])
+                conn.sendall(os.getpid().to_bytes(4, "little"))
+                _serve_job(conn, fds[1:])
+                status = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        for fd in fds:
+            os.close(fd)
+
+
+def main() -> int:
+    # Step 1: Read payload
+    try:
+        payload = _parse_payload(sys.stdin.buffer.read())
+    except Exception as e:
+        sys.stderr.write(f"Invalid input payload: {e}\n")
+        return 1
+
+    _emit(handle(payload))
+    return 0
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["--fork-server"]:
+        serve_forks(int(sys.argv[2]), float(sys.argv[3]) if len(sys.argv) > 3 else 0)
+        raise SystemExit(0)
     raise SystemExit(main())
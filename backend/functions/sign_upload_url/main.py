@@ -1,34 +1,41 @@
 import os
-import json
-import uuid
+import base64
+import hashlib
+import threading
 from datetime import datetime, timedelta, timezone
 from typing import Tuple
 import time
 import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 
-from google.cloud import storage
-from google.cloud import firestore
 import google.auth
-from google.auth import impersonated_credentials
+from google.auth import exceptions as auth_exceptions
+from google.auth import iam
 import google.auth.transport.requests
+from requests.adapters import HTTPAdapter
 import firebase_admin
 from firebase_admin import auth as fb_auth
+from flask import Response
+import orjson
 
 MAX_FILE_BYTES = 20 * 1024 * 1024  # 20 MB
 FILES_BUCKET = os.getenv("FILES_BUCKET", "ai-data-analyser-files")
 PROJECT_ID = os.getenv("GCP_PROJECT", os.getenv("GOOGLE_CLOUD_PROJECT", "ai-data-analyser"))
 TTL_DAYS = int(os.getenv("TTL_DAYS", "1"))
+_TTL_DELTA = timedelta(days=TTL_DAYS)
+URL_EXPIRES_SECONDS = 15 * 60
 RUNTIME_SERVICE_ACCOUNT = os.getenv("RUNTIME_SERVICE_ACCOUNT")
-SIGNING_CREDS_TTL_SECONDS = int(os.getenv("SIGNING_CREDS_TTL_SECONDS", "3300"))  # ~55m
+DOC_WRITE_TIMEOUT_SECONDS = float(os.getenv("DOC_WRITE_TIMEOUT_SECONDS", "10"))
 
-ALLOWED_ORIGINS = {
+ALLOWED_ORIGINS = frozenset(
     o.strip()
     for o in re.split(r'[,;]', os.getenv(
         "ALLOWED_ORIGINS",
         "http://localhost:5173,https://ai-data-analyser.web.app,https://ai-data-analyser.firebaseapp.com",
     ) or "")
     if o.strip()
-}
+)
 
 ALLOWED_MIME = {
     "text/csv": ".csv",
@@ -37,53 +44,212 @@ ALLOWED_MIME = {
 }
 ALLOWED_EXT = {".csv", ".xls", ".xlsx"}
 
+# Response pieces that never change, built once (Flask copies the header dicts)
+_JSON_HEADERS = {"Content-Type": "application/json"}
+_PREFLIGHT_HEADERS = {
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type, content-type, Authorization, authorization, X-Session-Id, x-session-id",
+    "Access-Control-Max-Age": "3600",
+}
+_PREFLIGHT_FORBIDDEN = ("Origin not allowed", 403, {"Content-Type": "text/plain"})
+_ERR_ORIGIN = (orjson.dumps({"error": "origin not allowed"}), 403, _JSON_HEADERS)
+_ERR_MISSING_TOKEN = (orjson.dumps({"error": "missing Authorization Bearer token"}), 401, _JSON_HEADERS)
+_ERR_MISSING_SID = (orjson.dumps({"error": "Missing X-Session-Id header"}), 400, _JSON_HEADERS)
+_ERR_MISSING_ARGS = (orjson.dumps({"error": "filename and type are required"}), 400, _JSON_HEADERS)
+_ERR_TOO_LARGE = (orjson.dumps({"error": "file too large (max 20MB)"}), 400, _JSON_HEADERS)
+_ERR_UNSUPPORTED_TYPE = (orjson.dumps({"error": "unsupported file type"}), 400, _JSON_HEADERS)
+
+
+# Allowed extensions keyed by the filename tail they end with (4 or 5 chars)
+_EXT_TAIL_4 = {".csv": ".csv", ".xls": ".xls"}
+_EXT_TAIL_5 = {".xlsx": ".xlsx"}
+
 
 def _ext_from_filename_or_type(filename: str, mime: str) -> str:
-    ext = os.path.splitext(filename)[1].lower() if filename else ""
-    if ext in ALLOWED_EXT:
-        return ext
-    return ALLOWED_MIME.get(mime, "")
+    ext = _EXT_TAIL_4.get(filename[-4:].lower()) or _EXT_TAIL_5.get(filename[-5:].lower())
+    return ext or ALLOWED_MIME.get(mime, "")
+
 
-def _origin_allowed(origin: str | None) -> bool:
-    if not origin:
-        return False
-    # Normalize the origin by removing any trailing slashes before checking
-    normalized_origin = origin.rstrip('/')
-    return normalized_origin in ALLOWED_ORIGINS
+# Verified ID tokens by hash, kept until shortly before they expire: repeat uploads in a
+# session skip the RSA verification (and any public-key refetch)
+_TOKEN_CACHE: dict[bytes, tuple[float, dict]] = {}
+_TOKEN_CACHE_MAX = 1024
+_TOKEN_CACHE_LOCK = threading.Lock()
 
 
-def _require_session_id(request) -> str:
-    sid = request.headers.get("X-Session-Id") or request.args.get("sessionId")
-    if not sid:
-        raise ValueError("Missing X-Session-Id header")
-    return sid
+def _verify_id_token(token: str) -> dict:
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    hit = _TOKEN_CACHE.get(key)
+    if hit is not None and time.time() < hit[0] - 30:
+        return hit[1]
+    decoded = fb_auth.verify_id_token(token)
+    with _TOKEN_CACHE_LOCK:
+        if len(_TOKEN_CACHE) >= _TOKEN_CACHE_MAX:
+            del _TOKEN_CACHE[next(iter(_TOKEN_CACHE))]  # oldest first
+        _TOKEN_CACHE[key] = (float(decoded.get("exp", 0)), decoded)
+    return decoded
 
 
-_CACHED_SIGNING_CREDS = None
-_CACHED_EXPIRES_AT = 0.0
+_IAM_SIGN_BLOB_URL = "https://iamcredentials.googleapis.com/v1/projects/-/serviceAccounts/{}:signBlob"
+_GCS_HOST = "storage.googleapis.com"
+_SIGNER_EMAIL = None
 
 
-def _impersonated_signing_credentials(sa_email: str):
-    global _CACHED_SIGNING_CREDS, _CACHED_EXPIRES_AT
-    now = time.time()
-    if _CACHED_SIGNING_CREDS is not None and now < _CACHED_EXPIRES_AT:
-        return _CACHED_SIGNING_CREDS
-    if not sa_email:
+def _signer_email() -> str:
+    """Service account whose key signs the URLs: the runtime SA, else the default one."""
+    global _SIGNER_EMAIL
+    if _SIGNER_EMAIL is None:
+        email = RUNTIME_SERVICE_ACCOUNT
+        if not email:
+            creds = _get_authed_session().credentials
+            if getattr(creds, "service_account_email", "default") == "default":
+                # Compute Engine credentials only learn their email on refresh
+                creds.refresh(google.auth.transport.requests.Request())
+            email = creds.service_account_email
+        _SIGNER_EMAIL = email
+    return _SIGNER_EMAIL
+
+
+def _sign_blob(sa_email: str, payload: bytes) -> bytes:
+    """Signs `payload` with the service account's Google-managed key (IAM signBlob)."""
+    body = {"payload": base64.b64encode(payload).decode("ascii")}
+    url = _IAM_SIGN_BLOB_URL.format(sa_email)
+    for _ in range(3):
+        resp = _get_authed_session().post(url, json=body, timeout=10)
+        if resp.status_code not in iam.IAM_RETRY_CODES:
+            break
+    if resp.status_code != 200:
+        raise auth_exceptions.TransportError(f"Error calling signBlob: {resp.text}")
+    return base64.b64decode(resp.json()["signedBlob"])
+
+
+def _v4_signed_put_url(sa_email: str, bucket: str, object_path: str, mime: str, now: datetime) -> str:
+    """Builds a V4 signed URL for uploading `object_path` with a PUT of type `mime`.
+
+    Follows the GCS V4 signing process (canonical request, string to sign, RSA-SHA256
+    via signBlob), which is all blob.generate_signed_url did for us, without loading
+    google-cloud-storage.
+    """
+    request_ts = now.strftime("%Y%m%dT%H%M%SZ")
+    scope = f"{request_ts[:8]}/auto/storage/goog4_request"
+    resource = f"/{bucket}/{quote(object_path, safe='/~')}"
+    # Already in sorted order, as the canonical query string requires
+    query = "&".join(f"{k}={quote(v, safe='~')}" for k, v in (
+        ("X-Goog-Algorithm", "GOOG4-RSA-SHA256"),
+        ("X-Goog-Credential", f"{sa_email}/{scope}"),
+        ("X-Goog-Date", request_ts),
+        ("X-Goog-Expires", str(URL_EXPIRES_SECONDS)),
+        ("X-Goog-SignedHeaders", "content-type;host"),
+    ))
+    canonical_request = (
+        f"PUT\n{resource}\n{query}\n"
+        f"content-type:{mime.strip()}\nhost:{_GCS_HOST}\n\n"
+        "content-type;host\nUNSIGNED-PAYLOAD"
+    )
+    string_to_sign = (
+        f"GOOG4-RSA-SHA256\n{request_ts}\n{scope}\n"
+        f"{hashlib.sha256(canonical_request.encode()).hexdigest()}"
+    )
+    signature = _sign_blob(sa_email, string_to_sign.encode()).hex()
+    return f"https://{_GCS_HOST}{resource}?{query}&X-Goog-Signature={signature}"
+
+
+_FS_CLIENT = None
+_FS_CLIENT_LOCK = threading.Lock()
+
+
+def _get_firestore():
+    global _FS_CLIENT
+    if _FS_CLIENT is None:
+        with _FS_CLIENT_LOCK:
+            if _FS_CLIENT is None:
+                # Imported here: the library is large and only backs the REST fallback
+                from google.cloud import firestore
+                _FS_CLIENT = firestore.Client(project=PROJECT_ID)
+    return _FS_CLIENT
+
+
+_FIRESTORE_DOC_URL = "https://firestore.googleapis.com/v1/projects/{project}/databases/(default)/documents/{path}"
+# Body of the awaiting_upload document write; only the URI and timestamps change per request
+_FS_DOC_TEMPLATE = (
+    '{{"fields":{{"status":{{"stringValue":"awaiting_upload"}},'
+    '"rawUri":{{"stringValue":{raw_uri}}},'
+    '"createdAt":{{"timestampValue":"{created}"}},'
+    '"updatedAt":{{"timestampValue":"{updated}"}},'
+    '"ttlAt":{{"timestampValue":"{ttl}"}}}}}}'
+)
+_FS_DOC_UPDATE_MASK = [
+    ("updateMask.fieldPaths", name) for name in ("status", "rawUri", "createdAt", "updatedAt", "ttlAt")
+]
+_AUTHED_SESSION = None
+
+
+def _get_authed_session():
+    """Shared keepalive session for the Firestore REST writes and IAM signBlob calls."""
+    global _AUTHED_SESSION
+    if _AUTHED_SESSION is None:
         creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-        _CACHED_SIGNING_CREDS = creds
-        _CACHED_EXPIRES_AT = now + SIGNING_CREDS_TTL_SECONDS
-        return _CACHED_SIGNING_CREDS
-    source_creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-    if getattr(source_creds, "token", None) is None:
-        source_creds.refresh(google.auth.transport.requests.Request())
-    _CACHED_SIGNING_CREDS = impersonated_credentials.Credentials(
-        source_credentials=source_creds,
-        target_principal=sa_email,
-        target_scopes=["https://www.googleapis.com/auth/cloud-platform"],
-        lifetime=3600,
+        session = google.auth.transport.requests.AuthorizedSession(creds)
+        # Sized for the request thread plus the doc-write executor
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, pool_block=False)
+        session.mount("https://", adapter)
+        _AUTHED_SESSION = session
+    return _AUTHED_SESSION
+
+
+def _rfc3339(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _check_doc_path(path: Tuple[str, ...]) -> None:
+    if any(not seg or "/" in seg for seg in path):
+        raise ValueError(f"Invalid document path: {'/'.join(path)}")
+
+
+def _firestore_rest_set(path: Tuple[str, ...], fields: dict) -> None:
+    """Merge-writes the awaiting_upload `fields` into the document at `path` with one REST PATCH.
+
+    Skips the gRPC channel set-up the client library pays on its first call; the update
+    mask limits the write to these fields, like set(..., merge=True). The body comes from
+    _FS_DOC_TEMPLATE, with the URI JSON-escaped since it embeds the client's session id.
+    """
+    _check_doc_path(path)
+    url = _FIRESTORE_DOC_URL.format(project=PROJECT_ID, path="/".join(quote(seg, safe="") for seg in path))
+    body = _FS_DOC_TEMPLATE.format(
+        raw_uri=orjson.dumps(fields["rawUri"]).decode(),
+        created=_rfc3339(fields["createdAt"]),
+        updated=_rfc3339(fields["updatedAt"]),
+        ttl=_rfc3339(fields["ttlAt"]),
+    )
+    resp = _get_authed_session().patch(
+        url,
+        params=_FS_DOC_UPDATE_MASK,
+        data=body.encode(),
+        headers=_JSON_HEADERS,
+        timeout=10,
     )
-    _CACHED_EXPIRES_AT = now + SIGNING_CREDS_TTL_SECONDS
-    return _CACHED_SIGNING_CREDS
+    resp.raise_for_status()
+
+
+def _write_dataset_doc(path: Tuple[str, ...], fields: dict) -> None:
+    try:
+        _firestore_rest_set(path, fields)
+    except ValueError:
+        raise
+    except Exception:
+        # REST write failed (e.g. endpoint unreachable): fall back to the client library
+        _get_firestore().document(*path).set(fields, merge=True)
+
+
+def _await_doc_write(fut) -> None:
+    try:
+        fut.result(timeout=DOC_WRITE_TIMEOUT_SECONDS)
+    except Exception as e:
+        print(f"awaiting_upload document write failed: {e}")
+
+
+# Runs the Firestore write while the request thread signs the URL
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sign-upload-io")
 
 
 try:
@@ -91,88 +257,87 @@ try:
 except ValueError:
     firebase_admin.initialize_app()
 
+# Build the session and resolve the signing account while the instance starts rather
+# than on a request; whatever fails here (e.g. credentials not available yet) is retried
+# on first use.
+for _init in (_get_authed_session, _signer_email):
+    try:
+        _init()
+    except Exception:
+        pass
+# The Firestore client (gapic/grpc imports) is only needed if a REST write fails, so it
+# loads in the background instead of on the cold-start path
+_FS_WARMUP = _EXECUTOR.submit(_get_firestore)
+
 
 def sign_upload_url(request):
     # --- DIAGNOSTIC LOGS START ---
     origin = request.headers.get("Origin") or ""
+    # Checked once per request; trailing slashes are ignored. "" is never in the set.
+    origin_ok = origin.rstrip("/") in ALLOWED_ORIGINS
     print("--- DIAGNOSTIC LOGS ---")
     print(f"Received Origin Header: '{origin}'")
     print(f"Parsed Allowed Origins Set: {ALLOWED_ORIGINS}")
-    print(f"Origin Check Result: {_origin_allowed(origin)}")
+    print(f"Origin Check Result: {origin_ok}")
     print("--- DIAGNOSTIC LOGS END ---")
     # --- DIAGNOSTIC LOGS END ---
     
     if request.method == "OPTIONS":
         # CORS preflight
-        if not _origin_allowed(origin):
-            return ("Origin not allowed", 403, {"Content-Type": "text/plain"})
-        headers = {
-            "Access-Control-Allow-Origin": origin,
-            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type, content-type, Authorization, authorization, X-Session-Id, x-session-id",
-            "Access-Control-Max-Age": "3600",
-        }
-        return ("", 204, headers)
+        if not origin_ok:
+            return _PREFLIGHT_FORBIDDEN
+        return ("", 204, {**_PREFLIGHT_HEADERS, "Access-Control-Allow-Origin": origin})
 
     try:
         # Origin allowlist
-        if not _origin_allowed(origin):
-            return (json.dumps({"error": "origin not allowed"}), 403, {"Content-Type": "application/json"})
+        if not origin_ok:
+            return _ERR_ORIGIN
 
         # ... (rest of the function is the same)
         auth_header = request.headers.get("Authorization", "")
         token = auth_header.split(" ", 1)[1] if auth_header.lower().startswith("bearer ") else None
         if not token:
-            return (json.dumps({"error": "missing Authorization Bearer token"}), 401, {"Content-Type": "application/json"})
+            return _ERR_MISSING_TOKEN
         try:
-            decoded = fb_auth.verify_id_token(token)
+            decoded = _verify_id_token(token)
             uid = decoded.get("uid")
         except Exception as e:
-            return (json.dumps({"error": "invalid token", "detail": str(e)[:200]}), 401, {"Content-Type": "application/json"})
+            return (orjson.dumps({"error": "invalid token", "detail": str(e)[:200]}), 401, _JSON_HEADERS)
 
-        sid = _require_session_id(request)
+        sid = request.headers.get("X-Session-Id") or request.args.get("sessionId")
+        if not sid:
+            return _ERR_MISSING_SID
         filename = request.args.get("filename", "")
         size = int(request.args.get("size", "0"))
         mime = request.args.get("type", "")
 
         if not filename or not mime:
-            return (json.dumps({"error": "filename and type are required"}), 400, {"Content-Type": "application/json"})
+            return _ERR_MISSING_ARGS
         if size <= 0 or size > MAX_FILE_BYTES:
-            return (json.dumps({"error": "file too large (max 20MB)"}), 400, {"Content-Type": "application/json"})
+            return _ERR_TOO_LARGE
 
         ext = _ext_from_filename_or_type(filename, mime)
         if ext not in ALLOWED_EXT:
-            return (json.dumps({"error": "unsupported file type"}), 400, {"Content-Type": "application/json"})
+            return _ERR_UNSUPPORTED_TYPE
 
-        dataset_id = str(uuid.uuid4())
+        dataset_id = os.urandom(16).hex()
         object_path = f"users/{uid}/sessions/{sid}/datasets/{dataset_id}/raw/input{ext}"
 
-        storage_client = storage.Client(project=PROJECT_ID)
-        bucket = storage_client.bucket(FILES_BUCKET)
-        blob = bucket.blob(object_path)
-
-        signing_creds = _impersonated_signing_credentials(RUNTIME_SERVICE_ACCOUNT)
-
-        url = blob.generate_signed_url(
-            version="v4",
-            expiration=timedelta(minutes=15),
-            method="PUT",
-            content_type=mime,
-            credentials=signing_creds,
-        )
-
-        fs = firestore.Client(project=PROJECT_ID)
-        ttl_at = datetime.now(timezone.utc) + timedelta(days=TTL_DAYS)
-        fs.document("users", uid, "sessions", sid, "datasets", dataset_id).set(
-            {
-                "status": "awaiting_upload",
-                "rawUri": f"gs://{FILES_BUCKET}/{object_path}",
-                "createdAt": datetime.now(timezone.utc),
-                "updatedAt": datetime.now(timezone.utc),
-                "ttlAt": ttl_at,
-            },
-            merge=True,
-        )
+        now = datetime.now(timezone.utc)
+        doc_path = ("users", uid, "sessions", sid, "datasets", dataset_id)
+        doc_fields = {
+            "status": "awaiting_upload",
+            "rawUri": f"gs://{FILES_BUCKET}/{object_path}",
+            "createdAt": now,
+            "updatedAt": now,
+            "ttlAt": now + _TTL_DELTA,
+        }
+        _check_doc_path(doc_path)
+        # The document only helps the UI, so the URL does not wait for it: the write runs
+        # alongside the signing and is awaited once the response has been sent
+        doc_write = _EXECUTOR.submit(_write_dataset_doc, doc_path, doc_fields)
+
+        url = _v4_signed_put_url(_signer_email(), FILES_BUCKET, object_path, mime, now)
 
         resp = {
             "url": url,
@@ -183,9 +348,13 @@ def sign_upload_url(request):
             "Content-Type": "application/json",
             "Access-Control-Allow-Origin": origin,
         }
-        return (json.dumps(resp), 200, headers)
+        response = Response(orjson.dumps(resp), status=200, headers=headers)
+        # Finish the write while the request is still open, so the instance is not
+        # throttled or frozen with it in flight
+        response.call_on_close(lambda: _await_doc_write(doc_write))
+        return response
 
     except ValueError as ve:
-        return (json.dumps({"error": str(ve)}), 400, {"Content-Type": "application/json"})
+        return (orjson.dumps({"error": str(ve)}), 400, _JSON_HEADERS)
     except Exception as e:
-        return (json.dumps({"error": "internal error", "detail": str(e)[:500]}), 500, {"Content-Type": "application/json"})
\ No newline at end of file
+        return (orjson.dumps({"error": "internal error", "detail": str(e)[:500]}), 500, _JSON_HEADERS)
\ No newline at end of file
@@ -7,8 +7,11 @@ import pytest
 from flask import Request
 from werkzeug.datastructures import Headers
 
-# Import the module to be tested
-import main
+# Import the module to be tested, without building real clients (credential discovery
+# is slow off GCP)
+with patch("google.cloud.firestore.Client"), \
+        patch("google.auth.default", return_value=(MagicMock(), "test-project")):
+    import main
 
 @pytest.fixture(autouse=True)
 def setup_and_reload_main(monkeypatch):
@@ -17,7 +20,15 @@ def setup_and_reload_main(monkeypatch):
     monkeypatch.setenv("GCP_PROJECT", "test-project")
     monkeypatch.setenv("ALLOWED_ORIGINS", "http://localhost:5173,https://ai-data-analyser.web.app")
     monkeypatch.setenv("RUNTIME_SERVICE_ACCOUNT", "test-sa@example.com")
-    importlib.reload(main)
+    # Stub the clients and credentials built at import (no credential discovery), then
+    # drop them so each test's patches are the ones used
+    with patch("google.cloud.firestore.Client"), \
+            patch("google.auth.default", return_value=(MagicMock(), "test-project")):
+        importlib.reload(main)
+        main._FS_WARMUP.result()
+    monkeypatch.setattr(main, "_FS_CLIENT", None)
+    monkeypatch.setattr(main, "_AUTHED_SESSION", MagicMock())  # Firestore REST writes, signBlob
+    monkeypatch.setattr(main, "_SIGNER_EMAIL", None)
 
 @pytest.fixture
 def mock_request():
@@ -36,25 +47,17 @@ def mock_request():
         return req
     return _mock_request
 
-@patch("main.storage.Client")
-@patch("main.firestore.Client")
+@patch("google.cloud.firestore.Client")
 @patch("main.fb_auth.verify_id_token")
-@patch("main._impersonated_signing_credentials")
+@patch("main._sign_blob", return_value=b"sig")
 def test_sign_upload_url_happy_path(
-    mock_creds, mock_verify_id_token, mock_firestore_client, mock_storage_client, mock_request
+    mock_sign_blob, mock_verify_id_token, mock_firestore_client, mock_request
 ):
     """
     Tests the happy path for the sign_upload_url function.
     """
     # Arrange: Set up mocks
     mock_verify_id_token.return_value = {"uid": "test-uid"}
-    mock_creds.return_value = "mock-credentials"
-
-    mock_blob = MagicMock()
-    mock_blob.generate_signed_url.return_value = "https://signed.url/for/upload"
-    mock_bucket = MagicMock()
-    mock_bucket.blob.return_value = mock_blob
-    mock_storage_client.return_value.bucket.return_value = mock_bucket
 
     mock_fs_doc = MagicMock()
     mock_firestore_client.return_value.document.return_value = mock_fs_doc
@@ -74,7 +77,9 @@ def test_sign_upload_url_happy_path(
     )
 
     # Act: Call the function
-    response_body, status_code, headers = main.sign_upload_url(req)
+    response = main.sign_upload_url(req)
+    response.close()  # awaits the deferred Firestore write
+    response_body, status_code, headers = response.get_data(as_text=True), response.status_code, response.headers
 
     # Assert: Check the response
     assert status_code == 200
@@ -82,23 +87,239 @@ def test_sign_upload_url_happy_path(
     assert headers["Access-Control-Allow-Origin"] == "http://localhost:5173"
 
     response_data = json.loads(response_body)
-    assert response_data["url"] == "https://signed.url/for/upload"
+    assert response_data["url"].startswith(
+        "https://storage.googleapis.com/test-bucket/" + response_data["storagePath"] + "?X-Goog-Algorithm=GOOG4-RSA-SHA256"
+        "&X-Goog-Credential=test-sa%40example.com%2F"
+    )
+    assert "&X-Goog-Expires=900&X-Goog-SignedHeaders=content-type%3Bhost&" in response_data["url"]
+    assert response_data["url"].endswith("&X-Goog-Signature=" + b"sig".hex())
     assert "datasetId" in response_data
     assert response_data["storagePath"].startswith("users/test-uid/sessions/test-session-id/datasets/")
     assert response_data["storagePath"].endswith("/raw/input.csv")
 
     # Assert: Check that external services were called correctly
     mock_verify_id_token.assert_called_once_with("valid-token")
-    mock_storage_client.return_value.bucket.assert_called_once_with("test-bucket")
-    mock_bucket.blob.assert_called_once()
-    mock_blob.generate_signed_url.assert_called_once()
-    mock_firestore_client.return_value.document.assert_called_once()
-    mock_fs_doc.set.assert_called_once()
+    sa_email, string_to_sign = mock_sign_blob.call_args[0]
+    assert sa_email == "test-sa@example.com"
+    assert string_to_sign.startswith(b"GOOG4-RSA-SHA256\n")
+    mock_firestore_client.assert_not_called()  # written over REST, no gRPC client
+    main._AUTHED_SESSION.patch.assert_called_once()
+
+    # Check that the Firestore document has the correct path and status
+    url = main._AUTHED_SESSION.patch.call_args[0][0]
+    assert url == (
+        "https://firestore.googleapis.com/v1/projects/test-project/databases/(default)/documents/"
+        f"users/test-uid/sessions/test-session-id/datasets/{response_data['datasetId']}"
+    )
+    kwargs = main._AUTHED_SESSION.patch.call_args[1]
+    fields = json.loads(kwargs["data"])["fields"]
+    assert fields["status"] == {"stringValue": "awaiting_upload"}
+    assert fields["rawUri"]["stringValue"].startswith("gs://test-bucket/users/test-uid/")
+    assert fields["ttlAt"]["timestampValue"].endswith("Z")
+    assert sorted(v for _, v in kwargs["params"]) == sorted(fields)
+
+    assert fields["createdAt"] == fields["updatedAt"]
+
+
+def test_firestore_rest_body_escapes_the_uri():
+    """
+    Tests that the templated REST body stays valid JSON whatever the session id holds.
+    """
+    from datetime import datetime, timezone
+    now = datetime(2026, 1, 2, 3, 4, 5, 6000, tzinfo=timezone.utc)
+    uri = 'gs://test-bucket/users/u/sessions/a"b\\c/raw/input.csv'
+    main._firestore_rest_set(("users", "u", "sessions", 'a"b', "datasets", "d"), {
+        "status": "awaiting_upload", "rawUri": uri, "createdAt": now, "updatedAt": now, "ttlAt": now,
+    })
+
+    fields = json.loads(main._AUTHED_SESSION.patch.call_args[1]["data"])["fields"]
+    assert fields["rawUri"] == {"stringValue": uri}
+    assert fields["ttlAt"] == {"timestampValue": "2026-01-02T03:04:05.006000Z"}
+
+@patch("google.cloud.firestore.Client")
+@patch("main.fb_auth.verify_id_token")
+@patch("main._sign_blob", return_value=b"sig")
+def test_sign_upload_url_falls_back_to_firestore_client(
+    mock_sign_blob, mock_verify_id_token, mock_firestore_client, mock_request
+):
+    """
+    Tests that a failed REST write is retried through the Firestore client library.
+    """
+    mock_verify_id_token.return_value = {"uid": "test-uid"}
+    main._AUTHED_SESSION.patch.side_effect = ConnectionError("unreachable")
+    req = mock_request(
+        headers={
+            "Origin": "http://localhost:5173",
+            "Authorization": "Bearer valid-token",
+            "X-Session-Id": "test-session-id",
+        },
+        args={"filename": "a.csv", "size": "100", "type": "text/csv"},
+    )
+
+    response = main.sign_upload_url(req)
+    response.close()
+
+    assert response.status_code == 200
+    doc = mock_firestore_client.return_value.document
+    assert doc.call_args[0][:4] == ("users", "test-uid", "sessions", "test-session-id")
+    assert doc.return_value.set.call_args[0][0]["status"] == "awaiting_upload"
+    assert doc.return_value.set.call_args[1] == {"merge": True}
+
+
+@patch("google.cloud.firestore.Client")
+@patch("main.fb_auth.verify_id_token")
+@patch("main._sign_blob", return_value=b"sig")
+def test_sign_upload_url_reuses_clients(
+    mock_sign_blob, mock_verify_id_token, mock_firestore_client, mock_request
+):
+    """
+    Tests that requests share the signing account and write Firestore over REST, without
+    building a client library.
+    """
+    mock_verify_id_token.return_value = {"uid": "test-uid"}
+    req = mock_request(
+        headers={
+            "Origin": "http://localhost:5173",
+            "Authorization": "Bearer valid-token",
+            "X-Session-Id": "test-session-id",
+        },
+        args={"filename": "a.csv", "size": "100", "type": "text/csv"},
+    )
+
+    for _ in range(2):
+        response = main.sign_upload_url(req)
+        response.close()
+        assert response.status_code == 200
+
+    mock_firestore_client.assert_not_called()
+    assert main._AUTHED_SESSION.patch.call_count == 2
+    assert [c[0][0] for c in mock_sign_blob.call_args_list] == ["test-sa@example.com"] * 2
+
+
+@patch("main._sign_blob")
+@patch("main.fb_auth.verify_id_token")
+def test_sign_upload_url_overlaps_firestore_write_and_signing(
+    mock_verify_id_token, mock_sign_blob, mock_request
+):
+    """
+    Tests that the Firestore write runs while the URL is being signed.
+    """
+    import threading
+    write_started = threading.Event()
+
+    def _patch(*args, **kwargs):
+        write_started.set()
+        return MagicMock()
+
+    main._AUTHED_SESSION.patch.side_effect = _patch
+
+    def _sign(sa_email, payload):
+        assert write_started.wait(5), "Firestore write did not start while signing"
+        return b"sig"
+
+    mock_verify_id_token.return_value = {"uid": "test-uid"}
+    mock_sign_blob.side_effect = _sign
+    req = mock_request(
+        headers={
+            "Origin": "http://localhost:5173",
+            "Authorization": "Bearer valid-token",
+            "X-Session-Id": "test-session-id",
+        },
+        args={"filename": "a.csv", "size": "100", "type": "text/csv"},
+    )
 
-    # Check that the Firestore document has the correct status
-    firestore_call_args = mock_fs_doc.set.call_args[0][0]
-    assert firestore_call_args["status"] == "awaiting_upload"
-    assert firestore_call_args["rawUri"].startswith("gs://test-bucket/users/test-uid/")
+    response = main.sign_upload_url(req)
+    response.close()
+    assert response.status_code == 200
+
+
+@patch("main.fb_auth.verify_id_token")
+@patch("main._sign_blob", return_value=b"sig")
+def test_sign_upload_url_responds_before_firestore_write_finishes(
+    mock_sign_blob, mock_verify_id_token, mock_request
+):
+    """
+    Tests that the signed URL is returned without waiting for the Firestore write, which
+    is awaited when the response closes.
+    """
+    import threading
+    release = threading.Event()
+    finished = threading.Event()
+
+    def _patch(*args, **kwargs):
+        release.wait(5)
+        finished.set()
+        return MagicMock()
+
+    main._AUTHED_SESSION.patch.side_effect = _patch
+    mock_verify_id_token.return_value = {"uid": "test-uid"}
+    req = mock_request(
+        headers={
+            "Origin": "http://localhost:5173",
+            "Authorization": "Bearer valid-token",
+            "X-Session-Id": "test-session-id",
+        },
+        args={"filename": "a.csv", "size": "100", "type": "text/csv"},
+    )
+
+    response = main.sign_upload_url(req)
+    assert response.status_code == 200 and not finished.is_set()
+    release.set()
+    response.close()
+    assert finished.is_set()
+
+
+@patch("main.fb_auth.verify_id_token")
+def test_verified_tokens_are_cached_until_expiry(mock_verify_id_token):
+    """
+    Tests that a verified token is reused until shortly before its exp claim.
+    """
+    import time
+    mock_verify_id_token.return_value = {"uid": "test-uid", "exp": time.time() + 3600}
+    assert main._verify_id_token("tok")["uid"] == "test-uid"
+    assert main._verify_id_token("tok")["uid"] == "test-uid"
+    assert mock_verify_id_token.call_count == 1
+
+    mock_verify_id_token.return_value = {"uid": "other", "exp": time.time() + 10}
+    main._verify_id_token("tok2")
+    main._verify_id_token("tok2")  # inside the expiry margin: verified again
+    assert mock_verify_id_token.call_count == 3
+
+
+def test_signing_account_is_resolved_at_import(monkeypatch):
+    """
+    Tests that importing the module builds the session and resolves the signing account
+    (the default credentials' one when no runtime account is set).
+    """
+    monkeypatch.delenv("RUNTIME_SERVICE_ACCOUNT")
+    creds = MagicMock(service_account_email="default-sa@example.com")
+    with patch("google.cloud.firestore.Client"), \
+            patch("google.auth.default", return_value=(creds, "test-project")) as mock_default:
+        importlib.reload(main)
+        main._FS_WARMUP.result()
+        calls_at_import = mock_default.call_count
+        email = main._signer_email()
+
+    assert calls_at_import >= 1 and mock_default.call_count == calls_at_import
+    assert email == main._SIGNER_EMAIL == "default-sa@example.com"
+
+
+def test_sign_blob_reuses_the_shared_session():
+    """
+    Tests that signBlob calls go through the shared keepalive session, retrying 5xx.
+    """
+    ok = MagicMock(status_code=200)
+    ok.json.return_value = {"signedBlob": "c2ln"}
+    main._AUTHED_SESSION.post.side_effect = [MagicMock(status_code=503), ok, ok]
+
+    assert main._sign_blob("test-sa@example.com", b"a") == b"sig"
+    assert main._sign_blob("test-sa@example.com", b"b") == b"sig"
+
+    assert main._AUTHED_SESSION.post.call_count == 3
+    assert main._AUTHED_SESSION.post.call_args[0][0] == (
+        "https://iamcredentials.googleapis.com/v1/projects/-/serviceAccounts/test-sa@example.com:signBlob"
+    )
+    assert main._AUTHED_SESSION.post.call_args[1]["json"] == {"payload": "Yg=="}
 
 
 def test_sign_upload_url_invalid_origin(mock_request):
@@ -190,6 +411,28 @@ def test_sign_upload_url_missing_session_id(mock_verify_id_token, mock_request):
     assert response_data["error"] == "Missing X-Session-Id header"
 
 
+@patch("main.fb_auth.verify_id_token")
+def test_sign_upload_url_rejects_session_id_with_slash(mock_verify_id_token, mock_request):
+    """
+    Tests that a session ID that would break the document path is rejected before any write.
+    """
+    mock_verify_id_token.return_value = {"uid": "test-uid"}
+    req = mock_request(
+        headers={
+            "Origin": "http://localhost:5173",
+            "Authorization": "Bearer valid-token",
+            "X-Session-Id": "a/b",
+        },
+        args={"filename": "a.csv", "size": "100", "type": "text/csv"},
+    )
+
+    response_body, status_code, _ = main.sign_upload_url(req)
+
+    assert status_code == 400
+    assert json.loads(response_body)["error"].startswith("Invalid document path")
+    main._AUTHED_SESSION.patch.assert_not_called()
+
+
 @patch("main.fb_auth.verify_id_token")
 @pytest.mark.parametrize("args", [
     {"size": "100", "type": "text/csv"},
@@ -275,15 +518,31 @@ def test_sign_upload_url_unsupported_type(mock_verify_id_token, mock_request):
     response_data = json.loads(response_body)
     assert response_data["error"] == "unsupported file type"
 
-@patch("main.storage.Client")
+
+@pytest.mark.parametrize("filename,mime,expected", [
+    ("data.CSV", "", ".csv"),
+    ("book.xls", "", ".xls"),
+    ("Book.XLSX", "text/plain", ".xlsx"),
+    ("noext", "text/csv", ".csv"),
+    ("data.txt", "application/vnd.ms-excel", ".xls"),
+    ("data.txt", "text/plain", ""),
+])
+def test_ext_from_filename_or_type(filename, mime, expected):
+    """
+    Tests that the extension comes from the filename tail, then the MIME type.
+    """
+    assert main._ext_from_filename_or_type(filename, mime) == expected
+
+
+@patch("main._sign_blob")
 @patch("main.fb_auth.verify_id_token")
-def test_sign_upload_url_storage_error(mock_verify_id_token, mock_storage_client, mock_request):
+def test_sign_upload_url_signing_error(mock_verify_id_token, mock_sign_blob, mock_request):
     """
-    Tests that an internal server error is returned if Cloud Storage fails.
+    Tests that an internal server error is returned if the URL cannot be signed.
     """
     # Arrange
     mock_verify_id_token.return_value = {"uid": "test-uid"}
-    mock_storage_client.side_effect = Exception("Storage is down")
+    mock_sign_blob.side_effect = Exception("IAM is down")
     req = mock_request(
         headers={
             "Origin": "http://localhost:5173",
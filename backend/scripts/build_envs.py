@@ -36,7 +36,7 @@ ALLOWED_ENV_KEYS = {
     "GCP_PROJECT","FILES_BUCKET","RUNTIME_SERVICE_ACCOUNT",
     # Timeouts/limits
     "SSE_PING_INTERVAL_SECONDS","CHAT_HARD_TIMEOUT_SECONDS","CHAT_REPAIR_TIMEOUT_SECONDS",
-    "CODEGEN_TIMEOUT_SECONDS","CLASSIFIER_TIMEOUT_SECONDS","MAX_FASTPATH_ROWS",
+    "CODEGEN_TIMEOUT_SECONDS","CLASSIFIER_TIMEOUT_SECONDS","TITLE_WAIT_SECONDS","MAX_FASTPATH_ROWS",
     "FORCE_FALLBACK_MIN_ROWS","MAX_CHART_POINTS",
     # Flags/Router/UI
     "FASTPATH_ENABLED","FALLBACK_ENABLED","CODE_RECONSTRUCT_ENABLED",
@@ -46,7 +46,8 @@ ALLOWED_ENV_KEYS = {
     "GEMINI_MODEL_NAME","GEMINI_MAX_TOKENS","GEMINI_TEMPERATURE","CLASSIFIER_TEMPERATURE","GEMINI_FUSED",
     "CLASSIFIER_MODEL_OVERRIDE","PRESENTATIONAL_CODE_TEMPERATURE",
     # Worker/Sandbox
-    "CODE_TIMEOUT","CODE_MAX_MEMORY_BYTES","SANDBOX_MODE",
+    "CODE_TIMEOUT","CODE_MAX_MEMORY_BYTES","SANDBOX_MODE","PYARROW_MEMORY_MAP",
+    "WORKER_FORK_SERVER","WORKER_FORK_SERVER_IDLE_SECONDS",
     # Embedding router
     "EMBED_ROUTER_ENABLED","EMBED_MODEL","EMBED_TIMEOUT_SECONDS","EMBED_THRESHOLD_DEFAULT",
 }
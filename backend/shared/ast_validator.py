@@ -64,26 +64,27 @@ class _Validator(ast.NodeVisitor):
         super().__init__()
         self.allowlist = set(allowlist)
         self.errors: list[str] = []
-
-    def _err(self, msg: str) -> None:
-        self.errors.append(msg)
+        # Bound list.append: visitors call self._err(msg) without a Python-level frame
+        self._err = self.errors.append
 
     # Imports
     def visit_Import(self, node: ast.Import) -> None:  # noqa: N802
         for alias in node.names:
-            name = (alias.asname or alias.name).split(".")[0]
+            raw = alias.asname or alias.name
+            name = raw.partition(".")[0]
             if not any(name == a or name.startswith(a + ".") for a in self.allowlist):
                 self._err(f"Import not allowed: {alias.name}")
-            if any(name == p or name.startswith(p + ".") for p in FORBIDDEN_MODULE_PREFIXES):
+            # Every forbidden prefix is a top-level module, so the root decides
+            if name in FORBIDDEN_MODULE_PREFIXES:
                 self._err(f"Forbidden import: {alias.name}")
         self.generic_visit(node)
 
     def visit_ImportFrom(self, node: ast.ImportFrom) -> None:  # noqa: N802
         mod = node.module or ""
-        root = mod.split(".")[0]
+        root = mod.partition(".")[0]
         if not any(root == a or root.startswith(a + ".") for a in self.allowlist):
             self._err(f"Import from not allowed: {mod}")
-        if any(root == p or root.startswith(p + ".") for p in FORBIDDEN_MODULE_PREFIXES):
+        if root in FORBIDDEN_MODULE_PREFIXES:
             self._err(f"Forbidden import from: {mod}")
         self.generic_visit(node)
 
@@ -103,9 +104,9 @@ class _Validator(ast.NodeVisitor):
 
     # Name access
     def visit_Name(self, node: ast.Name) -> None:  # noqa: N802
+        # Leaf: the only child is the Load/Store/Del context, so no generic_visit
         if node.id.startswith("__") and node.id.endswith("__"):
             self._err("Use of dunder names is not allowed")
-        self.generic_visit(node)
 
 
 def validate(code: str, allowlist: Iterable[str] = ALLOWED_IMPORTS_FAST) -> tuple[bool, list[str]]: